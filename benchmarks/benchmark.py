@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Benchmarks of the main workflows of py-confluence against the in-process fake server
+
+For every workflow the number of requests (per operation and by endpoint), the wall time, the throughput and the peak
+memory allocated by Python are reported. Results can be saved and compared with a saved baseline; the comparison fails
+if a workflow needs more requests per operation, or more than --tolerance more time or memory, than the baseline.
+
+    python benchmarks/benchmark.py --latency 0.005 --save baseline.json
+    python benchmarks/benchmark.py --latency 0.005 --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from confluence.fakeserver import FakeConfluence  # noqa: E402
+
+
+def publish(fake, confluence, operations):
+    from confluence.bytesIO import BytesIO
+    from confluence.content import Page
+    for number in range(operations):
+        page = Page(confluence, spacekey='DEMO', title='Published ' + str(number), body='<p>Benchmark</p>',
+                    labels='benchmark', attachments=[BytesIO(b'benchmark', file_name='published.txt')])
+        page.publish()
+
+
+def update(fake, confluence, operations):
+    from confluence.content import Page
+    content_id = confluence.create_page('DEMO', 'Updated', '<p>Version 1</p>')['id']
+    fake.reset_counts()
+    page = Page(confluence, content_id=content_id)
+    page.attachments = []
+    for number in range(operations):
+        page.body = '<p>Version ' + str(number + 2) + '</p>'
+        page.update()
+
+
+def attach(fake, confluence, operations):
+    from confluence.bytesIO import BytesIO
+    content_id = confluence.create_page('DEMO', 'Attached', '<p>Attachments</p>')['id']
+    fake.reset_counts()
+    for number in range(operations):
+        confluence.attach_file_to_content_by_id_with_macro(BytesIO(b'benchmark', file_name='file' + str(number)),
+                                                           content_id, 'page', 'Attached')
+
+
+def clone_space(fake, confluence, operations):
+    from confluence import clone
+    from confluence.rpc import XmlRpcServer
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for number in range(operations):
+                srv = XmlRpcServer(fake.url)
+                token = clone.auth('benchmark', 'benchmark', srv)
+                progress, = clone.cloneSpaces(srv, token, ['DEMO'], confluence=confluence)
+                if progress.status != 'ok':
+                    raise RuntimeError('clone failed: ' + progress.status)
+        finally:
+            os.chdir(cwd)
+
+
+WORKFLOWS = {'publish': publish, 'update': update, 'attach': attach, 'clone': clone_space}
+
+
+def run(name, args):
+    """Run workflow name against a new fake server and provide its measurements"""
+    from confluence.confluence import Confluence
+    with FakeConfluence(pages=args.pages, blogs=args.blogs, attachments=args.attachments,
+                        attachment_size=args.attachment_size, latency=args.latency) as fake:
+        confluence = Confluence('benchmark', 'benchmark', url=fake.url)
+        fake.reset_counts()
+        tracemalloc.start()
+        start = time.perf_counter()
+        # the workflows print progress messages, which are not part of the benchmark
+        with contextlib.redirect_stdout(io.StringIO()):
+            WORKFLOWS[name](fake, confluence, args.operations)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        counts = dict(fake.counts)
+    requests = sum(counts.values())
+    return {'operations': args.operations,
+            'seconds': seconds,
+            'operations_per_second': args.operations / seconds,
+            'requests': requests,
+            'requests_per_operation': requests / args.operations,
+            'peak_memory': peak,
+            'endpoints': counts}
+
+
+def report(results):
+    print('{:<10} {:>10} {:>10} {:>10} {:>12} {:>12}'.format('workflow', 'seconds', 'ops/s', 'requests', 'req/op',
+                                                            'peak KiB'))
+    for name, result in results.items():
+        print('{:<10} {:>10.3f} {:>10.2f} {:>10d} {:>12.1f} {:>12.0f}'.format(
+            name, result['seconds'], result['operations_per_second'], result['requests'],
+            result['requests_per_operation'], result['peak_memory'] / 1024.))
+    for name, result in results.items():
+        print('\n' + name + ': ' + ', '.join('{} {}'.format(endpoint, count)
+                                            for endpoint, count in sorted(result['endpoints'].items())))
+
+
+def compare(results, baseline, tolerance):
+    """Provide the list of regressions of results against baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result['requests_per_operation'] > old['requests_per_operation']:
+            regressions.append('{}: {:.1f} requests per operation instead of {:.1f}'.format(
+                name, result['requests_per_operation'], old['requests_per_operation']))
+        for key, unit in (('seconds', 's'), ('peak_memory', ' bytes')):
+            if result[key] > old[key] * (1 + tolerance):
+                regressions.append('{}: {} {:.6g}{} instead of {:.6g}{}'.format(name, key, result[key], unit,
+                                                                                old[key], unit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('workflows', nargs='*', default=sorted(WORKFLOWS),
+                        help='Workflows to benchmark, of ' + ', '.join(sorted(WORKFLOWS)) + ' [default: all]')
+    parser.add_argument('--operations', type=int, default=10, help='Operations per workflow [default: 10]')
+    parser.add_argument('--latency', type=float, default=0., help='Seconds every request is delayed [default: 0]')
+    parser.add_argument('--pages', type=int, default=50, help='Pages of the fake space [default: 50]')
+    parser.add_argument('--blogs', type=int, default=10, help='Blog posts of the fake space [default: 10]')
+    parser.add_argument('--attachments', type=int, default=1,
+                        help='Attachments of every page and blog post [default: 1]')
+    parser.add_argument('--attachment-size', dest='attachment_size', type=int, default=64 * 1024,
+                        help='Bytes of every attachment [default: 65536]')
+    parser.add_argument('--save', default=None, help='Save the results as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='Compare the results with those saved in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of time and memory over the baseline [default: 0.25]')
+    args = parser.parse_args()
+    for name in args.workflows:
+        if name not in WORKFLOWS:
+            parser.error('unknown workflow ' + name)
+
+    results = {}
+    for name in args.workflows:
+        # the clone saves complete spaces, one operation is enough
+        if name == 'clone':
+            results[name] = run(name, argparse.Namespace(**dict(vars(args), operations=1)))
+        else:
+            results[name] = run(name, args)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as in_file:
+            regressions = compare(results, json.load(in_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Time of python -c "import confluence" and the modules it imports
+
+Every run imports the package in a new interpreter with -X importtime. The median time of all runs and the slowest
+modules are reported. The benchmark fails if the median exceeds --max-seconds, or if the package imports one of the
+dependencies that are only needed by some features (eml_parser, dateutil, bs4, opentelemetry, cProfile):
+
+    python benchmarks/import_time.py --runs 10 --max-seconds 0.2
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# modules that must only be imported on first use
+DEFERRED = ('eml_parser', 'dateutil', 'bs4', 'BeautifulSoup', 'lxml', 'opentelemetry', 'cProfile')
+
+CODE = "import {module}, sys; print(' '.join(sorted(m for m in {deferred!r} if m in sys.modules)))"
+
+
+def import_once(module):
+    """Import module in a new interpreter, provide (seconds, {module: cumulative seconds}, deferred modules imported)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE.format(module=module, deferred=DEFERRED)],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative) / 1e6
+    return modules[module], modules, result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='confluence', help='Module to import [default: confluence]')
+    parser.add_argument('--runs', type=int, default=5, help='Number of imports [default: 5]')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules reported [default: 15]')
+    parser.add_argument('--max-seconds', dest='max_seconds', type=float, default=None,
+                        help='Fail if the median import time exceeds this [default: no limit]')
+    args = parser.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.runs)]
+    median = statistics.median(seconds for seconds, _, _ in runs)
+    modules = runs[-1][1]
+    print('import {}: {:.3f}s (median of {} runs)\n'.format(args.module, median, args.runs))
+    for name, seconds in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print('{:>8.1f} ms  {}'.format(seconds * 1e3, name))
+
+    failed = False
+    deferred = runs[-1][2]
+    if deferred:
+        print('\nFAILED: importing {} imports {}'.format(args.module, ', '.join(deferred)))
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print('\nFAILED: import takes {:.3f}s, more than {:.3f}s'.format(median, args.max_seconds))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Request budgets of Confluence operations, locked in by recorded traces
+
+record calls one method of confluence.Confluence against a server and saves its requests as a trace (see
+confluence.recording); check replays saved traces without a server and fails if an operation now makes other, more or
+fewer requests than recorded:
+
+    python benchmarks/replay.py record update_page '{"parent_id": null, "content_id": "12345", "title": "Budget",
+        "body": "<p>budget</p>"}' --server https://confluence.desy.de/ --user jkuepper -o traces/update_page.json
+    python benchmarks/replay.py check traces/*.json
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from confluence.confluence import Confluence  # noqa: E402
+from confluence.recording import ReplayMismatch, Trace, record, replay  # noqa: E402
+
+# the url of replayed clients, traces do not depend on the recorded server
+REPLAY_URL = 'https://confluence.invalid/'
+
+
+def record_operation(args):
+    arguments = json.loads(args.arguments)
+    print("Please enter the password for User " + args.user, file=sys.stderr)
+    confluence = Confluence(args.user, getpass.getpass(), url=args.server)
+    with record(confluence, Trace(operation=args.operation, arguments=arguments)) as trace:
+        getattr(confluence, args.operation)(**arguments)
+    trace.save(args.output)
+    print('{0}: {1} requests, {2:.3f}s on the server'.format(args.operation, len(trace.entries), trace.seconds()))
+    for endpoint in trace.endpoints():
+        print('    ' + endpoint)
+
+
+def check(args):
+    failed = 0
+    for filename in args.traces:
+        trace = Trace.load(filename)
+        confluence = Confluence('replay', 'replay', url=REPLAY_URL)
+        try:
+            with replay(confluence, trace):
+                getattr(confluence, trace.operation)(**trace.arguments)
+        except ReplayMismatch as e:
+            failed += 1
+            print('FAILED {0} ({1}): {2}'.format(filename, trace.operation, e))
+        else:
+            print('ok     {0} ({1}): {2} requests'.format(filename, trace.operation, len(trace.entries)))
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    record_parser = commands.add_parser('record', help='Record the requests of one Confluence method')
+    record_parser.add_argument('operation', help='Method of confluence.Confluence, e.g. update_page')
+    record_parser.add_argument('arguments', help='Keyword arguments of the method as JSON object')
+    record_parser.add_argument('--server', dest='server', default="https://confluence.desy.de/",
+                               help='Server address [default: https://confluence.desy.de/]')
+    record_parser.add_argument('--user', dest='user', default="jkuepper",
+                               help='Please enter your Username. [default: jkuepper]')
+    record_parser.add_argument('-o', '--output', dest='output', required=True, help='Trace file')
+    check_parser = commands.add_parser('check', help='Replay traces and compare the requests')
+    check_parser.add_argument('traces', nargs='+', help='Trace files')
+    args = parser.parse_args()
+    if args.command == 'record':
+        record_operation(args)
+    elif args.command == 'check':
+        check(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
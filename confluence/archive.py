@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Backup of a Confluence space in a single SQLite file
+
+Every file of a backup (pages/<id>.html, blogs/<id>.html, attachments/<id>/<filename>, assets, ...) is one row of the
+table entries, indexed by its path and by the content id it belongs to. Reads use SQLite's memory mapped I/O, so an
+archive can be opened and served without extracting it.
+"""
+
+import io
+import mimetypes
+import os
+import posixpath
+import sqlite3
+import time
+
+from .profiling import phase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, contentid TEXT, modified REAL, data BLOB);
+CREATE INDEX IF NOT EXISTS entries_contentid ON entries (contentid);
+CREATE TABLE IF NOT EXISTS backups (time REAL, message TEXT);
+"""
+
+# maximum number of bytes of the archive accessed through memory mapping
+MMAP_SIZE = 1 << 30
+
+
+def contentid_of(path):
+    """Provide the content id of pages/<id>.html, blogs/<id>.html and attachments/<id>/..., else None"""
+    parts = path.split('/')
+    if len(parts) == 2 and parts[0] in ('pages', 'blogs') and parts[1].endswith('.html'):
+        return parts[1][:-len('.html')]
+    if len(parts) == 3 and parts[0] == 'attachments':
+        return parts[1]
+    return None
+
+
+class _EntryWriter(io.BytesIO):
+    """Buffer of an entry that is stored in the archive when it is closed"""
+
+    def __init__(self, archive, path):
+        super().__init__()
+        self._archive = archive
+        self._path = path
+
+    def close(self):
+        if not self.closed:
+            self._archive.write(self._path, self.getvalue())
+        super().close()
+
+
+class SpaceArchive(object):
+    """A space backup in one SQLite file
+
+    Provides the same interface as the directory output of confluence.clone (open, read, exists, listdir, remove and
+    commit), so the clone can write into either of them.
+    """
+
+    def __init__(self, filename, readonly=False):
+        """
+        :param filename: The archive file, e.g. ConfluenceBackup_CFELCMI.sqlite
+        :param readonly: Open an existing archive for reading only
+        """
+        self.filename = filename
+        if readonly:
+            if not os.path.isfile(filename):
+                raise IOError('No such archive: ' + filename)
+            self._db = sqlite3.connect('file:' + filename + '?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self._db = sqlite3.connect(filename, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        self._db.execute('PRAGMA mmap_size={:d}'.format(MMAP_SIZE))
+
+    def open(self, path, mode='rt'):
+        """
+        Open the entry path like a file
+        :param path: The path of the entry, e.g. pages/12345.html
+        :param mode: 'rt', 'rb', 'wt' or 'wb'
+        :return: File object. Written entries are stored when the file object is closed.
+        """
+        if 'w' in mode:
+            writer = _EntryWriter(self, path)
+            if 'b' in mode:
+                return writer
+            return io.TextIOWrapper(writer, encoding='utf-8')
+        data = self.read(path)
+        if data is None:
+            raise IOError('No such entry in ' + self.filename + ': ' + path)
+        if 'b' in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode('utf-8'))
+
+    def read(self, path):
+        """Provide the data of entry path as bytes, or None if there is no such entry"""
+        row = self._db.execute('SELECT data FROM entries WHERE path = ?', (path,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write(self, path, data):
+        """Store data (bytes) as entry path"""
+        with phase('io'):
+            self._db.execute('INSERT OR REPLACE INTO entries (path, contentid, modified, data) VALUES (?, ?, ?, ?)',
+                             (path, contentid_of(path), time.time(), sqlite3.Binary(data)))
+
+    def exists(self, path):
+        return self._db.execute('SELECT 1 FROM entries WHERE path = ?', (path,)).fetchone() is not None
+
+    def listdir(self, folder):
+        """Provide the names of the entries directly below folder"""
+        prefix = folder.rstrip('/') + '/'
+        rows = self._db.execute('SELECT path FROM entries WHERE path >= ? AND path < ?', (prefix, prefix[:-1] + '0'))
+        return [row[0][len(prefix):] for row in rows if '/' not in row[0][len(prefix):]]
+
+    def remove(self, path):
+        self._db.execute('DELETE FROM entries WHERE path = ?', (path,))
+
+    def flush(self):
+        """Make the entries written so far persistent, e.g. to resume an interrupted backup"""
+        with phase('io'):
+            self._db.commit()
+
+    def resume(self, written, deleted):
+        """The entries of an interrupted backup were flushed into the archive already, nothing to do"""
+
+    def paths(self, contentid=None):
+        """Provide the paths of all entries, or only those of contentid"""
+        if contentid is None:
+            rows = self._db.execute('SELECT path FROM entries ORDER BY path')
+        else:
+            rows = self._db.execute('SELECT path FROM entries WHERE contentid = ? ORDER BY path', (contentid,))
+        return [row[0] for row in rows]
+
+    def commit(self, message=None):
+        """Make all changes since the last commit persistent, recording message in the table backups"""
+        if message is not None:
+            self._db.execute('INSERT INTO backups (time, message) VALUES (?, ?)', (time.time(), message))
+        with phase('io'):
+            self._db.commit()
+
+    def backups(self):
+        """Provide (time, message) of all backups stored in this archive"""
+        return self._db.execute('SELECT time, message FROM backups ORDER BY time').fetchall()
+
+    def extract(self, directory):
+        """Write all entries as files below directory"""
+        for path in self.paths():
+            filename = os.path.join(directory, *path.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as out_file:
+                out_file.write(self.read(path))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def serve(archive, port=8000, host='localhost'):
+    """
+    Serve the pages of archive over http, e.g. http://localhost:8000/ for the start page of the space
+    :param archive: SpaceArchive
+    :param port: OPTIONAL: Default: 8000
+    :param host: OPTIONAL: Default: localhost
+    """
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import unquote, urlsplit
+
+    class ArchiveRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            path = posixpath.normpath(unquote(urlsplit(self.path).path)).lstrip('/') or 'index.html'
+            data = archive.read(path)
+            if data is None:
+                self.send_error(404, 'Not Found')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    httpd = HTTPServer((host, port), ArchiveRequestHandler)
+    print('Serving ' + archive.filename + ' at http://' + host + ':' + str(port) + '/')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Audit of the view and edit restrictions of all pages and blog posts of a space or page tree
+
+The content is streamed with paginated CQL searches, including its ancestors, while the restrictions of every item are
+requested concurrently. View restrictions of a page also apply to all its descendants; they are taken from the
+restrictions requested for the ancestors anyway, so only the ancestors above the root of a page tree are requested
+separately.
+"""
+
+import concurrent.futures
+import csv
+import json
+
+OPERATIONS = ('read', 'update')
+CSV_FIELDS = ['id', 'type', 'title', 'restricted', 'read_users', 'read_groups', 'update_users', 'update_groups',
+              'inherited_read']
+
+
+def compact_restrictions(response):
+    """Provide the users and groups of the restrictions of a content, as returned by
+    Confluence.get_all_restrictions_for_content, as dictionary operation -> {'users': [...], 'groups': [...]}; only
+    restricted operations are included"""
+    restrictions = {}
+    for operation in OPERATIONS:
+        restriction = ((response or {}).get(operation) or {}).get('restrictions', {})
+        users = sorted(user.get('username') or user.get('userKey')
+                       for user in restriction.get('user', {}).get('results', []))
+        groups = sorted(group['name'] for group in restriction.get('group', {}).get('results', []))
+        if users or groups:
+            restrictions[operation] = {'users': users, 'groups': groups}
+    return restrictions
+
+
+def audit(confluence, space=None, root_id=None, parallel=8):
+    """
+    Audit the restrictions of all pages and blog posts of a space, or of all pages below (and including) root_id
+    :param confluence: confluence.Confluence REST client
+    :param space: The space key
+    :param root_id: OPTIONAL: Only audit the page tree of this page
+    :param parallel: OPTIONAL: Maximum number of concurrent requests. Default: 8
+    :return: List of one dictionary per content with the keys id, type, title, ancestors (list of ids), restrictions
+             (see compact_restrictions), inherited (list of {'id': ancestor id, 'read': users and groups}) and
+             restricted (whether viewing is restricted by the content itself or by an ancestor)
+    """
+    if root_id is not None:
+        cql = '(id={root} OR ancestor={root}) AND type in (page, blogpost)'.format(root=root_id)
+        if space is not None:
+            cql += ' AND space="{space}"'.format(space=space)
+    elif space is not None:
+        cql = 'space="{space}" AND type in (page, blogpost)'.format(space=space)
+    else:
+        raise ValueError('audit requires a space or a root page')
+
+    contents = []
+    restrictions = {}
+
+    def finished(done):
+        for future in done:
+            restrictions[pending.pop(future)] = compact_restrictions(future.result())
+
+    def request(content_id):
+        # a few requests are queued beyond the running ones, further results are read when they finish
+        if len(pending) >= 2 * parallel:
+            finished(concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED).done)
+        requested.add(content_id)
+        pending[executor.submit(confluence.get_all_restrictions_for_content, content_id)] = content_id
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        pending = {}
+        requested = set()
+        for content in confluence.iter_content_by_cql(cql, expand='ancestors'):
+            contents.append(content)
+            request(content['id'])
+        # ancestors outside of the audited tree
+        for content in contents:
+            for ancestor in content.get('ancestors', []):
+                if ancestor['id'] not in requested:
+                    request(ancestor['id'])
+        finished(concurrent.futures.wait(pending).done)
+
+    report = []
+    for content in contents:
+        ancestors = [ancestor['id'] for ancestor in content.get('ancestors', [])]
+        inherited = [{'id': ancestor, 'read': restrictions[ancestor]['read']}
+                     for ancestor in ancestors if 'read' in restrictions[ancestor]]
+        own = restrictions[content['id']]
+        report.append({'id': content['id'],
+                       'type': content['type'],
+                       'title': content['title'],
+                       'ancestors': ancestors,
+                       'restrictions': own,
+                       'inherited': inherited,
+                       'restricted': 'read' in own or bool(inherited)})
+    return report
+
+
+def write_json(report, out):
+    """Write the report of audit into an open text file handle"""
+    json.dump(report, out, indent=2)
+    out.write('\n')
+
+
+def write_csv(report, out):
+    """Write the report of audit into an open text file handle, one row per content; several users or groups are
+    separated by semicolons"""
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for entry in report:
+        row = {'id': entry['id'], 'type': entry['type'], 'title': entry['title'], 'restricted': entry['restricted']}
+        for operation in OPERATIONS:
+            restriction = entry['restrictions'].get(operation, {})
+            row[operation + '_users'] = ';'.join(restriction.get('users', []))
+            row[operation + '_groups'] = ';'.join(restriction.get('groups', []))
+        row['inherited_read'] = ';'.join(inherited['id'] for inherited in entry['inherited'])
+        writer.writerow(row)
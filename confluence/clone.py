@@ -0,0 +1,911 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+#
+# Copyright (C) 2016 Alex Franke
+
+__doc__ = """Local and readable HTML backups of Confluence spaces
+
+Every space is saved into its own git repository ConfluenceBackup_<spacekey> in the current directory; every backup run
+creates a new commit. Several spaces can be backed up concurrently over one XML-RPC login.
+"""
+
+import concurrent.futures
+import datetime
+import fnmatch
+import os
+import sys
+import time
+import xmlrpc
+import xmlrpc.client
+from collections import OrderedDict
+from collections import defaultdict
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+import git
+
+from .links import LinkRewriter
+from .profiling import phase, timed
+from .search import SearchIndex, filename_of
+from .templates import Template
+
+MAIN_CSS = (
+    '.blogtree a, .blogtree a:link { color: seashell;}#sidebar object{position:absolute;height:100%;width:100%}#gotos'
+    'pan{padding:2px 10px; border:1px #83B7D9 solid; color:seashell!important} #sidebar{position:fixed;top:0;bottom:0'
+    ';left:0;overflow:scroll; width:20em;background-color:#404040}#sidebarheader{background-color:#2980B9; padding:10'
+    'px 20px; text-align:center;}.blogtree{color:#2980B9} li.active > a { color: Crimson}#sidebar::-webkit-scrollbar '
+    '{ display: none;} html,body{font-family:sans-serif; margin:0; padding:0;height:100%}.pagetree{color:seashell} a,'
+    'a:link{text-decoration:none; color:Crimson}a:hover{text-decoration:underline}#pagetree ul{list-style-type: none}'
+    'a.pagelink:hover,.arrow:hover{text-decoration: underline}a.arrow, a.dot{font-family: monospace; font-size: 20px;'
+    'text-decoration: none; color:seashell} a.pagelink{color: seashell; padding-left: 5px;text-decoration:none}.confl'
+    'uenceTable{border-collapse:collapse;}.confluenceTh, .confluenceTd {    border: 1px solid #ddd; padding: 7px 10px'
+    '; vertical-align: top; text-align: left;}.confluenceTh{background-color:#f0f0f0;}')
+
+MAIN_JS = (
+    'function findUpTag(n,e){for(;n.parentNode;)if(n=n.parentNode,n.tagName===e)return n;return null} function showCh'
+    'ildren(ele){var children=ele.parentElement.childNodes; for (var i=0; i < children.length; i++){if (children[i].n'
+    'odeName.toLowerCase()=="ul"){children[i].style.display="block";}}ele.setAttribute("onclick","hideChildren(this)"'
+    '); ele.innerHTML="&darr;";}function hideChildren(ele){var children=ele.parentElement.childNodes; for (var i=0; i'
+    ' < children.length; i++){if (children[i].nodeName.toLowerCase()=="ul"){children[i].style.display="none";}}ele.se'
+    'tAttribute("onclick","showChildren(this)"); ele.innerHTML="&rarr;";}function openTree(){var e=document.body.getA'
+    'ttribute("pageid"),t=document.getElementById(e);for(t.firstElementChild.children.length>2&&showChildren(t.firstE'
+    'lementChild.firstElementChild),t.firstElementChild.className+=" active";findUpTag(t,"UL");)showChildren(findUpTa'
+    'g(t,"UL").firstElementChild.firstElementChild),t=findUpTag(t,"UL")}')
+
+PAGE_TEMPLATE = Template(
+    '<!DOCTYPE html><html><head><meta charset="UTF-8"><title>{title}</title><script language="javascript" '
+    'type="text/javascript" src="../assets/main.js"></script><link rel="stylesheet" href="../assets/main.css"></head>'
+    '<body onload="openTree()" pageid="{id}"><div id="sidebar"><div id="sidebarheader"><div><h3>Local copy of '
+    'Confluence Space<br><i>{spacename}</i></h3><p><i>saved {saved}</i></p></div><div>'
+    '<a href="../blogs/{lastblog}.html"><span id="gotospan">go&nbsp;to&nbsp;blog</span></a></div></div>'
+    '<div id="pagetree" style="padding:0 10px;"><h3 style="color:Crimson">PAGES</h3>{pagetree}</div></div>'
+    '<div style="float:left; padding: 0px 30px; height:100%; padding-left:22em;"> '
+    '<h1>{title} (<a href="{url}">Origin</a>)</h1><h5>Published {published} by {creator}</h5>'
+    '{attachments}{content}{comments}</div></body></html>')
+
+BLOG_TEMPLATE = Template(
+    '<!DOCTYPE html><html><head><meta charset="UTF-8"><link rel="stylesheet" href="../assets/main.css"><script '
+    'language="javascript" type="text/javascript" src="../assets/main.js"></script><title>{title}</title></head><body>'
+    '<div id="sidebar"><object type="text/html" data="../assets/blogtree.html"></object></div>'
+    '<div style="float:left; padding: 0px 30px; height:100%; padding-left:22em;"> '
+    '<h1>{title} (<a href="{url}">Origin</a>)</h1><h5>Published {published} by {creator}</h5>'
+    '{attachments}{content}{comments}</div></body></html>')
+
+BLOGTREE_TEMPLATE = Template(
+    '<!DOCTYPE html><html><head><meta charset="UTF-8"><base target="_parent" /><link rel="stylesheet" '
+    'href="../assets/main.css"><script language="javascript" type="text/javascript" src="../assets/main.js"></script>'
+    '<title>blogtree</title></head><body><div id="sidebar"><div id="sidebarheader"><div><h3>Local copy of Confluence '
+    'Space<br><i>{spacename}</i></h3><p><i>saved {saved}</i></p></div><div><a target href="../pages/{homepage}.html">'
+    '<span id="gotospan">go&nbsp;to&nbsp;pages</span></a></div></div><div style="padding:0 10px;">'
+    '<h3 style="color:Crimson">BLOG</h3><table class="blogtree" style="width:100%">{months}</table></body>')
+
+BLOGTREE_MONTH_TEMPLATE = Template('<tr><th colspan="2">{month} {year}</th></tr>{blogs}')
+
+BLOGTREE_BLOG_TEMPLATE = Template('<tr><td>{day}.</td><td><a href="../blogs/{id}.html">{title}</a></td></tr>')
+
+COMMENT_TEMPLATE = Template('<div class="confluence_comment"><hr><h4>{creator}</h4><p><i>{created}</i></p><div>'
+                            '{content}</div></div>')
+
+ATTACHMENTS_TEMPLATE = Template('<div style="background-color: #DDD; border: 1px silver ridge; padding: 5px;">'
+                                '<b>Attachments</b><ul>{attachments}</ul></div>')
+
+ATTACHMENT_TEMPLATE = Template('<li><a href="../{path}">{name}</a></li>')
+
+START_TEMPLATE = Template('<!DOCTYPE html><html><head><meta http-equiv="refresh" content="0; '
+                          'url=pages/{homepage}.html"></head><body><p>Please visit <a href="pages/{homepage}.html">'
+                          'this page</a></p></body></html>')
+
+
+class SpaceProgress(object):
+    """Progress messages and counters of the backup of one space"""
+
+    def __init__(self, key, prefix=False):
+        """
+        :param key: The spacekey
+        :param prefix: If True, every message is prefixed by the spacekey. Used when several spaces run concurrently.
+        """
+        self.key = key
+        self.prefix = prefix
+        self.counts = defaultdict(int)
+        self.status = 'pending'
+        self.seconds = 0.
+
+    def __call__(self, message):
+        if self.prefix:
+            message = '[' + self.key + '] ' + str(message)
+        print(message)
+
+    def count(self, kind, number=1):
+        """Count number items of kind, e.g. pages, blogs, or attachments"""
+        self.counts[kind] += number
+
+
+class GitChangeSet(object):
+    """Paths written or deleted during one backup run, relative to the root of the backup repository
+
+    Only these paths are staged for the backup commit, so git does not have to re-hash the complete working tree when
+    just a few pages changed.
+    """
+
+    # paths staged per git command
+    BATCH = 500
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.written = set()
+        self.deleted = set()
+
+    def write(self, path):
+        """Record that path has been (re)written"""
+        self.deleted.discard(path)
+        self.written.add(path)
+
+    def remove(self, path):
+        """Delete path from the working tree and record the deletion"""
+        os.remove(os.path.join(self.repo_dir, path))
+        self.written.discard(path)
+        self.deleted.add(path)
+
+    def commit(self, repo, message):
+        """Stage exactly the recorded paths and commit them
+
+        The paths are staged by git itself, which runs in the repository: the index methods of GitPython change the
+        working directory of the whole process, which breaks the backups of other spaces running concurrently.
+        """
+        deleted = sorted(self.deleted)
+        written = sorted(self.written)
+        # in batches, the command line of a large space would exceed the limits of the OS
+        for start in range(0, len(deleted), self.BATCH):
+            repo.git.rm('--cached', '--ignore-unmatch', '--quiet', '--', *deleted[start:start + self.BATCH])
+        for start in range(0, len(written), self.BATCH):
+            repo.git.add('--', *written[start:start + self.BATCH])
+        return repo.index.commit(message)
+
+
+class Checkpoint(object):
+    """Journal of the content saved by a backup run, so an interrupted run can be resumed
+
+    The journal file ConfluenceBackup_<spacekey>.checkpoint has one line per completed page, blog post, or attachment
+    and per file it wrote or deleted. Every line is flushed to disk right away. The journal is removed after the run
+    finished successfully.
+    """
+
+    def __init__(self, filename, resume=False):
+        """
+        :param filename: The journal file
+        :param resume: Load the journal of an interrupted run. Otherwise an old journal is discarded.
+        """
+        self.filename = filename
+        self.completed = set()
+        self.written = set()
+        self.deleted = set()
+        if os.path.isfile(filename):
+            if resume:
+                self._load()
+            else:
+                os.remove(filename)
+        self._journal = open(filename, "at", encoding="utf-8")
+
+    def _load(self):
+        with open(self.filename, "rt", encoding="utf-8") as journal:
+            for line in journal:
+                if not line.endswith('\n'):
+                    # incomplete last line of a crashed run
+                    break
+                action, item = line[:-1].split('\t', 1)
+                if action == 'done':
+                    self.completed.add(item)
+                elif action == 'write':
+                    self.deleted.discard(item)
+                    self.written.add(item)
+                elif action == 'remove':
+                    self.written.discard(item)
+                    self.deleted.add(item)
+
+    def _append(self, lines):
+        self._journal.write(''.join(lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def isDone(self, kind, key):
+        """True if the item key (e.g. a content id) of kind (page, blog or attachment) was completed already"""
+        return kind + ':' + key in self.completed
+
+    def done(self, kind, key, paths=()):
+        """Record that the item key of kind is completed and that it wrote paths"""
+        self.completed.add(kind + ':' + key)
+        self._append(['write\t' + path + '\n' for path in paths] + ['done\t' + kind + ':' + key + '\n'])
+
+    def removed(self, path):
+        """Record that path was deleted"""
+        self._append(['remove\t' + path + '\n'])
+
+    def close(self, finished=False):
+        """Close the journal; delete it if the run finished successfully"""
+        self._journal.close()
+        if finished:
+            os.remove(self.filename)
+
+
+class DirectoryOutput(object):
+    """Backup into the git repository ConfluenceBackup_<spacekey>, one file per page, blog post and attachment
+
+    All paths are relative to the repository root, e.g. pages/12345.html.
+    """
+
+    def __init__(self, dirname, progress=print):
+        self.progress = progress
+        # if this is the first time the backup is executed in the current directory, a new git repository is
+        # initialized. otherwise a new commit to the existing git repo will be created
+        self.root = os.path.abspath(dirname)
+        with phase('git'):
+            if not os.path.exists(self.root):
+                self.repo = git.Repo.init(self.root)
+                os.mkdir(os.path.join(self.root, 'assets'))
+                os.mkdir(os.path.join(self.root, 'attachments'))
+                os.mkdir(os.path.join(self.root, 'pages'))
+                os.mkdir(os.path.join(self.root, 'blogs'))
+            else:
+                self.repo = git.Repo(self.root)
+                assert not self.repo.bare
+        # only the files touched by this run are staged at the end
+        self.changes = GitChangeSet(self.root)
+
+    def open(self, path, mode='rt'):
+        """Open the file path; files opened for writing are recorded for the next commit"""
+        if 'w' in mode:
+            directory = os.path.dirname(os.path.join(self.root, path))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.changes.write(path)
+        if 'b' in mode:
+            return timed(open(os.path.join(self.root, path), mode))
+        return timed(open(os.path.join(self.root, path), mode, encoding="utf-8"))
+
+    def read(self, path):
+        """Provide the content of file path as bytes, or None if there is no such file"""
+        if not self.exists(path):
+            return None
+        with open(os.path.join(self.root, path), "rb") as in_file:
+            return in_file.read()
+
+    def exists(self, path):
+        return os.path.isfile(os.path.join(self.root, path))
+
+    def listdir(self, folder):
+        return os.listdir(os.path.join(self.root, folder))
+
+    def remove(self, path):
+        self.changes.remove(path)
+
+    def flush(self):
+        """Files are written directly, nothing to do"""
+
+    def resume(self, written, deleted):
+        """Record the paths written and deleted by an interrupted run for the next commit"""
+        for path in written:
+            if self.exists(path):
+                self.changes.write(path)
+        self.changes.deleted.update(deleted)
+
+    def commit(self, message):
+        """Add the written and deleted files to the git repo and commit them"""
+        self.progress('add ' + str(len(self.changes.written)) + ' written and ' + str(len(self.changes.deleted))
+                      + ' deleted files to git repo')
+        self.progress('Commiting changes to git repo')
+        with phase('git'):
+            self.changes.commit(self.repo, message)
+
+    def close(self):
+        pass
+
+
+def auth(user, pwd, srv):
+    """Login to the server and return the authentification token; stop if the login fails"""
+    try:
+        return srv.confluence2.login(user, pwd)
+    except xmlrpc.client.Fault:
+        print("Authentication issues, stopping without sync. Wrong password?")
+        sys.exit(1)
+
+
+def resolveSpaceKeys(srv, token, patterns):
+    """Expand shell-style wildcards (e.g. CMI*) in the list of spacekeys patterns against all spaces on the server"""
+    keys = []
+    spaces = None
+    for pattern in patterns:
+        if not any(char in pattern for char in '*?['):
+            keys.append(pattern)
+            continue
+        if spaces is None:
+            spaces = [space["key"] for space in srv.confluence2.getSpaces(token)]
+        keys.extend(fnmatch.filter(spaces, pattern))
+    # unique keys, keeping the order
+    return list(OrderedDict.fromkeys(keys))
+
+
+def spaceKeysByCQL(confluence, cql, limit=100):
+    """Provide the keys of all spaces matching the CQL filter, e.g. 'space.title ~ "beamtime"'
+
+    :param confluence: confluence.Confluence instance
+    :param limit: The number of results requested at once
+    """
+    return [result["space"]["key"] for result in confluence.iter_cql('type=space AND (' + cql + ')', limit=limit)
+            if "space" in result]
+
+
+def cloneSpaces(srv, token, keys, parallel=4, **kwargs):
+    """Backup all spaces in keys, up to parallel spaces concurrently
+
+    :param srv: XmlRpcServer shared by all backups
+    :param token: The authentification token
+    :param keys: List of spacekeys
+    :param parallel: Maximum number of spaces saved concurrently
+    :param kwargs: Options of SpaceClone, e.g. downloadAttach=False
+    :return: List of the SpaceProgress of every space
+    """
+    progresses = [SpaceProgress(key, prefix=len(keys) > 1) for key in keys]
+    # resolved before the backups start, none of them depends on the working directory afterwards
+    kwargs.setdefault('directory', os.getcwd())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(parallel))) as executor:
+        futures = dict((executor.submit(SpaceClone(srv, token, progress.key, progress=progress, **kwargs).run),
+                        progress) for progress in progresses)
+        for future in concurrent.futures.as_completed(futures):
+            progress = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                progress.status = 'failed: ' + str(e)
+                progress('Backup failed: ' + str(e))
+    return progresses
+
+
+def printSummary(progresses):
+    """Print one line per space with its status, counts and duration"""
+    print('----------------------------------------------------------------------')
+    print('{:<16} {:>7} {:>7} {:>12} {:>9}  {}'.format('space', 'pages', 'blogs', 'attachments', 'seconds', 'status'))
+    for progress in progresses:
+        print('{:<16} {:>7} {:>7} {:>12} {:>9.1f}  {}'.format(progress.key, progress.counts['pages'],
+                                                               progress.counts['blogs'],
+                                                               progress.counts['attachments'], progress.seconds,
+                                                               progress.status))
+    print('----------------------------------------------------------------------')
+
+
+class SpaceClone(object):
+    """Backup of a single space into the git repository ConfluenceBackup_<spacekey> in the current directory"""
+
+    def __init__(self, srv, token, sk, downloadPages=True, downloadBlog=True, downloadAttach=True, overwrite=True,
+                 archive=False, resume=False, progress=None, confluence=None, searchIndex=True, directory=None):
+        """
+        :param srv: XML-RPC server (ServerProxy or XmlRpcServer)
+        :param token: The authentification token
+        :param sk: The spacekey
+        :param downloadPages: Download pages
+        :param downloadBlog: Download blog posts
+        :param downloadAttach: Download attachments
+        :param overwrite: Overwrite all content except for attachments, even if it was not updated since the last
+                          backup. This updates the macro generated content.
+        :param archive: Save the space into the single file ConfluenceBackup_<spacekey>.sqlite (see
+                        confluence.archive) instead of a git repository
+        :param resume: Skip the content saved already by an interrupted run, see Checkpoint
+        :param progress: OPTIONAL: SpaceProgress for messages and counters
+        :param confluence: OPTIONAL: confluence.Confluence REST client. If given, the comments and attachments of the
+                           whole space are harvested with a few CQL requests, and they are only requested per page or
+                           blog post for the content that has any. It is also needed to index labels.
+        :param searchIndex: Index all saved pages and blog posts in ConfluenceBackup_<spacekey>.search.sqlite, see
+                            confluence.search
+        :param directory: OPTIONAL: The directory of the backup, the checkpoint and the search index. Default: the
+                          current directory
+        """
+        self.srv = srv
+        self.token = token
+        self.sk = sk
+        self.downloadPages = downloadPages
+        self.downloadBlog = downloadBlog
+        self.downloadAttach = downloadAttach
+        self.overwrite = overwrite
+        self.progress = progress or SpaceProgress(sk)
+        self.archive = archive
+        self.directory = os.path.abspath(directory or os.getcwd())
+        self.dirname = 'ConfluenceBackup_' + sk + ('.sqlite' if archive else '')
+        self.resume = resume
+        self.output = None
+        self.checkpoint = None
+        self.lastbackuptime = None
+        self.links = None
+        self.confluence = confluence
+        self.commented = None
+        self.attached = None
+        self.searchIndex = searchIndex
+        self.index = None
+        self.labels = {}
+
+    def run(self, changed=None):
+        """Save the space and commit the changes
+
+        :param changed: OPTIONAL: Content ids of the pages and blog posts to save, see saveChanges. Default: None (the
+                        whole space)
+        """
+        start = time.time()
+        self.progress.status = 'running'
+
+        ### BEGIN output
+        if self.archive:
+            from .archive import SpaceArchive
+            self.output = output = SpaceArchive(os.path.join(self.directory, self.dirname))
+        else:
+            self.output = output = DirectoryOutput(os.path.join(self.directory, self.dirname), progress=self.progress)
+        ### END output
+        self.checkpoint = Checkpoint(os.path.join(self.directory, 'ConfluenceBackup_' + self.sk + '.checkpoint'),
+                                     resume=self.resume)
+        if self.checkpoint.completed:
+            self.progress('Resuming interrupted backup, ' + str(len(self.checkpoint.completed))
+                          + ' items completed already')
+            output.resume(self.checkpoint.written, self.checkpoint.deleted)
+        if self.searchIndex:
+            self.index = SearchIndex(os.path.join(self.directory, filename_of(self.sk)))
+        finished = False
+        try:
+            if changed is None:
+                self.saveSpace(output)
+            else:
+                self.saveChanges(output, changed)
+            finished = True
+        finally:
+            self.checkpoint.close(finished)
+            output.close()
+            if self.index is not None:
+                self.index.close()
+        self.progress.seconds = time.time() - start
+        self.progress.status = 'ok'
+        self.progress('Backup finished successfully.')
+        return self.progress
+
+    def loadIndex(self, output):
+        """Load space info, newest blog id and summaries of all pages and blog posts, for the links within the backup
+
+        :return: (space info, id of the newest blog post, list of page summaries, list of blog post summaries)
+        """
+        srv = self.srv
+        token = self.token
+        sk = self.sk
+        # time of the last backup, if this is a refresh of an old backup
+        lastbackuptime = output.read('backuptime.txt')
+        self.lastbackuptime = float(lastbackuptime.decode()) if lastbackuptime else None
+
+        ### BEGIN Get space info, homepage id, newest blog id
+        spaceinfo = srv.confluence2.getSpace(token, sk)
+        self.progress('Saving Space ' + spaceinfo["name"])
+        lastblog = srv.confluence2.search(token, "type = blogpost AND spacekey=" + sk, 1)
+        lastblog = lastblog[0]["id"]
+        ### END Get space info, homepage id, newest blog id
+
+        ### BEGIN index of all pages and blog posts for the links within the backup
+        pages = srv.confluence2.getPages(token, sk) if self.downloadPages else []
+        blogs = srv.confluence2.getBlogEntries(token, sk) if self.downloadBlog else []
+        serverurl = urlsplit(spaceinfo["url"])
+        self.links = LinkRewriter(serverurl.scheme + '://' + serverurl.netloc + '/', attachments=self.downloadAttach)
+        for page in pages:
+            self.links.add(page["id"], 'pages/' + page["id"] + '.html', page["url"])
+        for blog in blogs:
+            self.links.add(blog["id"], 'blogs/' + blog["id"] + '.html', blog["url"])
+        ### END index
+        return spaceinfo, lastblog, pages, blogs
+
+    def saveSpace(self, output):
+        """Save the space into output (DirectoryOutput or SpaceArchive) and commit it"""
+        srv = self.srv
+        token = self.token
+        sk = self.sk
+        spaceinfo, lastblog, pages, blogs = self.loadIndex(output)
+        homepage = spaceinfo["homePage"]
+
+        ### BEGIN ids of all content with comments or attachments
+        if self.confluence is not None:
+            self.commented = set(self.confluence.get_space_comments(sk))
+            self.attached = set(self.confluence.get_space_attachments(sk)) if self.downloadAttach else set()
+            self.progress(str(len(self.commented)) + ' pages/blog posts with comments, ' + str(len(self.attached))
+                          + ' with attachments')
+        ### END ids
+        self.labels = self.loadLabels()
+
+        ### BEGIN assets for html
+        with output.open('assets/main.css', "wt") as css:
+            css.write(MAIN_CSS)
+        with output.open('assets/main.js', "wt") as js:
+            js.write(MAIN_JS)
+        ### END assets for html
+
+        ### BEGIN download of pages (if downloadpages argument is true)
+        if self.downloadPages:
+            self.progress('Saving pages')
+            pagescount = str(len(pages))
+            self.progress(pagescount + " pages found.")
+            self.progress('Generating page tree. Might take some time...')
+            parents = defaultdict(list)
+
+            for page in pages:
+                pagemeta = srv.confluence2.getPage(token, page["id"])
+                # add own id to parents array. This ensures a correct page tree (with the current page also showing)
+                parents[pagemeta["parentId"]].append(page["id"])
+
+            # the page tree is part of every page, so it is assembled only once
+            pagetreeHTML = ''.join(self.recursivePagetreeHTML(parents, "0"))
+            # kept for saveChanges, which saves all pages again only if the tree changed
+            with output.open('assets/pagetree.html', "wt") as out_file:
+                out_file.write(pagetreeHTML)
+
+            for page in pages:
+                self.progress(self.loadpage(page, pagescount, spaceinfo["name"], pagetreeHTML, lastblog))
+                self.progress.count('pages')
+            # pages deleted on the server are removed from the backup as well
+            self.pruneContent('pages', [page["id"] for page in pages])
+        ### END download of pages
+
+        ### BEGIN download of blogposts
+        if self.downloadBlog:
+            self.progress('Saving blog')
+            blogscount = str(len(blogs))
+            self.progress(blogscount + " blog posts found.")
+            self.progress("creating sorted blog tree.")
+
+            self.writeBlogtree(spaceinfo, blogs)
+
+            self.progress("downloading blogs...")
+            for count, blog in enumerate(blogs, start=1):
+                self.progress("(" + str(count) + "/" + blogscount + ") writing blog entry " + blog["id"])
+                self.loadblog(blog)
+                self.progress.count('blogs')
+            self.pruneContent('blogs', [blog["id"] for blog in blogs])
+        ### END download of blogposts
+
+        self.progress('creating start-here page')
+        with output.open('index.html', "wt") as out:
+            START_TEMPLATE.render(out, homepage=homepage)
+
+        # save backup time
+        self.progress('creating backuptime file in unixtimeformat')
+        with output.open('backuptime.txt', "wt") as timefile:
+            timefile.write(str(time.time()))
+
+        output.commit("Confluence space backup of " + str(datetime.datetime.now()))
+
+    def saveChanges(self, output, changed):
+        """Save only the pages and blog posts with the content ids in changed into output and commit them
+
+        Pages and blog posts deleted on the server are removed from the backup. The page tree is part of every page,
+        so all pages are saved again if it changed, e.g. because a page was added, moved or renamed.
+        """
+        spaceinfo, lastblog, pages, blogs = self.loadIndex(output)
+        changed = set(changed)
+
+        if self.downloadPages:
+            parents = defaultdict(list)
+            titles = {}
+            for page in pages:
+                parents[page["parentId"]].append(page["id"])
+                titles[page["id"]] = page["title"]
+            pagetreeHTML = ''.join(self.recursivePagetreeHTML(parents, "0", titles=titles))
+            oldtree = output.read('assets/pagetree.html')
+            if oldtree is None or oldtree.decode('utf-8') != pagetreeHTML:
+                self.progress('Page tree changed, saving all pages')
+                changed.update(page["id"] for page in pages)
+                with output.open('assets/pagetree.html', "wt") as out_file:
+                    out_file.write(pagetreeHTML)
+            changedpages = [page for page in pages if page["id"] in changed]
+            self.labels = self.loadLabels(changed)
+            pagescount = str(len(changedpages))
+            self.progress(pagescount + " changed pages.")
+            for page in changedpages:
+                self.progress(self.loadpage(page, pagescount, spaceinfo["name"], pagetreeHTML, lastblog))
+                self.progress.count('pages')
+            self.pruneContent('pages', [page["id"] for page in pages])
+
+        if self.downloadBlog:
+            changedblogs = [blog for blog in blogs if blog["id"] in changed]
+            self.labels.update(self.loadLabels([blog["id"] for blog in changedblogs]))
+            self.progress(str(len(changedblogs)) + " changed blog posts.")
+            if changedblogs or len(blogs) != len(output.listdir('blogs')):
+                self.writeBlogtree(spaceinfo, blogs)
+            for blog in changedblogs:
+                self.loadblog(blog)
+                self.progress.count('blogs')
+            self.pruneContent('blogs', [blog["id"] for blog in blogs])
+
+        with output.open('backuptime.txt', "wt") as timefile:
+            timefile.write(str(time.time()))
+        output.commit("Confluence space mirror update of " + str(datetime.datetime.now()))
+
+    def writeBlogtree(self, spaceinfo, blogs):
+        """Write the blog sidebar tree assets/blogtree.html"""
+        # the idea here is to get a list of blog posts ordered by month, showing the newest first.
+        # create a defaultdict with keys 201510,201509,2014111 etc for every month. Insert every blog resp. as value
+        yearmonthDict = defaultdict(list)
+        for blog in blogs:
+            yearmonthDict[str(blog["publishDate"])[0:6]].append(blog)  # fill default dict
+        with self.output.open('assets/blogtree.html', "wt") as out_file:
+            BLOGTREE_TEMPLATE.render(out_file,
+                                     spacename=html_escape(spaceinfo["name"]),
+                                     saved=str(datetime.datetime.today()),
+                                     homepage=spaceinfo["homePage"],
+                                     months=blogtreeMonths(yearmonthDict))
+
+    def loadLabels(self, ids=None):
+        """Provide the labels of the pages and blog posts with the content ids in ids (default: all of the space) for
+        the search index, as dictionary content id -> list of label names; requires the REST client confluence"""
+        if self.index is None or self.confluence is None:
+            return {}
+        if ids is None:
+            return self.confluence.get_labels_by_cql('space="' + self.sk + '" AND type in (page, blogpost)')
+        labels = {}
+        ids = sorted(ids)
+        for start in range(0, len(ids), 100):
+            labels.update(self.confluence.get_labels_by_cql('id in (' + ','.join(ids[start:start + 100]) + ')'))
+        return labels
+
+    def indexContent(self, contentid, kind, path, title, contenthtml, comments):
+        """Add saved content to the search index, if there is one"""
+        if self.index is not None:
+            self.index.add(contentid, kind, path, title, contenthtml, self.labels.get(contentid, ()),
+                           [comment["content"] for comment in comments])
+
+    def pruneContent(self, folder, ids):
+        """Remove local pages/blogs from folder whose content id is not in ids anymore, i.e., deleted on the server"""
+        keep = set(contentid + '.html' for contentid in ids)
+        for filename in self.output.listdir(folder):
+            if filename.endswith('.html') and filename not in keep:
+                self.progress('Removing ' + folder + '/' + filename + ' (deleted on server)')
+                self.output.remove(folder + '/' + filename)
+                if self.index is not None:
+                    self.index.remove(filename[:-len('.html')])
+                    self.index.commit()
+                self.checkpoint.removed(folder + '/' + filename)
+
+    def completed(self, kind, key, paths):
+        """Persist the output and the search index, then journal the item key of kind as completed, so a resumed
+        backup never skips content whose index entry was lost"""
+        self.output.flush()
+        if self.index is not None:
+            self.index.commit()
+        self.checkpoint.done(kind, key, paths)
+
+    def loadpage(self, page, pagescount, spacename, pagetreeHTML, lastblog):
+        """Load page
+
+        Parameters:
+        array with page info,
+        int number of pages,
+        string spacename,
+        string pagetree,
+        int id of last blog
+        Function to load a page with given id
+
+        For every page a new file is created in the folder /pages/. The name is given by the content id and the file
+        extension .html. This is to make sure this backup works on every filesystem and has no weird symbols or spaces
+        in its filename.
+        """
+        srv = self.srv
+        token = self.token
+        if self.checkpoint.isDone('page', page["id"]):
+            return "------- " + page["id"] + ' completed by interrupted backup --------'
+        ### path to local backup html.
+        pagepath = 'pages/' + page["id"] + '.html'
+
+        ### BEGIN comments
+        comments = self.getComments(page["id"])
+        ### END comments
+
+        ### BEGIN additional info, for page tree links
+        pagemeta = srv.confluence2.getPage(token, page["id"])
+        ### END additional info
+
+        ###BEGIN attachments
+        attachHTML = ""
+        if self.downloadAttach:
+            attachHTML = self.getConfAttachments(page["id"])
+        ###END attachments
+
+        ###BEGIN content of page
+        if self.lastbackuptime is not None and not self.overwrite:
+            # if server file newer than last backup
+            if ((pagemeta["modified"] > datetime.datetime.fromtimestamp(self.lastbackuptime))
+                    or not self.output.exists(pagepath)):
+                self.writePage(pagepath, page, spacename, lastblog, pagemeta, attachHTML, comments, pagetreeHTML)
+            else:
+                self.progress(page["id"] + ": Content not changed since last backup. Skipping")
+        else:
+            self.writePage(pagepath, page, spacename, lastblog, pagemeta, attachHTML, comments, pagetreeHTML)
+        self.completed('page', page["id"], [pagepath])
+        ###END content of page
+
+        return "------- " + page["id"] + ' completed --------'
+
+    def loadblog(self, blog):
+        """Load blog post with its comments and attachments into the folder /blogs/"""
+        if self.checkpoint.isDone('blog', blog["id"]):
+            self.progress(blog["id"] + ': completed by interrupted backup. Skipping')
+            return
+        blogpath = 'blogs/' + blog["id"] + '.html'
+        comments = self.getComments(blog["id"])
+        # downloading Attachments of page
+        attachHTML = ""
+        if self.downloadAttach:
+            attachHTML = self.getConfAttachments(blog["id"])
+
+        # modify links within html
+        contenthtml = self.links.rewrite(self.saveConfluenceContent(blog["id"]))
+        with self.output.open(blogpath, "wt") as out_file:
+            BLOG_TEMPLATE.render(out_file,
+                                 title=html_escape(blog["title"]),
+                                 url=blog["url"],
+                                 published=publishedDate(blog["publishDate"]),
+                                 creator=html_escape(blog["author"]),
+                                 attachments=attachHTML,
+                                 content=contenthtml,
+                                 comments=commentFragments(comments, self.links))
+        self.indexContent(blog["id"], 'blogpost', blogpath, blog["title"], contenthtml, comments)
+        self.completed('blog', blog["id"], [blogpath])
+
+    def saveConfluenceContent(self, id):
+        """saveConfluenceContent
+
+        returns the content of the given id in plain html wrapped by a <div>
+        """
+        parameter = {}
+        parameter['style'] = 'clean'
+        return self.srv.confluence2.renderContent(self.token, '', id, '', parameter)
+
+    def recursivePagetreeHTML(self, parents, i, html=None, titles=None):
+        """Collect the HTML fragments of the page tree below page i in the list html and return it
+
+        The titles of the pages are requested from the server, unless they are given in the dictionary titles.
+        """
+        if html is None:
+            html = []
+        for ele in parents[i]:
+            # get element information
+            if titles is not None:
+                elehtml = {"id": ele, "title": titles[ele]}
+            else:
+                elehtml = self.srv.confluence2.getPage(self.token, ele)
+
+            # root element is visible
+            if i == "0":
+                html.append('<ul id="' + elehtml["id"] + '"><li>')
+            # every subpage is not
+            else:
+                html.append('<ul id="' + elehtml["id"] + '" style="display:none"><li>')
+
+            # if current element has children
+            if ele in parents:
+                html.append('<a class="arrow" onclick="showChildren(this)" href="#">&rarr;</a>')
+                html.append('<a class="pagelink" href="' + elehtml["id"] + '.html">' + html_escape(elehtml["title"])
+                            + '</a>')
+                # recursively insert children
+                self.recursivePagetreeHTML(parents, ele, html, titles)
+            # current element has no children
+            else:
+                html.append('<a class="dot">&middot;</a>')
+                html.append('<a class="pagelink" href="' + elehtml["id"] + '.html">' + html_escape(elehtml["title"])
+                            + '</a>')
+
+            html.append("</li></ul>")
+
+        return html
+
+    def getComments(self, contentid):
+        """Provide the comments of a page or blog post, without asking the server if the harvest found none"""
+        if self.commented is not None and contentid not in self.commented:
+            return []
+        return self.srv.confluence2.getComments(self.token, contentid)
+
+    def getConfAttachments(self, contentid):
+        ### ask server for attachments, unless the harvest found none
+        if self.attached is not None and contentid not in self.attached:
+            return []
+        attachments = self.srv.confluence2.getAttachments(self.token, contentid)
+        ### set html output
+        attachHTML = []
+
+        if attachments:
+            for attachment in attachments:
+
+                ### every page/blog gets its own folder with all its attachments. This folder is named with the
+                ### contentid of that page/blogpost
+                attachPath = 'attachments/' + contentid + '/' + attachment["fileName"]
+
+                ### check if file has changes since last backup. The modification date is within its url
+                url = attachment["url"]
+                urlpos = url.find('modificationDate') + 17
+                modDate = url[urlpos:urlpos + 10]
+                if self.checkpoint.isDone('attachment', contentid + '/' + attachment["fileName"]):
+                    self.progress('Skipping ' + attachment["fileName"] + ' for contentid ' + contentid
+                                  + ' (completed by interrupted backup)')
+                # if this is a refresh of an old backup
+                elif self.lastbackuptime is not None:
+                    # if server file newer than last backup
+                    if int(modDate) > int(self.lastbackuptime) or not self.output.exists(attachPath):
+                        self.writeAttachment(attachPath, attachment, contentid)
+                    else:
+                        self.progress('Skipping ' + attachment["fileName"] + ' for contentid ' + contentid
+                                      + ' (not updated since last backup)')
+
+                # first time backing up space, so no backuptime file present
+                else:
+                    self.writeAttachment(attachPath, attachment, contentid)
+
+                # create link to attachment
+                attachHTML.append(ATTACHMENT_TEMPLATE.fragments(path=attachPath, name=attachment["fileName"]))
+
+            ###add html container and heading if every attachment has been processed
+            attachHTML = ATTACHMENTS_TEMPLATE.fragments(attachments=(fragment for item in attachHTML
+                                                                     for fragment in item))
+        return attachHTML
+
+    def writePage(self, pagepath, page, spacename, lastblog, pagemeta, attachHTML, comments, pagetreeHTML):
+        # modify links within pagehtml
+        contenthtml = self.links.rewrite(self.saveConfluenceContent(page["id"]))
+        with self.output.open(pagepath, "wt") as out_file:
+            PAGE_TEMPLATE.render(out_file,
+                                 title=html_escape(page["title"]),
+                                 id=page["id"],
+                                 spacename=html_escape(spacename),
+                                 saved=html_escape(str(datetime.datetime.today())),
+                                 lastblog=lastblog,
+                                 pagetree=pagetreeHTML,
+                                 url=page["url"],
+                                 published=publishedDate(pagemeta["created"]),
+                                 creator=html_escape(pagemeta["creator"]),
+                                 attachments=attachHTML,
+                                 content=contenthtml,
+                                 comments=commentFragments(comments, self.links))
+        self.indexContent(page["id"], 'page', pagepath, page["title"], contenthtml, comments)
+
+    def writeAttachment(self, attachPath, attachment, contentid):
+        with self.output.open(attachPath, "wb") as out_file:
+            self.progress('Downloading ' + attachment["fileName"] + ' for contentid ' + contentid)
+            attbytes = self.srv.confluence2.getAttachmentData(self.token, contentid, attachment["fileName"], "0").data
+            out_file.write(attbytes)
+        self.completed('attachment', contentid + '/' + attachment["fileName"], [attachPath])
+        self.progress.count('attachments')
+
+
+def publishedDate(date):
+    """Format an XML-RPC date (e.g. 20190101T12:00:00) as 2019-01-01 12:00:00"""
+    date = str(date)
+    return date[0:4] + '-' + date[4:6] + '-' + date[6:8] + ' ' + date[9:]
+
+
+def commentFragments(comments, links):
+    """Generate the HTML fragments of the comments of a page or blog post, with links rewritten by links"""
+    for comment in comments:
+        for fragment in COMMENT_TEMPLATE.fragments(creator=html_escape(comment["creator"]),
+                                                   created=html_escape(str(comment["created"])),
+                                                   content=links.rewrite(comment["content"])):
+            yield fragment
+
+
+def blogtreeMonths(yearmonthDict):
+    """Generate the HTML fragments of the blog tree, newest month and blog post first"""
+    monthnames = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    for yearmonth in sorted(yearmonthDict, reverse=True):
+        # sorted list of all blogs of the month, newest first
+        srtBlogs = sorted(yearmonthDict[yearmonth], key=lambda blog: str(blog["publishDate"]), reverse=True)
+        blogs = (BLOGTREE_BLOG_TEMPLATE.fragments(day=str(blog["publishDate"])[6:8],
+                                                  id=blog["id"],
+                                                  title=html_escape(blog["title"]))
+                 for blog in srtBlogs)
+        for fragment in BLOGTREE_MONTH_TEMPLATE.fragments(month=monthnames[int(yearmonth[4:6]) - 1],
+                                                          year=yearmonth[0:4],
+                                                          blogs=(fragment for blog in blogs for fragment in blog)):
+            yield fragment
+
+
+def html_escape(text):
+    # escape() and unescape() takes care of &, < and >.
+    html_escape_table = {
+        '"': "&quot;",
+        "'": "&apos;"
+    }
+    return escape(text, html_escape_table)
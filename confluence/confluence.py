@@ -4,16 +4,26 @@
 # Copyright (C) 2018 Alexander Franke, Jan Petermann
 
 from .rest_client import AtlassianRestAPI
+from collections import OrderedDict
+from collections import defaultdict
 from requests import HTTPError
 from xml.etree import ElementTree
+import concurrent.futures
 import logging
 import os
+import random
+import threading
+import time
+from . import metrics
 from .bytesIO import clean_string
+from .directory import UserDirectory
+from .tracing import traced_methods
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+@traced_methods
 class Confluence(AtlassianRestAPI):
     content_types = {
         ".gif": "image/gif",
@@ -25,6 +35,27 @@ class Confluence(AtlassianRestAPI):
         ".xls": "application/vnd.ms-excel",
     }
 
+    def __init__(self, *args, **kwargs):
+        """
+        See AtlassianRestAPI, and
+        :param conversion_cache: OPTIONAL: ConversionCache of convert_wiki_to_storage and convert_storage_to_view.
+                                 Default: None (every conversion is requested from the server)
+        :param user_directory: OPTIONAL: UserDirectory caching the users and groups, e.g. with another ttl or a JSON
+                               file; one created with confluence None uses this client. Default: None (a new
+                               UserDirectory in memory)
+        """
+        self.conversion_cache = kwargs.pop('conversion_cache', None)
+        directory = kwargs.pop('user_directory', None)
+        super(Confluence, self).__init__(*args, **kwargs)
+        # cache of users and groups, see UserDirectory
+        self.directory = directory if directory is not None else UserDirectory(self)
+        if self.directory.confluence is None:
+            self.directory.confluence = self
+        # transforms waiting for atomic_update, per content id, and the lock of the thread writing them
+        self._pending_updates = {}
+        self._update_writers = {}
+        self._updates_lock = threading.Lock()
+
     def page_exists(self, space, title):
         try:
             if self.get_content_by_title(space, title):
@@ -220,6 +251,23 @@ class Confluence(AtlassianRestAPI):
         """
         return self.get_all_contents_from_space(space, start, limit, status)
 
+    def iter_contents_from_space(self, space, content_type='page', status=None, expand=None, limit=200):
+        """
+        Iterate over all pages or blog posts of a space, requesting them page by page, see _iter_results
+        :param space: Space Key
+        :param content_type: OPTIONAL: page or blogpost. Default: page
+        :param status: OPTIONAL: current, draft or trashed. Default: None (current)
+        :param expand: OPTIONAL: The properties to expand on the content, e.g. version
+        :param limit: OPTIONAL: The number of results requested at once. Default: 200
+        :return: Generator of content
+        """
+        params = {'spaceKey': space, 'type': content_type, 'limit': int(limit)}
+        if status:
+            params['status'] = status
+        if expand is not None:
+            params['expand'] = expand
+        yield from self._iter_results('rest/api/content', params)
+
     def get_all_draft_contents_from_space_through_cql(self, space, start=0, limit=500, status='draft'):
         """
         Search list of draft content by space key
@@ -432,6 +480,17 @@ class Confluence(AtlassianRestAPI):
                 'name': label}
         return self.post(path=url, data=data)
 
+    def set_content_labels(self, content_id, labels):
+        """
+        Set several labels on the page with one request
+        :param content_id: content_id format
+        :param labels: labels to add
+        :return:
+        """
+        url = 'rest/api/content/{content_id}/label'.format(content_id=content_id)
+        data = [{'prefix': 'global', 'name': label} for label in labels]
+        return self.post(path=url, data=data)
+
     def history(self, page_id):
         url = 'rest/api/content/{0}/history'.format(page_id)
         return self.get(url)
@@ -569,15 +628,79 @@ class Confluence(AtlassianRestAPI):
                                                                    url=result['_links']['tinyui']))
         return result
 
+    def atomic_update(self, content_id, transform, retries=5, backoff=0.5, minor_edit=True):
+        """
+        Update the storage body of a page or blog post without losing concurrent updates
+        The content is read with its version, transformed and written with the next version number. If somebody else
+        updated it in between, the server rejects the write with a conflict, and it is read, transformed and written
+        again, waiting backoff, 2*backoff, ... seconds before each retry.
+        Transforms of the same content id queued by other threads while an update is running are applied together with
+        one read and one write.
+        :param content_id: The id of the page or blog post
+        :param transform: Function of the storage body (str) providing the new storage body. It may be called more than
+                          once, and must not depend on anything but its argument.
+        :param retries: OPTIONAL: How often a conflicting write is repeated. Default: 5
+        :param backoff: OPTIONAL: Seconds to wait before the first retry. Default: 0.5
+        :param minor_edit: OPTIONAL: Do not notify watchers about the change. Default: True
+        :return: The updated content, or the unchanged content if no transform changed the body
+        """
+        content_id = str(content_id)
+        update = _PendingUpdate(transform)
+        with self._updates_lock:
+            self._pending_updates.setdefault(content_id, []).append(update)
+            writer = self._update_writers.setdefault(content_id, threading.Lock())
+        with writer:
+            if not update.done.is_set():
+                # write all transforms queued so far, including those of threads still waiting for the writer lock
+                with self._updates_lock:
+                    batch = self._pending_updates.pop(content_id)
+                try:
+                    result = self._write_transforms(content_id, [pending.transform for pending in batch],
+                                                    retries, backoff, minor_edit)
+                except Exception as e:
+                    for pending in batch:
+                        pending.error = e
+                else:
+                    for pending in batch:
+                        pending.result = result
+                for pending in batch:
+                    pending.done.set()
+        if update.error is not None:
+            raise update.error
+        return update.result
+
+    def _write_transforms(self, content_id, transforms, retries, backoff, minor_edit):
+        url = 'rest/api/content/{content_id}'.format(content_id=content_id)
+        for attempt in range(retries + 1):
+            content = self.get_content_by_id(content_id, expand='body.storage,version')
+            body = content['body']['storage']['value']
+            new_body = body
+            for transform in transforms:
+                new_body = transform(new_body)
+            if new_body == body:
+                return content
+            data = {'id': content_id,
+                    'type': content['type'],
+                    'title': content['title'],
+                    'body': {'storage': {'value': new_body, 'representation': 'storage'}},
+                    'version': {'number': content['version']['number'] + 1, 'minorEdit': minor_edit}}
+            try:
+                return self.request('PUT', path=url, data=data).json()
+            except HTTPError as e:
+                if e.response is None or e.response.status_code != 409 or attempt == retries:
+                    raise
+                log.info('Version conflict updating {content_id}, retrying'.format(content_id=content_id))
+                metrics.retry('conflict')
+                # spread the retries of concurrent writers
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
     def convert_wiki_to_storage(self, wiki):
         """
         Convert to Confluence XHTML format from wiki style
         :param wiki:
         :return:
         """
-        data = {'value': wiki,
-                'representation': 'wiki'}
-        return self.post('rest/api/contentbody/convert/storage', data=data)
+        return self._convert(wiki, 'wiki', 'storage')
 
     def convert_storage_to_view(self, storage):
         """
@@ -585,9 +708,31 @@ class Confluence(AtlassianRestAPI):
         :param storage:
         :return:
         """
-        data = {'value': storage,
-                'representation': 'storage'}
-        return self.post('rest/api/contentbody/convert/view', data=data)
+        return self._convert(storage, 'storage', 'view')
+
+    def convert_many(self, values, representation='wiki', to='storage', parallel=8):
+        """
+        Convert many content bodies concurrently; every distinct value is converted once
+        :param values: List of content bodies
+        :param representation: OPTIONAL: The representation of values, wiki or storage. Default: wiki
+        :param to: OPTIONAL: The representation to convert to, storage or view. Default: storage
+        :param parallel: OPTIONAL: Maximum number of concurrent conversions. Default: 8
+        :return: List of the conversions, in the order of values
+        """
+        distinct = list(OrderedDict.fromkeys(values))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+            converted = dict(zip(distinct, executor.map(lambda value: self._convert(value, representation, to),
+                                                        distinct)))
+        return [converted[value] for value in values]
+
+    def _convert(self, value, representation, to):
+        def convert(value):
+            data = {'value': value,
+                    'representation': representation}
+            return self.post('rest/api/contentbody/convert/{to}'.format(to=to), data=data)
+        if self.conversion_cache is None:
+            return convert(value)
+        return self.conversion_cache.convert(representation, to, value, convert)
 
     def set_content_property(self, content_id, data):
         """
@@ -682,6 +827,23 @@ class Confluence(AtlassianRestAPI):
                                                                                       start=start)
         return (self.get(url) or {}).get('results')
 
+    def iter_group_members(self, group_name='confluence-users', limit=200):
+        """
+        Iterate over all users in the given group, requesting them page by page
+        :param group_name
+        :param limit: OPTIONAL: The number of users requested at once. Default: 200
+        :return: Generator of users
+        """
+        start = 0
+        while True:
+            # the server may return less than limit users, so only an empty page marks the end
+            members = self.get_group_members(group_name, start=start, limit=limit)
+            if not members:
+                return
+            for member in members:
+                yield member
+            start += len(members)
+
     def get_space(self, space_key, expand='description.plain,homepage'):
         """
         Get information about a space through space key
@@ -693,6 +855,19 @@ class Confluence(AtlassianRestAPI):
                                                                   expand=expand)
         return self.get(url)
 
+    def create_space(self, space_key, space_name, description=None):
+        """
+        Create a new space
+        :param space_key: The unique space key name
+        :param space_name: The name of the space
+        :param description: OPTIONAL: Plain text description of the space
+        :return: Returns the new space
+        """
+        data = {'key': space_key, 'name': space_name, 'metadata': {}}
+        if description is not None:
+            data['description'] = {'plain': {'value': description, 'representation': 'plain'}}
+        return self.post('rest/api/space', data=data)
+
     def get_user_details_by_username(self, username, expand=None):
         """
         Get information about a user through username
@@ -738,7 +913,7 @@ class Confluence(AtlassianRestAPI):
                         this may cause database requests for some properties
         :param include_archived_spaces: OPTIONAL: whether to include content in archived spaces in the result,
                                     this defaults to false
-        :return:
+        :return: One page of search results; iter_cql streams all of them
         """
         params = {}
         if start is not None:
@@ -756,9 +931,102 @@ class Confluence(AtlassianRestAPI):
 
         return self.get('rest/api/search', params=params)
 
+    def get_space_comments(self, space, limit=200, expand='container'):
+        """
+        Get all comments of a space with paginated CQL requests, grouped by the page or blog post they belong to
+        :param space: The space key
+        :param limit: OPTIONAL: The number of comments requested at once. Default: 200.
+        :param expand: OPTIONAL: The properties to expand on the comments, must include container. Default: container
+        :return: Dictionary container id -> list of comments
+        """
+        return self._get_space_content_by_container(space, 'comment', limit=limit, expand=expand)
+
+    def get_space_attachments(self, space, limit=200, expand='container'):
+        """
+        Get the metadata of all attachments of a space with paginated CQL requests, grouped by the page or blog post
+        they are attached to
+        :param space: The space key
+        :param limit: OPTIONAL: The number of attachments requested at once. Default: 200.
+        :param expand: OPTIONAL: The properties to expand on the attachments, must include container. Default: container
+        :return: Dictionary container id -> list of attachments
+        """
+        return self._get_space_content_by_container(space, 'attachment', limit=limit, expand=expand)
+
+    def _get_space_content_by_container(self, space, content_type, limit, expand):
+        by_container = defaultdict(list)
+        cql = 'space="{space}" AND type={type}'.format(space=space, type=content_type)
+        for result in self.iter_content_by_cql(cql, expand=expand, limit=limit):
+            by_container[result['container']['id']].append(result)
+        return dict(by_container)
+
+    def get_labels_by_cql(self, cql, limit=200):
+        """
+        Get the labels of all content matching cql with paginated CQL requests
+        :param cql: The CQL query, e.g. 'space="CFELCMI" AND type in (page, blogpost)'
+        :param limit: OPTIONAL: The number of results requested at once. Default: 200
+        :return: Dictionary content id -> list of label names, for the content with labels
+        """
+        labels = {}
+        for result in self.iter_content_by_cql(cql, expand='metadata.labels', limit=limit):
+            names = [label['name'] for label in result.get('metadata', {}).get('labels', {}).get('results', [])]
+            if names:
+                labels[result['id']] = names
+        return labels
+
+    def iter_content_by_cql(self, cql, expand=None, limit=200):
+        """
+        Iterate over all content matching cql, requesting it page by page, see _iter_results
+        :param cql: The CQL query, e.g. 'space="CFELCMI" AND type=page'
+        :param expand: OPTIONAL: The properties to expand on the content, e.g. ancestors
+        :param limit: OPTIONAL: The number of results requested at once. Default: 200
+        :return: Generator of content
+        """
+        params = {'cql': cql, 'limit': int(limit)}
+        if expand is not None:
+            params['expand'] = expand
+        yield from self._iter_results('rest/api/content/search', params)
+
+    def iter_cql(self, cql, expand=None, limit=200, include_archived_spaces=None, excerpt=None):
+        """
+        Iterate over all search results of cql, requesting them page by page, see _iter_results
+        :param cql: The CQL query, e.g. 'space="CFELCMI" AND text ~ "laser"'
+        :param expand: OPTIONAL: The properties to expand on the search results, e.g. content.version; only the
+                        expanded fields are returned, so keep it short for large queries
+        :param limit: OPTIONAL: The number of results requested at once. Default: 200
+        :param include_archived_spaces: OPTIONAL: whether to include content in archived spaces in the result,
+                                    this defaults to false
+        :param excerpt: OPTIONAL: the excerpt strategy to apply to the result, one of : indexed, highlight, none.
+        :return: Generator of search results, like the results of cql
+        """
+        params = {'cql': cql, 'limit': int(limit)}
+        if expand is not None:
+            params['expand'] = expand
+        if include_archived_spaces is not None:
+            params['includeArchivedSpaces'] = include_archived_spaces
+        if excerpt is not None:
+            params['excerpt'] = excerpt
+        yield from self._iter_results('rest/api/search', params)
+
+    def _iter_results(self, path, params):
+        """
+        Iterate over the results of a paginated request, following the link to the next results the server provides
+        Confluence 7 and later link a cursor, so every page of results costs the server the same, while the offset of
+        start gets slower with every page. The next page is only requested when the results so far are consumed.
+        """
+        response = self.get(path, params=params) or {}
+        while True:
+            results = response.get('results', [])
+            for result in results:
+                yield result
+            # the server may return less than limit results per request, so rely on the link to the next results
+            following = response.get('_links', {}).get('next')
+            if not results or not following:
+                return
+            response = self.get(following) or {}
+
     def get_content_as_pdf(self, content_id):
         """
-        Export content as standard pdf exporter
+        Export content as standard pdf exporter; export_content_as_pdf writes it into a file instead of memory
         :param content_id: content_id ID
         :return: PDF File
         """
@@ -766,6 +1034,16 @@ class Confluence(AtlassianRestAPI):
         url = 'spaces/flyingpdf/pdfpageexport.action?pageId={content_id}'.format(content_id=content_id)
         return self.get(url, headers=headers, not_json_response=True)
 
+    def export_content_as_pdf(self, content_id, filename):
+        """
+        Export content with the standard pdf exporter and stream the PDF into a file, see AtlassianRestAPI.download
+        :param content_id: content_id ID
+        :param filename: The PDF file to write
+        :return: Number of bytes written
+        """
+        return self.download('spaces/flyingpdf/pdfpageexport.action', filename, params={'pageId': content_id},
+                             headers=self.form_token_headers)
+
     def export_content(self, content_id):
         """
         Alias method for export page as pdf
@@ -782,18 +1060,11 @@ class Confluence(AtlassianRestAPI):
         :param title: str
         :return: page_id of the page whose title is passed in argument
         """
-        page_id = ""
-
-        url = 'rest/api/content/search?cql=parent={}%20AND%20space="{}"'.format(
-            parent_id, space
-        )
-        response = self.get(url, {})
-
-        for each_page in response.get("results", []):
+        cql = 'parent={} AND space="{}"'.format(parent_id, space)
+        for each_page in self.iter_content_by_cql(cql):
             if each_page.get("title") == title:
-                page_id = each_page.get("id")
-                break
-        return page_id
+                return each_page.get("id")
+        return ""
 
     def reindex(self):
         """
@@ -823,3 +1094,13 @@ class Confluence(AtlassianRestAPI):
             # check as support tools
             response = self.get('rest/supportHealthCheck/1.0/check/')
         return response
+
+
+class _PendingUpdate(object):
+    """A transform waiting for Confluence.atomic_update"""
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -5,14 +5,14 @@
 
 
 import logging
-import dateutil.parser
-import eml_parser
 import datetime
 from .bytesIO import BytesIO
+from .tracing import traced_methods
 
 log = logging.getLogger(__name__)
 
 
+@traced_methods
 class _ConfluenceContent:
 
     def __init__(self,
@@ -69,6 +69,8 @@ class _ConfluenceContent:
     def _date(self, date):
         if not date:
             return
+        # imported on first use, it is not needed by most users of the package
+        import dateutil.parser
         try:
             new_date = dateutil.parser.parse(date.isoformat())
         except AttributeError:
@@ -255,6 +257,8 @@ class _ConfluenceContent:
         :param file_path:
         :return:
         """
+        # imported on first use, eml_parser and its dependencies take long to import
+        import eml_parser
         with open(file_path, 'rb') as raw_email:
             raw_email = raw_email.read()
         eml = eml_parser.eml_parser.decode_email_b(raw_email, include_raw_body=True, include_attachment_data=True)
@@ -299,6 +303,7 @@ class _ConfluenceContent:
                     )
 
 
+@traced_methods
 class Blogpost(_ConfluenceContent):
     def __init__(self, confluence_instance, spacekey=None, title=None, labels=None,
                  body=None, attachments=None, append_attachment_macros=True, content_id=None, date=None, **kwargs):
@@ -328,6 +333,7 @@ class Blogpost(_ConfluenceContent):
                          **kwargs)
 
 
+@traced_methods
 class Page(_ConfluenceContent):
     def __init__(self, confluence_instance, spacekey=None, title=None, labels=None,
                  body=None, parent_id=None, attachments=None, append_attachment_macros=True, content_id=None, **kwargs):
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Cache of content body conversions (wiki -> storage, storage -> view) done by the server
+
+Conversions are keyed by a hash of the source representation, the target representation and the content. Results are
+kept in memory, least recently used first out, and optionally in a directory, so they survive the process. Concurrent
+requests for the same conversion wait for the first one, so no conversion ever reaches the server twice.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def conversion_key(representation, to, value):
+    """Provide the cache key of converting value from representation to the representation to"""
+    digest = hashlib.sha256()
+    for part in (representation, to, value):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ConversionCache(object):
+
+    def __init__(self, maxsize=1024, directory=None):
+        """
+        :param maxsize: OPTIONAL: Maximum number of conversions kept in memory. Default: 1024
+        :param directory: OPTIONAL: Directory storing all conversions on disk. Default: None (memory only)
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._running = {}
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def convert(self, representation, to, value, convert):
+        """
+        Provide the conversion of value from the cache, calling convert(value) on the first request only
+        :param representation: The representation of value, e.g. wiki
+        :param to: The representation to convert to, e.g. storage
+        :param value: The content to convert
+        :param convert: Function doing the conversion on the server
+        :return: The result of convert(value)
+        """
+        key = conversion_key(representation, to, value)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            running = self._running.get(key)
+            if running is None:
+                running = self._running[key] = _RunningConversion()
+                first = True
+            else:
+                first = False
+        if not first:
+            running.done.wait()
+            if running.error is not None:
+                raise running.error
+            with self._lock:
+                self.hits += 1
+            return running.result
+        try:
+            result = self._load(key)
+            if result is None:
+                result = convert(value)
+                self._store(key, result)
+                with self._lock:
+                    self.misses += 1
+            else:
+                with self._lock:
+                    self.hits += 1
+            running.result = result
+            with self._lock:
+                self._memory[key] = result
+                while len(self._memory) > self.maxsize:
+                    self._memory.popitem(last=False)
+        except Exception as e:
+            running.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._running[key]
+            running.done.set()
+        return result
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._filename(key)) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def _store(self, key, result):
+        if self.directory is None:
+            return
+        filename = self._filename(key)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # write a temporary file first, so concurrent readers never see partial results
+        tmpname = filename + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmpname, 'w') as cache_file:
+            json.dump(result, cache_file)
+        os.replace(tmpname, filename)
+
+    def clear(self):
+        """Forget all conversions kept in memory"""
+        with self._lock:
+            self._memory.clear()
+
+
+class _RunningConversion(object):
+    """A conversion other threads are waiting for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Cache of the users and groups of a Confluence server
+
+Users are kept by user key and by username for ttl seconds, optionally in a JSON file so they survive the process.
+Listing a group (e.g. confluence-users) stores all its members with a few paginated requests; only users that are not
+known yet are looked up one by one, concurrently, each of them once.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+
+class UserDirectory(object):
+
+    def __init__(self, confluence, ttl=3600, filename=None, parallel=8):
+        """
+        :param confluence: confluence.Confluence REST client, or None for the client it is passed to as user_directory
+        :param ttl: OPTIONAL: Seconds a user or group is kept. Default: 3600
+        :param filename: OPTIONAL: JSON file the directory is loaded from and saved to. Default: None (memory only)
+        :param parallel: OPTIONAL: Maximum number of concurrent user lookups. Default: 8
+        """
+        self.confluence = confluence
+        self.ttl = ttl
+        self.filename = filename
+        self.parallel = parallel
+        # (time stored, user or None for unknown users)
+        self._by_key = {}
+        self._by_name = {}
+        # group name -> (time stored, list of usernames)
+        self._groups = {}
+        self._lock = threading.Lock()
+        if filename is not None and os.path.isfile(filename):
+            self.load()
+
+    def _valid(self, entry):
+        return entry is not None and time.time() - entry[0] < self.ttl
+
+    def _store(self, user, userkey=None, username=None):
+        """Store user, or that userkey/username is unknown if user is None"""
+        now = time.time()
+        with self._lock:
+            if user is not None:
+                userkey = user.get('userKey', userkey)
+                username = user.get('username', username)
+            if userkey is not None:
+                self._by_key[userkey] = (now, user)
+            if username is not None:
+                self._by_name[username] = (now, user)
+
+    @staticmethod
+    def _found(response):
+        # unknown users are answered with an error message instead
+        return response if response and 'statusCode' not in response else None
+
+    def user_by_key(self, userkey):
+        """Provide the details of the user with userkey, or None for unknown users"""
+        with self._lock:
+            entry = self._by_key.get(userkey)
+        if self._valid(entry):
+            return entry[1]
+        user = self._found(self.confluence.get_user_details_by_userkey(userkey))
+        self._store(user, userkey=userkey)
+        return user
+
+    def user_by_name(self, username):
+        """Provide the details of the user with username, or None for unknown users"""
+        with self._lock:
+            entry = self._by_name.get(username)
+        if self._valid(entry):
+            return entry[1]
+        user = self._found(self.confluence.get_user_details_by_username(username))
+        self._store(user, username=username)
+        return user
+
+    def resolve_keys(self, userkeys):
+        """Provide the details of many users as dictionary userkey -> user (None for unknown users)"""
+        return self._resolve(userkeys, self.user_by_key)
+
+    def resolve_names(self, usernames):
+        """Provide the details of many users as dictionary username -> user (None for unknown users)"""
+        return self._resolve(usernames, self.user_by_name)
+
+    def _resolve(self, ids, lookup):
+        ids = set(ids)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            return dict(zip(ids, executor.map(lookup, ids)))
+
+    def group_members(self, group_name):
+        """Provide the usernames of all members of a group, storing their details in the directory"""
+        with self._lock:
+            entry = self._groups.get(group_name)
+        if self._valid(entry):
+            return entry[1]
+        usernames = []
+        for user in self.confluence.iter_group_members(group_name):
+            self._store(user)
+            usernames.append(user.get('username'))
+        with self._lock:
+            self._groups[group_name] = (time.time(), usernames)
+        return usernames
+
+    def load(self):
+        """Read the directory from filename, dropping expired entries"""
+        with open(self.filename) as directory_file:
+            stored = json.load(directory_file)
+        with self._lock:
+            for name in ('by_key', 'by_name', 'groups'):
+                entries = getattr(self, '_' + name)
+                for key, entry in stored.get(name, {}).items():
+                    if self._valid(entry):
+                        entries[key] = tuple(entry)
+
+    def save(self):
+        """Write the directory to filename"""
+        with self._lock:
+            stored = {'by_key': dict(self._by_key), 'by_name': dict(self._by_name), 'groups': dict(self._groups)}
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as directory_file:
+            json.dump(stored, directory_file)
+        os.replace(tmpname, self.filename)
+
+    def clear(self):
+        """Forget all users and groups"""
+        with self._lock:
+            self._by_key.clear()
+            self._by_name.clear()
+            self._groups.clear()
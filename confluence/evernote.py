@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Bulk import of Evernote notes into a space, as blog posts dated like the notes or as pages
+
+Notes are read from ENEX exports, from HTML notes (Evernote's "Export as HTML") and from directories of both. ENEX
+files are parsed incrementally, note by note, so exports of thousands of notes never reside in memory at once. Every
+note is converted into the Confluence storage format in a process pool, with the lxml parser when it is installed.
+Embedded resources (en-media) and local files referenced by HTML notes are written to or taken from disk and uploaded
+as attachments from there, shown in place by ac:image or view-file macros. The converted notes are published
+concurrently by a single Confluence client, i.e. over one authenticated session:
+
+    report = import_notes(confluence, 'CFELCMI', ['Notebook.enex'], labels=['evernote_export'])
+"""
+
+import base64
+import concurrent.futures
+import datetime
+import hashlib
+import html
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from urllib.parse import unquote, urlsplit
+
+from .bytesIO import clean_string
+
+NOTE_EXTENSIONS = ('.enex', '.html', '.htm')
+ENEX_TIME = '%Y%m%dT%H%M%SZ'
+
+_MEDIA = re.compile(r'<en-media\b([^>]*?)/?>(?:\s*</en-media>)?', re.IGNORECASE)
+_TODO = re.compile(r'<en-todo\b([^>]*?)/?>(?:\s*</en-todo>)?', re.IGNORECASE)
+_DECLARATION = re.compile(r'<\?xml[^>]*\?>|<!DOCTYPE[^>]*>', re.IGNORECASE)
+_CRYPT = re.compile(r'<en-crypt\b[^>]*>.*?</en-crypt>', re.IGNORECASE | re.DOTALL)
+_ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+# placeholder of a macro while the note is parsed as HTML, which would break up the namespaced macro elements
+_MARKER = re.compile('\ue000(\\d+)\ue001')
+# characters that are not allowed in labels
+_LABEL = re.compile(r'[\s:;,.?&\[\]()#^*@!]+')
+
+
+def _marker(number):
+    return '\ue000{0}\ue001'.format(number)
+
+
+def image_macro(filename):
+    """Provide the storage format of an attached image shown in place"""
+    return '<ac:image><ri:attachment ri:filename="{0}" /></ac:image>'.format(html.escape(filename))
+
+
+def file_macro(filename):
+    """Provide the storage format of an attached file shown in place, see Confluence.attachment_macro"""
+    return ('<ac:structured-macro ac:name="view-file" ac:schema-version="1"><ac:parameter ac:name="name">'
+            '<ri:attachment ri:filename="{0}" /></ac:parameter></ac:structured-macro>').format(html.escape(filename))
+
+
+def link_macro(filename, text):
+    """Provide the storage format of a link to an attached file"""
+    return ('<ac:link><ri:attachment ri:filename="{0}" /><ac:plain-text-link-body><![CDATA[{1}]]>'
+            '</ac:plain-text-link-body></ac:link>').format(html.escape(filename), text.replace(']]>', ']] >'))
+
+
+def label_of(tag):
+    """Provide the label of an Evernote tag, which may contain spaces and punctuation, e.g. 'Beamtime 2019' ->
+    beamtime_2019"""
+    return _LABEL.sub('_', tag.strip().lower()).strip('_')
+
+
+def _soup(markup):
+    # imported on first use, it is needed by the import of notes only
+    from bs4 import BeautifulSoup, FeatureNotFound
+    try:
+        return BeautifulSoup(markup, 'lxml')
+    except FeatureNotFound:
+        return BeautifulSoup(markup, 'html.parser')
+
+
+def _iterparse(filename):
+    try:
+        from lxml import etree
+    except ImportError:
+        from xml.etree import ElementTree
+        return ElementTree.iterparse(filename, events=('start', 'end'))
+    # resources are embedded as base64 text, which may exceed the default size limit of lxml
+    return etree.iterparse(filename, events=('start', 'end'), huge_tree=True, resolve_entities=False)
+
+
+def read_enex(filename):
+    """
+    Read the notes of an ENEX export one by one, without holding the export in memory
+    :param filename: The ENEX file
+    :return: Generator of notes as read, dictionaries with source, title, content (ENML), created (ENEX time), tags and
+             resources (list of dictionaries with the base64 data, mime type and filename)
+    """
+    root = None
+    for event, element in _iterparse(filename):
+        if root is None:
+            root = element
+        if event != 'end' or element.tag != 'note':
+            continue
+        title = (element.findtext('title') or '').strip()
+        yield {'source': os.path.basename(filename) + ': ' + title,
+               'title': title,
+               'content': element.findtext('content') or '',
+               'created': element.findtext('created'),
+               'tags': [tag.text for tag in element.findall('tag') if tag.text],
+               'resources': [{'data': resource.findtext('data') or '',
+                              'mime': resource.findtext('mime') or 'application/octet-stream',
+                              'filename': resource.findtext('resource-attributes/file-name')}
+                             for resource in element.findall('resource')]}
+        # drop the note just read
+        root.clear()
+
+
+def read_notes(sources):
+    """
+    Read the notes of ENEX exports, HTML notes and directories of both, in this order
+    :param sources: List of files and directories
+    :return: Generator of notes, see read_enex; HTML notes are dictionaries with source and path, they are parsed by
+             convert_note
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            filenames = [os.path.join(source, name) for name in sorted(os.listdir(source))
+                         if os.path.splitext(name)[1].lower() in NOTE_EXTENSIONS]
+        else:
+            filenames = [source]
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() == '.enex':
+                for note in read_enex(filename):
+                    yield note
+            else:
+                yield {'source': filename, 'path': filename}
+
+
+def convert_note(note, spool):
+    """
+    Convert a note read by read_notes into the storage format and write its resources into a new directory in spool
+    This runs in the processes of import_notes, so it only takes and returns picklable values.
+    :return: Dictionary with source, title, body, created (datetime or None), tags, attachments (list of file names)
+             and directory (the directory to remove after publishing)
+    """
+    directory = tempfile.mkdtemp(dir=spool)
+    if 'path' in note:
+        converted = _convert_html(note['path'], directory)
+    else:
+        converted = _convert_enex(note, directory)
+    converted.update(source=note['source'], directory=directory)
+    converted['title'] = converted['title'] or 'Untitled note'
+    return converted
+
+
+def _unique(filename, names):
+    """Provide filename as it is attached, i.e. cleaned by clean_string, and distinct from the names already used"""
+    cleaned = clean_string(filename) or 'attachment'
+    stem, extension = os.path.splitext(cleaned)
+    number = 1
+    while cleaned in names:
+        number += 1
+        cleaned = stem + '_' + str(number) + extension
+    names.add(cleaned)
+    return cleaned
+
+
+def _convert_enex(note, directory):
+    attachments = []
+    media = {}
+    names = set()
+    for resource in note['resources']:
+        data = base64.b64decode(resource['data'])
+        digest = hashlib.md5(data).hexdigest()
+        name = _unique(resource['filename'] or digest + (mimetypes.guess_extension(resource['mime']) or ''), names)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as out_file:
+            out_file.write(data)
+        attachments.append(path)
+        media[digest] = (name, resource['mime'])
+
+    macros = []
+
+    def embed(match):
+        # en-media refers to its resource by the MD5 hash of the data
+        name, mime = media.get(dict(_ATTRIBUTE.findall(match.group(1))).get('hash', ''), (None, None))
+        if name is None:
+            return ''
+        macros.append(image_macro(name) if mime.startswith('image/') else file_macro(name))
+        return _marker(len(macros) - 1)
+
+    def todo(match):
+        return '&#9745; ' if dict(_ATTRIBUTE.findall(match.group(1))).get('checked') == 'true' else '&#9744; '
+
+    content = _DECLARATION.sub('', note['content'])
+    content = _CRYPT.sub('[encrypted]', _TODO.sub(todo, _MEDIA.sub(embed, content)))
+    soup = _soup(content)
+    root = soup.find('en-note') or soup.body or soup
+    created = None
+    if note['created']:
+        created = datetime.datetime.strptime(note['created'], ENEX_TIME).replace(tzinfo=datetime.timezone.utc)
+    return {'title': note['title'],
+            'body': _MARKER.sub(lambda match: macros[int(match.group(1))], root.decode_contents()),
+            'created': created,
+            'tags': note['tags'],
+            'attachments': attachments}
+
+
+def _convert_html(path, directory):
+    with open(path, 'rb') as in_file:
+        soup = _soup(in_file.read())
+
+    def meta(name):
+        tag = soup.find('meta', attrs={'name': name})
+        return tag.get('content') if tag is not None else None
+
+    notedir = os.path.realpath(os.path.dirname(path))
+    attachments = []
+    attached = {}
+    names = set()
+    macros = []
+    for tag in soup.find_all(['img', 'a']):
+        reference = tag.get('src' if tag.name == 'img' else 'href')
+        if not reference or urlsplit(reference).scheme or reference.startswith('#'):
+            continue
+        filename = os.path.realpath(os.path.join(notedir, unquote(urlsplit(reference).path)))
+        # only files in the directory of the note, so a crafted note cannot upload any other local file
+        if os.path.commonpath([notedir, filename]) != notedir or not os.path.isfile(filename):
+            continue
+        if filename not in attached:
+            name = _unique(os.path.basename(filename), names)
+            if name == clean_string(os.path.basename(filename)):
+                attachments.append(filename)
+            else:
+                # the attachment is named after the file, so a copy with the distinct name is uploaded
+                shutil.copyfile(filename, os.path.join(directory, name))
+                attachments.append(os.path.join(directory, name))
+            attached[filename] = name
+        name = attached[filename]
+        macros.append(image_macro(name) if tag.name == 'img' else link_macro(name, tag.get_text() or name))
+        tag.replace_with(_marker(len(macros) - 1))
+
+    created = meta('created')
+    if created:
+        # imported on first use, like in content
+        import dateutil.parser
+        created = dateutil.parser.parse(created)
+    root = soup.body or soup
+    return {'title': soup.title.get_text().strip() if soup.title else os.path.splitext(os.path.basename(path))[0],
+            'body': _MARKER.sub(lambda match: macros[int(match.group(1))], root.decode_contents()),
+            'created': created,
+            'tags': [tag.strip() for tag in (meta('keywords') or '').split(',') if tag.strip()],
+            'attachments': attachments}
+
+
+def publish_note(confluence, spacekey, note, content_type='blogpost', labels=(), parent_id=None):
+    """
+    Publish a note converted by convert_note, with its attachments, tags and labels
+    :param confluence: confluence.Confluence REST client
+    :param spacekey: The spacekey
+    :param note: The converted note
+    :param content_type: OPTIONAL: blogpost, dated like the note, or page. Default: blogpost
+    :param labels: OPTIONAL: Labels added to every note, besides its tags
+    :param parent_id: OPTIONAL: The parent of a page
+    :return: The new content
+    """
+    content = confluence.create_page(spacekey, note['title'], note['body'], parent_id, content_type,
+                                     date=note['created'] if content_type == 'blogpost' else None)
+    for filename in note['attachments']:
+        confluence.attach_file_to_content_by_id(filename, content['id'])
+    names = list(labels) + [label for label in (label_of(tag) for tag in note['tags']) if label]
+    if names:
+        confluence.set_content_labels(content['id'], names)
+    return content
+
+
+def import_notes(confluence, spacekey, sources, content_type='blogpost', labels=(), parent_id=None, processes=None,
+                 parallel=4, progress=None):
+    """
+    Import notes into a space, see the module documentation
+    :param confluence: confluence.Confluence REST client
+    :param spacekey: The spacekey
+    :param sources: List of ENEX files, HTML notes and directories of both
+    :param content_type: OPTIONAL: blogpost, dated like the note, or page. Default: blogpost
+    :param labels: OPTIONAL: Labels added to every note, besides its tags
+    :param parent_id: OPTIONAL: The parent of pages. Default: the homepage of the space
+    :param processes: OPTIONAL: Number of processes converting notes. Default: number of CPUs
+    :param parallel: OPTIONAL: Maximum number of notes published concurrently. Default: 4
+    :param progress: OPTIONAL: Function called with a message for every imported or failed note
+    :return: Dictionary with the numbers of published notes and attachments and the failed notes as dictionary
+             source -> error message
+    """
+    if content_type not in ('blogpost', 'page'):
+        raise ValueError('Notes are imported as blogpost or page, not ' + str(content_type))
+    if content_type == 'page' and parent_id is None:
+        parent_id = confluence.get_space(spacekey)["homepage"]["id"]
+    processes = processes or os.cpu_count() or 1
+    report = {'published': 0, 'attachments': 0, 'failed': {}}
+
+    def failed(source, error):
+        report['failed'][source] = str(error)
+        if progress is not None:
+            progress('Import of ' + source + ' failed: ' + str(error))
+
+    def converted(done):
+        for future in done:
+            source = converting.pop(future)
+            try:
+                note = future.result()
+            except Exception as e:
+                # whatever the parsers raise on a broken note, the other notes are imported
+                failed(source, e)
+                continue
+            future = publisher.submit(publish_note, confluence, spacekey, note, content_type, labels, parent_id)
+            publishing[future] = note
+
+    def published(done):
+        for future in done:
+            note = publishing.pop(future)
+            try:
+                content = future.result()
+            except Exception as e:
+                # e.g. an error of the server or an unexpected response, the other notes are imported
+                failed(note['source'], e)
+                continue
+            finally:
+                shutil.rmtree(note['directory'], ignore_errors=True)
+            report['published'] += 1
+            report['attachments'] += len(note['attachments'])
+            if progress is not None:
+                progress('Imported ' + note['title'] + ' (' + str(len(note['attachments'])) + ' attachments) as '
+                         + content_type + ' ' + content['id'])
+
+    spool = tempfile.mkdtemp(prefix='evernote-')
+    converting = {}
+    publishing = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as converter, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as publisher:
+            for note in read_notes(sources):
+                # a few notes are queued beyond the running ones, further notes are read when they finish
+                if len(converting) >= 2 * processes:
+                    converted(concurrent.futures.wait(converting,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED).done)
+                if len(publishing) >= 2 * parallel:
+                    published(concurrent.futures.wait(publishing,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED).done)
+                converting[converter.submit(convert_note, note, spool)] = note['source']
+            converted(concurrent.futures.wait(converting).done)
+            published(concurrent.futures.wait(publishing).done)
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+    return report
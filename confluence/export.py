@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Bulk export of pages and blog posts as PDF files, e.g. of a whole experiment tree for archiving
+
+The content is streamed with a paginated CQL search, and up to parallel PDF exports run concurrently while further
+results are read. Every PDF is streamed straight into its file (see Confluence.export_content_as_pdf), and only a
+bounded number of exports is queued at once, so memory stays flat however large the exported tree or the PDFs are.
+Existing files are skipped, so an interrupted export continues where it stopped when it is run again.
+"""
+
+import concurrent.futures
+import os
+import re
+
+import requests
+
+# characters that are not allowed in file names on common file systems
+_UNSAFE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def pdf_filename(content):
+    """Provide the file name of the PDF of a content: its id and title, e.g. 12345 Beamtime 2019.pdf"""
+    title = _UNSAFE.sub('_', content.get('title', '')).strip(' .')[:100]
+    return content['id'] + (' ' + title if title else '') + '.pdf'
+
+
+def export_cql(space=None, root_id=None):
+    """Provide the CQL query of the pages and blog posts of a space, or of the page tree below (and including) root_id"""
+    if root_id is not None:
+        cql = '(id={root} OR ancestor={root})'.format(root=root_id)
+        if space is not None:
+            cql += ' AND space="{space}"'.format(space=space)
+        return cql
+    if space is not None:
+        return 'space="{space}" AND type in (page, blogpost)'.format(space=space)
+    raise ValueError('export requires a space, a root page or a CQL query')
+
+
+def export_pdfs(confluence, directory, space=None, root_id=None, cql=None, parallel=4, overwrite=False,
+                progress=None):
+    """
+    Export pages and blog posts as PDF files into directory
+    :param confluence: confluence.Confluence REST client
+    :param directory: The directory of the PDF files, created if needed
+    :param space: OPTIONAL: Export all pages and blog posts of this space
+    :param root_id: OPTIONAL: Only export the page tree below (and including) this page
+    :param cql: OPTIONAL: Export the content matching this CQL query instead, e.g. 'label="published"'
+    :param parallel: OPTIONAL: Maximum number of concurrent exports. Default: 4
+    :param overwrite: OPTIONAL: Export content whose file exists already again. Default: False
+    :param progress: OPTIONAL: Function called with a message for every exported, skipped or failed content
+    :return: Dictionary with the numbers of exported and skipped contents, the bytes written and the failed contents
+             as dictionary id -> error message
+    """
+    if cql is None:
+        cql = export_cql(space, root_id)
+    os.makedirs(directory, exist_ok=True)
+    report = {'exported': 0, 'skipped': 0, 'bytes': 0, 'failed': {}}
+
+    def finished(done):
+        for future in done:
+            content, filename = pending.pop(future)
+            try:
+                report['bytes'] += future.result()
+            except requests.RequestException as e:
+                report['failed'][content['id']] = str(e)
+                message = 'Export of ' + content['title'] + ' failed: ' + str(e)
+            else:
+                report['exported'] += 1
+                message = 'Exported ' + filename
+            if progress is not None:
+                progress(message)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        pending = {}
+        for content in confluence.iter_content_by_cql(cql):
+            filename = pdf_filename(content)
+            path = os.path.join(directory, filename)
+            if not overwrite and os.path.exists(path):
+                report['skipped'] += 1
+                if progress is not None:
+                    progress('Skipping ' + filename + ' (exported already)')
+                continue
+            # a few exports are queued beyond the running ones, further results are read when they finish
+            if len(pending) >= 2 * parallel:
+                finished(concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED).done)
+            pending[executor.submit(confluence.export_content_as_pdf, content['id'], path)] = (content, filename)
+        finished(concurrent.futures.wait(pending).done)
+    return report
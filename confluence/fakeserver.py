@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """In-process stand-in for a Confluence server, for benchmarks and trying out scripts without a real server
+
+FakeConfluence serves the REST and XML-RPC endpoints used by this package over http on localhost, from spaces with a
+configurable number of pages, blog posts, comments and attachments held in memory. Every request can be delayed to
+mimic the latency of a real server, and all requests are counted by endpoint:
+
+    with FakeConfluence(pages=100, attachments=2, latency=0.01) as server:
+        confluence = Confluence('user', 'password', url=server.url)
+        ...
+        print(server.counts)
+
+Any username and password are accepted. Only the parts of the API used by this package are implemented, with the
+simplest behaviour that keeps the callers working; CQL is understood as far as space, type, id, ancestor, container
+and status terms go.
+"""
+
+import collections
+import datetime
+import email.parser
+import itertools
+import json
+import re
+import threading
+import time
+import xmlrpc.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+from xmlrpc.server import SimpleXMLRPCDispatcher
+
+
+class FakeConfluence(object):
+
+    def __init__(self, spaces=('DEMO',), pages=20, blogs=5, comments=1, attachments=1, attachment_size=1024,
+                 users=100, latency=0., host='localhost', port=0):
+        """
+        :param spaces: OPTIONAL: The keys of the spaces. Default: ('DEMO',)
+        :param pages: OPTIONAL: Number of pages of every space, including its homepage. Default: 20
+        :param blogs: OPTIONAL: Number of blog posts of every space. Default: 5
+        :param comments: OPTIONAL: Number of comments on every page and blog post. Default: 1
+        :param attachments: OPTIONAL: Number of attachments of every page and blog post. Default: 1
+        :param attachment_size: OPTIONAL: Bytes of every attachment. Default: 1024
+        :param users: OPTIONAL: Number of users, all of them members of every group. Default: 100
+        :param latency: OPTIONAL: Seconds every request is delayed. Default: 0
+        :param host: OPTIONAL: Default: localhost
+        :param port: OPTIONAL: Default: 0 (any free port)
+        """
+        self.latency = latency
+        self.counts = collections.Counter()
+        self.spaces = collections.OrderedDict()
+        self.contents = collections.OrderedDict()
+        self.permissions = collections.defaultdict(lambda: collections.defaultdict(set))
+        self._ids = itertools.count(1000)
+        self._lock = threading.RLock()
+        self._attachment_size = attachment_size
+        self.users = ['user' + str(number) for number in range(users)]
+        for key in spaces:
+            self._populate(key, pages, blogs, comments, attachments)
+        self._rpc = SimpleXMLRPCDispatcher(allow_none=True)
+        for name in dir(self):
+            if name.startswith('rpc_'):
+                self._rpc.register_function(getattr(self, name), 'confluence2.' + name[len('rpc_'):])
+        self._httpd = ThreadingHTTPServer((host, port), _FakeRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """The base url of the server, including the trailing slash"""
+        return 'http://{0}:{1}/'.format(*self._httpd.server_address[:2])
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.counts[endpoint] += 1
+
+    ### BEGIN content
+    def _new_id(self):
+        return str(next(self._ids))
+
+    def _populate(self, key, pages, blogs, comments, attachments):
+        self.create_space(key, 'Space ' + key)
+        homepage = self.spaces[key]['homepage']
+        for number in range(1, pages):
+            # a tree with up to ten children per page
+            parent = homepage if number < 10 else self._space_pages(key)[number // 10]
+            self.create_content(key, 'page', 'Page ' + str(number), '<p>Page ' + str(number) + ' of ' + key + '</p>',
+                                parent=parent)
+        for number in range(blogs):
+            self.create_content(key, 'blogpost', 'Blog post ' + str(number), '<p>Blog post ' + str(number) + '</p>')
+        for content in list(self.contents.values()):
+            if content['space'] != key or content['type'] not in ('page', 'blogpost'):
+                continue
+            for number in range(comments):
+                self.create_content(key, 'comment', 'Re: ' + content['title'], '<p>Comment ' + str(number) + '</p>',
+                                    container=content['id'])
+            data = (bytes(range(256)) * (self._attachment_size // 256 + 1))[:self._attachment_size]
+            for number in range(attachments):
+                self.create_attachment(content['id'], 'file' + str(number) + '.bin', data)
+
+    def _space_pages(self, key):
+        return [content['id'] for content in self.contents.values()
+                if content['space'] == key and content['type'] == 'page']
+
+    def create_space(self, key, name):
+        with self._lock:
+            self.spaces[key] = {'key': key, 'name': name, 'labels': [], 'homepage': None}
+            self.spaces[key]['homepage'] = self.create_content(key, 'page', name + ' Home', '<p>' + name + '</p>')
+            self.permissions[key]['confluence-users'].add('VIEWSPACE')
+        return self.spaces[key]
+
+    def create_content(self, space, content_type, title, body, parent=None, container=None, date=None):
+        now = datetime.datetime.now().replace(microsecond=0)
+        with self._lock:
+            content = {'id': self._new_id(), 'type': content_type, 'status': 'current', 'space': space,
+                       'title': title, 'body': body, 'version': 1, 'parent': parent, 'container': container,
+                       'labels': [], 'created': date or now, 'modified': now, 'creator': 'admin',
+                       'restrictions': {'read': [], 'update': []}}
+            self.contents[content['id']] = content
+        return content['id']
+
+    def create_attachment(self, container, filename, data):
+        with self._lock:
+            attachment_id = self.create_content(self.contents[container]['space'], 'attachment', filename, '',
+                                                container=container)
+            self.contents[attachment_id]['data'] = data
+        return attachment_id
+
+    def _children(self, content_id, content_type):
+        return [content for content in self.contents.values()
+                if content['type'] == content_type and content['container'] == content_id]
+
+    def _ancestors(self, content):
+        ancestors = []
+        # the parent may have been removed, like a draft purged before its children
+        while content['parent'] in self.contents:
+            content = self.contents[content['parent']]
+            ancestors.insert(0, content)
+        return ancestors
+
+    def _json(self, content):
+        """REST representation of content, with everything expanded"""
+        base = self.url.rstrip('/')
+        result = {'id': content['id'],
+                  'type': content['type'],
+                  'status': content['status'],
+                  'title': content['title'],
+                  'space': {'key': content['space'], 'name': self.spaces[content['space']]['name']},
+                  'version': {'number': content['version'], 'when': content['modified'].isoformat() + '.000Z'},
+                  'body': {'storage': {'value': content['body'], 'representation': 'storage'},
+                           'view': {'value': content['body'], 'representation': 'view'}},
+                  'ancestors': [{'id': ancestor['id'], 'type': ancestor['type'], 'title': ancestor['title']}
+                                for ancestor in self._ancestors(content)],
+                  'metadata': {'labels': {'results': [{'prefix': 'global', 'name': label}
+                                                      for label in content['labels']]}},
+                  'history': {'createdDate': content['created'].isoformat() + '.000Z',
+                              'lastUpdated': {'number': content['version']}},
+                  '_links': {'base': base, 'tinyui': '/x/' + content['id'],
+                             'webui': '/pages/viewpage.action?pageId=' + content['id']}}
+        if content['container'] is not None:
+            container = self.contents[content['container']]
+            result['container'] = {'id': container['id'], 'type': container['type'], 'title': container['title']}
+        if content['type'] == 'attachment':
+            result['extensions'] = {'fileSize': len(content['data'])}
+            result['_links']['download'] = ('/download/attachments/' + content['container'] + '/' + content['title']
+                                            + '?version=' + str(content['version']))
+        return result
+
+    def _summary(self, content):
+        """XML-RPC representation of content"""
+        return {'id': content['id'], 'space': content['space'], 'title': content['title'],
+                'url': self.url + 'pages/viewpage.action?pageId=' + content['id'],
+                'parentId': content['parent'] or '0', 'version': str(content['version']),
+                'created': content['created'], 'creator': content['creator'],
+                'modified': content['modified'], 'publishDate': content['created'], 'author': content['creator'],
+                'content': content['body']}
+    ### END content
+
+    ### BEGIN XML-RPC
+    def rpc_login(self, username, password):
+        return 'token-' + username
+
+    def rpc_logout(self, token):
+        return True
+
+    def rpc_getSpaces(self, token):
+        return [{'key': key, 'name': space['name'], 'url': self.url + 'display/' + key}
+                for key, space in self.spaces.items()]
+
+    def rpc_getSpace(self, token, key):
+        space = self.spaces[key]
+        return {'key': key, 'name': space['name'], 'homePage': space['homepage'],
+                'url': self.url + 'display/' + key}
+
+    def rpc_getPages(self, token, key):
+        return [self._summary(content) for content in self.contents.values()
+                if content['space'] == key and content['type'] == 'page']
+
+    def rpc_getPage(self, token, content_id):
+        return self._summary(self.contents[content_id])
+
+    def rpc_getBlogEntries(self, token, key):
+        return [self._summary(content) for content in self.contents.values()
+                if content['space'] == key and content['type'] == 'blogpost']
+
+    def rpc_getBlogEntry(self, token, content_id):
+        return self._summary(self.contents[content_id])
+
+    def rpc_search(self, token, query, maxresults):
+        key = re.search(r'spacekey=(\w+)', query).group(1)
+        blogs = [content for content in self.contents.values()
+                 if content['space'] == key and content['type'] == 'blogpost']
+        return [{'id': content['id'], 'title': content['title'], 'type': 'blogpost'}
+                for content in reversed(blogs)][:maxresults]
+
+    def rpc_getComments(self, token, content_id):
+        return [{'id': comment['id'], 'pageId': content_id, 'title': comment['title'], 'content': comment['body'],
+                 'created': comment['created'], 'creator': comment['creator']}
+                for comment in self._children(content_id, 'comment')]
+
+    def rpc_getAttachments(self, token, content_id):
+        return [{'id': attachment['id'], 'pageId': content_id, 'fileName': attachment['title'],
+                 'fileSize': str(len(attachment['data'])), 'created': attachment['created'],
+                 'url': (self.url + 'download/attachments/' + content_id + '/' + attachment['title']
+                         + '?version=1&modificationDate=' + str(int(attachment['modified'].timestamp() * 1000)))}
+                for attachment in self._children(content_id, 'attachment')]
+
+    def rpc_getAttachmentData(self, token, content_id, filename, version):
+        for attachment in self._children(content_id, 'attachment'):
+            if attachment['title'] == filename:
+                return xmlrpc.client.Binary(attachment['data'])
+        raise xmlrpc.client.Fault(0, 'No attachment ' + filename)
+
+    def rpc_renderContent(self, token, key, content_id, content, parameters):
+        return '<div class="wiki-content">' + self.contents[content_id]['body'] + '</div>'
+
+    def rpc_getSpacePermissionSets(self, token, key):
+        permissionsets = collections.defaultdict(list)
+        for entity, permissions in self.permissions[key].items():
+            for permission in permissions:
+                permissionsets[permission].append({'type': permission, 'groupName': entity})
+        return [{'type': permission, 'spacePermissions': entities}
+                for permission, entities in permissionsets.items()]
+
+    def rpc_addPermissionToSpace(self, token, permission, entity, key):
+        return self.rpc_addPermissionsToSpace(token, [permission], entity, key)
+
+    def rpc_addPermissionsToSpace(self, token, permissions, entity, key):
+        with self._lock:
+            self.permissions[key][entity].update(permissions)
+        return True
+
+    def rpc_addLabelByNameToSpace(self, token, label, key):
+        with self._lock:
+            if label not in self.spaces[key]['labels']:
+                self.spaces[key]['labels'].append(label)
+        return True
+    ### END XML-RPC
+
+    ### BEGIN REST
+    def rest(self, method, path, params, body, content_type):
+        """
+        Answer a REST request
+        :return: (status, JSON result or bytes)
+        """
+        for route_method, pattern, name in _ROUTES:
+            match = re.match(pattern + '$', path)
+            if match and route_method == method:
+                self.count(method + ' ' + name)
+                with self._lock:
+                    return getattr(self, 'rest_' + name)(params, body, content_type, *match.groups())
+        self.count(method + ' unknown')
+        return 404, {'statusCode': 404, 'message': 'No fake for ' + method + ' ' + path}
+
+    def _results(self, contents, params, limit=25, path=None):
+        """One page of contents; with path, the next page is linked by a cursor like the search of Confluence 7"""
+        if 'cursor' in params:
+            start = int(params['cursor'], 16)
+        else:
+            start = int(params.get('start', 0))
+        limit = int(params.get('limit', limit))
+        page = contents[start:start + limit]
+        result = {'results': page, 'start': start, 'limit': limit, 'size': len(page),
+                  '_links': {'base': self.url.rstrip('/')}}
+        if start + limit < len(contents):
+            if path is None:
+                result['_links']['next'] = '?start=' + str(start + limit)
+            else:
+                following = dict((name, value) for name, value in params.items() if name != 'start')
+                following.update(next='true', cursor='{:x}'.format(start + limit))
+                result['_links']['next'] = '/' + path + '?' + urlencode(following)
+        return result
+
+    def rest_content(self, params, body, content_type):
+        contents = [self._json(content) for content in self.contents.values()
+                    if content['space'] == params.get('spaceKey', content['space'])
+                    and content['title'] == params.get('title', content['title'])
+                    and content['type'] == params.get('type', 'page')
+                    and content['status'] == params.get('status', 'current')]
+        return 200, self._results(contents, params, path='rest/api/content')
+
+    def rest_content_get(self, params, body, content_type, content_id):
+        if content_id not in self.contents:
+            return 404, {'statusCode': 404, 'message': 'No content ' + content_id}
+        return 200, self._json(self.contents[content_id])
+
+    def rest_content_create(self, params, body, content_type):
+        data = json.loads(body)
+        parent = data['ancestors'][0]['id'] if data.get('ancestors') else None
+        if data['type'] == 'page' and parent is None:
+            parent = self.spaces[data['space']['key']]['homepage']
+        content_id = self.create_content(data['space']['key'], data['type'], data['title'],
+                                         data['body']['storage']['value'], parent=parent)
+        return 200, self._json(self.contents[content_id])
+
+    def rest_content_update(self, params, body, content_type, content_id):
+        data = json.loads(body)
+        content = self.contents[content_id]
+        if int(data['version']['number']) != content['version'] + 1:
+            return 409, {'statusCode': 409, 'message': 'Version must be incremented on update. Current version is: '
+                                                       + str(content['version'])}
+        content.update(title=data.get('title', content['title']), body=data['body']['storage']['value'],
+                       version=content['version'] + 1, modified=datetime.datetime.now().replace(microsecond=0))
+        return 200, self._json(content)
+
+    def rest_content_delete(self, params, body, content_type, content_id):
+        if content_id not in self.contents:
+            return 404, {'statusCode': 404, 'message': 'No content ' + content_id}
+        content = self.contents[content_id]
+        # drafts are removed right away, current content is moved to the trash and purged from there
+        if params.get('status') in ('trashed', 'draft') or content['status'] in ('trashed', 'draft'):
+            del self.contents[content_id]
+        else:
+            content['status'] = 'trashed'
+        return 204, b''
+
+    def rest_history(self, params, body, content_type, content_id):
+        content = self.contents[content_id]
+        return 200, {'createdDate': content['created'].isoformat() + '.000Z',
+                     'lastUpdated': {'number': content['version']}}
+
+    def rest_children(self, params, body, content_type, content_id, child_type):
+        if child_type == 'page':
+            children = [content for content in self.contents.values()
+                        if content['parent'] == content_id and content['type'] == 'page']
+        else:
+            children = self._children(content_id, child_type)
+        if 'filename' in params:
+            children = [child for child in children if child['title'] == params['filename']]
+        return 200, self._results([self._json(child) for child in children], params, limit=200)
+
+    def rest_attachment_create(self, params, body, content_type, content_id, attachment_id=None):
+        filename, data = _multipart_file(body, content_type)
+        if attachment_id is None:
+            attachment_id = self.create_attachment(content_id, filename, data)
+        else:
+            attachment = self.contents[attachment_id]
+            attachment.update(data=data, version=attachment['version'] + 1)
+        return 200, {'results': [self._json(self.contents[attachment_id])], 'size': 1}
+
+    def rest_attachment_update(self, params, body, content_type, content_id, attachment_id):
+        status, result = self.rest_attachment_create(params, body, content_type, content_id, attachment_id)
+        return status, result['results'][0]
+
+    def rest_label(self, params, body, content_type, content_id):
+        data = json.loads(body)
+        for label in (data if isinstance(data, list) else [data]):
+            if label['name'] not in self.contents[content_id]['labels']:
+                self.contents[content_id]['labels'].append(label['name'])
+        return 200, {'results': [{'prefix': 'global', 'name': label}
+                                 for label in self.contents[content_id]['labels']]}
+
+    def rest_restrictions(self, params, body, content_type, content_id):
+        restrictions = self.contents[content_id]['restrictions']
+        return 200, {operation: {'operation': operation,
+                                 'restrictions': {'user': {'results': [{'username': user} for user in users]},
+                                                  'group': {'results': []}}}
+                     for operation, users in restrictions.items()}
+
+    def rest_search_content(self, params, body, content_type):
+        matches = _CqlFilter(params.get('cql', ''), self)
+        contents = [self._json(content) for content in self.contents.values() if matches(content)]
+        return 200, self._results(contents, params, path='rest/api/content/search')
+
+    def rest_search(self, params, body, content_type):
+        cql = params.get('cql', '')
+        if re.match(r'\s*type\s*=\s*space', cql):
+            results = [{'space': {'key': key, 'name': space['name']}, 'entityType': 'space'}
+                       for key, space in self.spaces.items()]
+        else:
+            matches = _CqlFilter(cql, self)
+            results = [{'content': self._json(content), 'entityType': 'content'}
+                       for content in self.contents.values() if matches(content)]
+        return 200, self._results(results, params, path='rest/api/search')
+
+    def rest_space(self, params, body, content_type, key):
+        if key not in self.spaces:
+            return 404, {'statusCode': 404, 'message': 'No space with key : ' + key}
+        space = self.spaces[key]
+        return 200, {'key': key, 'name': space['name'],
+                     'homepage': self._json(self.contents[space['homepage']]),
+                     'metadata': {'labels': {'results': [{'prefix': label.split(':')[0] if ':' in label else 'global',
+                                                          'name': label.split(':')[-1]}
+                                                         for label in space['labels']]}},
+                     '_links': {'webui': '/display/' + key}}
+
+    def rest_spaces(self, params, body, content_type):
+        return 200, self._results([{'key': key, 'name': space['name']} for key, space in self.spaces.items()],
+                                  params)
+
+    def rest_space_create(self, params, body, content_type):
+        data = json.loads(body)
+        if data['key'] in self.spaces:
+            return 400, {'statusCode': 400, 'message': 'A space already exists with key ' + data['key']}
+        self.create_space(data['key'], data['name'])
+        return 200, self.rest_space(params, body, content_type, data['key'])[1]
+
+    def rest_convert(self, params, body, content_type, to):
+        data = json.loads(body)
+        return 200, {'value': '<p>' + data['value'] + '</p>', 'representation': to}
+
+    def rest_group_members(self, params, body, content_type, group_name):
+        return 200, self._results([self._user(username) for username in self.users], params, limit=200)
+
+    def _user(self, username):
+        return {'type': 'known', 'username': username, 'userKey': 'key-' + username, 'displayName': username.upper()}
+
+    def rest_user(self, params, body, content_type):
+        username = params.get('username') or params.get('key', '')[len('key-'):]
+        if username not in self.users:
+            return 404, {'statusCode': 404, 'message': 'No user ' + username}
+        return 200, self._user(username)
+
+    def rest_pdf(self, params, body, content_type):
+        content = self.contents[params['pageId']]
+        return 200, b'%PDF-1.4\n% ' + content['title'].encode('utf-8') + b'\n' + content['body'].encode('utf-8')
+
+    def rest_download(self, params, body, content_type, content_id, filename):
+        for attachment in self._children(content_id, 'attachment'):
+            if attachment['title'] == unquote(filename):
+                return 200, attachment['data']
+        return 404, {'statusCode': 404}
+    ### END REST
+
+
+_ROUTES = [
+    ('GET', r'rest/api/content/?', 'content'),
+    ('POST', r'rest/api/content/?', 'content_create'),
+    ('GET', r'rest/api/content/search', 'search_content'),
+    ('GET', r'rest/api/content/(\d+)', 'content_get'),
+    ('PUT', r'rest/api/content/(\d+)', 'content_update'),
+    ('DELETE', r'rest/api/content/(\d+)', 'content_delete'),
+    ('GET', r'rest/api/content/(\d+)/history', 'history'),
+    ('GET', r'rest/api/content/(\d+)/child/(page|comment|attachment)', 'children'),
+    ('POST', r'rest/api/content/(\d+)/child/attachment', 'attachment_create'),
+    ('POST', r'rest/api/content/(\d+)/child/attachment/(\d+)/data', 'attachment_update'),
+    ('POST', r'rest/api/content/(\d+)/label', 'label'),
+    ('GET', r'rest/api/content/(\d+)/restriction/byOperation', 'restrictions'),
+    ('GET', r'rest/api/search', 'search'),
+    ('GET', r'rest/api/space', 'spaces'),
+    ('POST', r'rest/api/space', 'space_create'),
+    ('GET', r'rest/api/space/([^/]+)', 'space'),
+    ('POST', r'rest/api/contentbody/convert/(\w+)', 'convert'),
+    ('GET', r'rest/api/group/([^/]+)/member', 'group_members'),
+    ('GET', r'rest/api/user', 'user'),
+    ('GET', r'spaces/flyingpdf/pdfpageexport\.action', 'pdf'),
+    ('GET', r'download/attachments/(\d+)/([^/]+)', 'download'),
+]
+
+
+class _CqlFilter(object):
+    """The subset of CQL used by this package: space, type, id, ancestor, container, status and parent terms and
+    lastmodified comparisons, joined with AND"""
+
+    TERM = re.compile(r'(space|type|id|ancestor|container|status|parent)\s*(=|in)\s*'
+                      r'("[^"]*"|\([^)]*\)|[^\s()]+)', re.IGNORECASE)
+
+    def __init__(self, cql, fake):
+        self.fake = fake
+        self.terms = []
+        for field, operator, value in self.TERM.findall(cql.replace('spaceKey=', '')):
+            values = [part.strip().strip('"') for part in value.strip('()').split(',')]
+            self.terms.append((field.lower(), set(values)))
+        # (id=1 OR ancestor=1) selects a page tree
+        self.tree = re.search(r'id\s*=\s*(\d+)\s+OR\s+ancestor\s*=\s*(\d+)', cql, re.IGNORECASE)
+        # lastmodified > "2019/01/31 12:00", with the precision of minutes
+        self.modified = [(operator, datetime.datetime.strptime(value.replace('-', '/'), '%Y/%m/%d %H:%M'))
+                         for operator, value in re.findall(r'lastmodified\s*(>=|>)\s*"([^"]+)"', cql, re.IGNORECASE)]
+
+    def __call__(self, content):
+        if self.tree:
+            root = self.tree.group(1)
+            if content['id'] != root and root not in [ancestor['id'] for ancestor in self.fake._ancestors(content)]:
+                return False
+        for field, values in self.terms:
+            if self.tree and field in ('id', 'ancestor'):
+                continue
+            if field == 'space' and content['space'] not in values:
+                return False
+            if field == 'type' and content['type'] not in values:
+                return False
+            if field == 'id' and content['id'] not in values:
+                return False
+            if field == 'container' and content['container'] not in values:
+                return False
+            if field == 'parent' and content['parent'] not in values:
+                return False
+            if field == 'ancestor' and not values & {ancestor['id'] for ancestor in self.fake._ancestors(content)}:
+                return False
+            if field == 'status' and content['status'] not in values:
+                return False
+        if not any(field == 'status' for field, values in self.terms) and content['status'] != 'current':
+            return False
+        for operator, since in self.modified:
+            modified = content['modified'].replace(second=0)
+            if modified < since or (operator == '>' and modified == since):
+                return False
+        return True
+
+
+def _multipart_file(body, content_type):
+    """Provide (filename, data) of the file of a multipart/form-data request"""
+    message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n'
+                                                    + body)
+    for part in message.get_payload():
+        if part.get_param('name', header='content-disposition') == 'file':
+            return part.get_param('filename', header='content-disposition'), part.get_payload(decode=True)
+    raise ValueError('No file in request')
+
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without this, every response waits for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = url.path.lstrip('/')
+        if method == 'POST' and path == 'rpc/xmlrpc':
+            method_name = xmlrpc.client.loads(body)[1]
+            fake.count('XML-RPC ' + method_name)
+            with fake._lock:
+                response = fake._rpc._marshaled_dispatch(body)
+            self._respond(200, response, 'text/xml')
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        status, result = fake.rest(method, path, params, body, self.headers.get('Content-Type', ''))
+        if isinstance(result, bytes):
+            self._respond(status, result, 'application/octet-stream')
+        else:
+            self._respond(status, json.dumps(result).encode('utf-8'), 'application/json')
+
+    def _respond(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
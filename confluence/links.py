@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Rewriting of server links in rendered Confluence content into links within a local backup
+
+All links are found with one compiled pattern and replaced in a single pass over the document:
+
+- attachments and thumbnails: /download/attachments/<id>/<file> -> ../attachments/<id>/<file>
+- pages: /pages/viewpage.action?pageId=<id> -> ../pages/<id>.html (or ../blogs/<id>.html)
+- pages and blog posts by space and title: /display/<space>/<title>, /display/<space>/<yyyy>/<mm>/<dd>/<title>
+- tiny links: /x/<code>
+
+Links to content that is not part of the backup are made absolute, so they still lead to the server.
+"""
+
+import base64
+import binascii
+import re
+from urllib.parse import quote, unquote, unquote_plus, urlsplit
+
+LINK_PATTERN = r'''
+    (?P<prefix>\b(?:href|src)=(?P<quote>["']))
+    (?P<server>{server})?
+    (?P<path>/(?:
+        download/(?:attachments|thumbnails)/(?P<attachment_id>\d+)/(?P<filename>[^"'?#]+)(?:\?[^"'#]*)?
+        | pages/viewpage\.action\?pageId=(?P<page_id>\d+)(?:&[^"'#]*)?
+        | (?P<display>display/[^"'?#]+)(?:\?[^"'#]*)?
+        | x/(?P<tiny>[A-Za-z0-9_-]+)
+    ))
+    (?P<anchor>\#[^"']*)?
+    (?=["'])
+'''
+
+
+def tinyui_id(code):
+    """Provide the content id encoded in the tiny link /x/<code>, or None"""
+    code = code.replace('-', '/').replace('_', '+')
+    if len(code) > 11:
+        return None
+    try:
+        return str(int.from_bytes(base64.b64decode(code.ljust(11, 'A') + '='), 'little'))
+    except (binascii.Error, ValueError):
+        return None
+
+
+class LinkRewriter(object):
+
+    def __init__(self, serverurl, local_paths=None, display_paths=None, attachments=True, base='../'):
+        """
+        :param serverurl: The base url of the server, e.g. https://confluence.desy.de/
+        :param local_paths: Dictionary content id -> local path, e.g. {'12345': 'pages/12345.html'}
+        :param display_paths: Dictionary of unquoted display paths -> local path,
+                              e.g. {'/display/CFELCMI/Home page': 'pages/12345.html'}. See add().
+        :param attachments: Rewrite attachment links to the local attachments folder
+        :param base: Prefix of local paths, relative to the rewritten document. Default: '../' for pages and blogs.
+        """
+        self.serverurl = serverurl.rstrip('/')
+        self.local_paths = local_paths if local_paths is not None else {}
+        self.display_paths = display_paths if display_paths is not None else {}
+        self.attachments = attachments
+        self.base = base
+        server = re.escape(self.serverurl)
+        # links may also use the server address with or without https
+        server = server.replace('https', 'https?', 1) if self.serverurl.startswith('https') else server
+        self.pattern = re.compile(LINK_PATTERN.format(server=server), re.VERBOSE)
+
+    def add(self, contentid, local_path, url=None):
+        """
+        Add a content to the backup
+        :param contentid: The content id
+        :param local_path: Its path within the backup, e.g. pages/12345.html
+        :param url: OPTIONAL: The url of the content on the server, e.g. the url of the XML-RPC page summary; its
+                    /display/... path is rewritten to local_path as well
+        """
+        self.local_paths[str(contentid)] = local_path
+        if url:
+            path = urlsplit(url).path
+            if path.startswith('/display/'):
+                self.display_paths[unquote_plus(path)] = local_path
+
+    def rewrite(self, html):
+        """Provide html with all links rewritten"""
+        return self.pattern.sub(self._replace, html)
+
+    def _replace(self, match):
+        local_path = None
+        if match.group('attachment_id'):
+            # attachments of content within the backup
+            if self.attachments and match.group('attachment_id') in self.local_paths:
+                local_path = ('attachments/' + match.group('attachment_id') + '/'
+                              + quote(unquote(match.group('filename'))))
+        elif match.group('page_id'):
+            local_path = self.local_paths.get(match.group('page_id'))
+        elif match.group('display'):
+            local_path = self.display_paths.get('/' + unquote_plus(match.group('display')))
+        elif match.group('tiny'):
+            local_path = self.local_paths.get(tinyui_id(match.group('tiny')))
+
+        if local_path is None:
+            target = self.serverurl + match.group('path')
+        else:
+            target = self.base + local_path
+        return match.group('prefix') + target + (match.group('anchor') or '')
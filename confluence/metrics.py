@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Prometheus metrics of the requests of long-running jobs
+
+Once enable() was called, every REST request (AtlassianRestAPI.request) and XML-RPC call is counted by method, endpoint
+template (e.g. rest/api/content/{id}) and status, with its latency and bytes sent and received; repeated calls are
+counted as retries. The metrics are provided in the Prometheus text format, by a local HTTP exporter or as text:
+
+    registry = metrics.enable()
+    registry.serve(port=9464)            # http://localhost:9464/metrics
+    ...
+    registry.save('backup.prom')         # e.g. for the textfile collector of the node exporter
+
+Until enable() is called, the only cost is one check per request.
+"""
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+# upper bounds of the latency histogram in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+# the enabled Registry, see enable()
+_registry = None
+
+
+def _labels(names, values):
+    return ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+class Registry(object):
+    """Counters and latency histograms of the requests"""
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: OPTIONAL: Upper bounds of the latency histogram in seconds. Default: BUCKETS
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.started = time.time()
+        self.requests = defaultdict(int)
+        self.request_bytes = defaultdict(int)
+        self.response_bytes = defaultdict(int)
+        self.retries = defaultdict(int)
+        # (method, endpoint) -> [count per bucket, ..., count above all buckets, sum of seconds]
+        self.latency = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, endpoint, status, seconds, request_bytes=0, response_bytes=0):
+        """
+        Count one request
+        :param method: GET, POST, ... or XML-RPC
+        :param endpoint: The endpoint template, e.g. rest/api/content/{id} or confluence2.getPage
+        :param status: The HTTP status, or e.g. error if there was no response
+        :param seconds: Latency of the request
+        """
+        labels = (method, endpoint)
+        with self._lock:
+            self.requests[labels + (str(status),)] += 1
+            self.request_bytes[labels] += request_bytes
+            self.response_bytes[labels] += response_bytes
+            histogram = self.latency.get(labels)
+            if histogram is None:
+                histogram = self.latency[labels] = [0] * (len(self.buckets) + 1) + [0.]
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+
+    def retry(self, reason):
+        """Count a repeated request, e.g. reason conflict or network"""
+        with self._lock:
+            self.retries[(reason,)] += 1
+
+    def quantile(self, q, method=None, endpoint=None):
+        """
+        Estimate a latency quantile from the histogram, like histogram_quantile of Prometheus
+        :param q: The quantile, e.g. 0.99
+        :param method: OPTIONAL: Only requests of this method. Default: None (all)
+        :param endpoint: OPTIONAL: Only requests of this endpoint template. Default: None (all)
+        :return: Seconds, or None if no request was counted
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        with self._lock:
+            for (label_method, label_endpoint), histogram in self.latency.items():
+                if method in (None, label_method) and endpoint in (None, label_endpoint):
+                    counts = [count + added for count, added in zip(counts, histogram)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def exposition(self):
+        """Provide all metrics in the Prometheus text format"""
+        lines = []
+
+        def family(name, kind, help_text, values, label_names):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in sorted(values.items()):
+                lines.append('{0}{{{1}}} {2}'.format(name, _labels(label_names, labels), value))
+
+        with self._lock:
+            family('confluence_requests_total', 'counter', 'Requests to the Confluence server', self.requests,
+                   ('method', 'endpoint', 'status'))
+            family('confluence_request_bytes_total', 'counter', 'Bytes sent in request bodies', self.request_bytes,
+                   ('method', 'endpoint'))
+            family('confluence_response_bytes_total', 'counter', 'Bytes received in response bodies',
+                   self.response_bytes, ('method', 'endpoint'))
+            family('confluence_retries_total', 'counter', 'Repeated requests', self.retries, ('reason',))
+            lines.append('# HELP confluence_request_seconds Latency of the requests to the Confluence server')
+            lines.append('# TYPE confluence_request_seconds histogram')
+            for labels, histogram in sorted(self.latency.items()):
+                label_text = _labels(('method', 'endpoint'), labels)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append('confluence_request_seconds_bucket{{{0},le="{1}"}} {2}'.format(label_text, bound,
+                                                                                               cumulative))
+                lines.append('confluence_request_seconds_sum{{{0}}} {1}'.format(label_text, histogram[-1]))
+                lines.append('confluence_request_seconds_count{{{0}}} {1}'.format(label_text, cumulative))
+        lines.append('# HELP confluence_metrics_start_time_seconds Time the metrics were enabled')
+        lines.append('# TYPE confluence_metrics_start_time_seconds gauge')
+        lines.append('confluence_metrics_start_time_seconds {0}'.format(self.started))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        """Write all metrics in the Prometheus text format to filename"""
+        with open(filename, 'w') as metrics_file:
+            metrics_file.write(self.exposition())
+
+    def serve(self, port=9464, host='localhost'):
+        """
+        Serve the metrics at http://host:port/metrics from a background thread
+        :return: The HTTP server; its shutdown() stops it
+        """
+        # imported on first use, see benchmarks/import_time.py
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+
+def registry():
+    """Provide the Registry requests are counted into, or None if metrics are disabled"""
+    return _registry
+
+
+def enable(registry=None):
+    """
+    Count all requests from now on
+    :param registry: OPTIONAL: Registry to count into. Default: None (a new Registry)
+    :return: The Registry
+    """
+    global _registry
+    _registry = registry if registry is not None else Registry()
+    return _registry
+
+
+def disable():
+    """Stop counting requests"""
+    global _registry
+    _registry = None
+
+
+def request(method, endpoint, status, seconds, request_bytes=0, response_bytes=0):
+    """Count one request, if metrics are enabled, see Registry.request"""
+    if _registry is not None:
+        _registry.request(method, endpoint, status, seconds, request_bytes, response_bytes)
+
+
+def retry(reason):
+    """Count a repeated request, if metrics are enabled"""
+    if _registry is not None:
+        _registry.retry(reason)
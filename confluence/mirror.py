@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Continuous mirror of Confluence spaces, built on the backups of confluence.clone
+
+Every space is saved completely once. Afterwards the mirror polls the server with a single CQL search for the content
+modified since the last poll (the cursor) and saves only the changed pages and blog posts, including those whose
+comments or attachments changed (see SpaceClone.saveChanges). The poll interval of every space adapts to its activity:
+it drops to the minimum after changes and grows up to the maximum while the space is idle.
+
+The cursors are persisted in a state file, so a restarted mirror continues where it stopped. Content deleted on the
+server is removed whenever changes are saved; in addition, every space is saved completely again after full_every
+seconds.
+"""
+
+import json
+import os
+import time
+
+from .clone import SpaceClone, SpaceProgress
+
+# format of times in CQL; they are interpreted in the time zone of the server, which is assumed to be the local one
+CQL_TIME = '%Y/%m/%d %H:%M'
+
+
+def changedContent(confluence, key, since):
+    """Provide the ids of the pages and blog posts of space key changed since the time since (seconds since the epoch)
+
+    Pages and blog posts whose comments or attachments changed are included.
+
+    :param confluence: confluence.Confluence REST client
+    """
+    cql = 'space="{0}" AND type in (page, blogpost, comment, attachment) AND lastmodified >= "{1}"'.format(
+        key, time.strftime(CQL_TIME, time.localtime(since)))
+    ids = set()
+    for content in confluence.iter_content_by_cql(cql, expand='container'):
+        if content["type"] in ('page', 'blogpost'):
+            ids.add(content["id"])
+        elif "container" in content:
+            ids.add(content["container"]["id"])
+    return ids
+
+
+class AdaptiveInterval(object):
+    """Poll interval that drops to minimum after changes and grows by factor up to maximum while nothing changes"""
+
+    def __init__(self, minimum=60., maximum=3600., factor=2., interval=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = interval if interval is not None else minimum
+
+    def update(self, changes):
+        """Adapt the interval to the number of changes found by the last poll and return it"""
+        if changes:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.maximum, self.interval * self.factor)
+        return self.interval
+
+
+class MirrorState(object):
+    """Cursors of all mirrored spaces in a JSON file, written atomically after every change"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.spaces = {}
+        if os.path.isfile(filename):
+            with open(filename, 'rt', encoding='utf-8') as state_file:
+                self.spaces = json.load(state_file)
+
+    def get(self, key):
+        """Provide the state of space key: dictionary with cursor, interval and full (time of the last complete save)"""
+        return self.spaces.setdefault(key, {})
+
+    def save(self):
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'wt', encoding='utf-8') as state_file:
+            json.dump(self.spaces, state_file, indent=1, sort_keys=True)
+        os.replace(temporary, self.filename)
+
+
+class SpaceMirror(object):
+    """Mirror of one space in the current directory, see mirror()"""
+
+    def __init__(self, srv, token, confluence, key, state, minimum=60., maximum=3600., full_every=86400.,
+                 overlap=120., **kwargs):
+        """
+        :param srv: XmlRpcServer
+        :param token: The authentification token
+        :param confluence: confluence.Confluence REST client, for the CQL searches
+        :param key: The spacekey
+        :param state: MirrorState
+        :param minimum: OPTIONAL: Minimum poll interval in seconds. Default: 60
+        :param maximum: OPTIONAL: Maximum poll interval in seconds. Default: 3600
+        :param full_every: OPTIONAL: Seconds after which the space is saved completely again. Default: 86400
+        :param overlap: OPTIONAL: Seconds every search reaches back before the cursor, for the precision of CQL times
+                        (minutes) and clock differences. Default: 120
+        :param kwargs: Options of SpaceClone, e.g. downloadAttach=False
+        """
+        self.srv = srv
+        self.token = token
+        self.confluence = confluence
+        self.key = key
+        self.state = state
+        self.full_every = full_every
+        self.overlap = overlap
+        self.options = kwargs
+        self.progress = SpaceProgress(key, prefix=True)
+        self.interval = AdaptiveInterval(minimum, maximum, interval=state.get(key).get('interval'))
+
+    def poll(self):
+        """Save the changes since the last poll, or the whole space if it is due; provide the number of changes"""
+        spacestate = self.state.get(self.key)
+        start = time.time()
+        if 'cursor' not in spacestate or start - spacestate.get('full', 0) > self.full_every:
+            self.progress('Saving the complete space')
+            SpaceClone(self.srv, self.token, self.key, progress=self.progress, confluence=self.confluence,
+                       **self.options).run()
+            spacestate['full'] = start
+            changes = None
+        else:
+            changed = changedContent(self.confluence, self.key, spacestate['cursor'] - self.overlap)
+            changes = len(changed)
+            if changed:
+                self.progress(str(changes) + ' changed pages/blog posts')
+                SpaceClone(self.srv, self.token, self.key, progress=self.progress, confluence=self.confluence,
+                           **self.options).run(changed)
+        spacestate['cursor'] = start
+        spacestate['interval'] = self.interval.update(changes)
+        self.state.save()
+        return changes
+
+
+def mirror(srv, token, confluence, keys, statefile='ConfluenceMirror.json', once=False, **kwargs):
+    """Mirror the spaces keys into the current directory until interrupted
+
+    :param srv: XmlRpcServer shared by all spaces
+    :param token: The authentification token
+    :param confluence: confluence.Confluence REST client
+    :param keys: List of spacekeys
+    :param statefile: OPTIONAL: File the cursors are kept in. Default: ConfluenceMirror.json
+    :param once: OPTIONAL: Poll every space only once. Default: False
+    :param kwargs: Options of SpaceMirror and SpaceClone, e.g. minimum=30 or downloadAttach=False
+    """
+    state = MirrorState(statefile)
+    mirrors = [SpaceMirror(srv, token, confluence, key, state, **kwargs) for key in keys]
+    due = dict((space.key, 0.) for space in mirrors)
+    while True:
+        for space in mirrors:
+            if due[space.key] > time.time():
+                continue
+            try:
+                space.poll()
+            except Exception as e:
+                space.progress('Mirror update failed: ' + str(e))
+                space.interval.update(0)
+            due[space.key] = time.time() + space.interval.interval
+            space.progress('Next update in {0:.0f}s'.format(space.interval.interval))
+        if once:
+            return
+        time.sleep(max(0., min(due.values()) - time.time()))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Phase-level profiling of the command-line scripts
+
+Within profiled(), the time spent waiting for the server (network), writing files (io) and in git is summed up, next
+to the wall time and the CPU time of the process; optionally all threads are profiled with cProfile as well. The
+scripts enable it with --profile and --cprofile, see add_arguments():
+
+    confluence_clone-space --key CMI --profile clone-profile.json --cprofile clone.pstats
+    python -m pstats clone.pstats
+
+Phases of concurrent threads add up, so they can exceed the wall time. Outside of profiled() the only cost of the
+instrumentation is one check per phase.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+PHASES = ('network', 'io', 'git')
+
+# the active Profile, see profiled()
+_profile = None
+
+
+class Profile(object):
+    """Seconds and number of calls per phase"""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.wall = None
+        self.cpu = None
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def to_dict(self):
+        return {'wall_seconds': self.wall, 'cpu_seconds': self.cpu,
+                'phases': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in self.seconds}}
+
+    def save(self, filename):
+        with open(filename, 'w') as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=1)
+
+    def summary(self, out=sys.stdout):
+        out.write('{:<10} {:>10} {:>10}\n'.format('phase', 'seconds', 'calls'))
+        for name in self.seconds:
+            out.write('{:<10} {:>10.3f} {:>10d}\n'.format(name, self.seconds[name], self.calls[name]))
+        out.write('{:<10} {:>10.3f}\n'.format('cpu', self.cpu))
+        out.write('{:<10} {:>10.3f}\n'.format('wall', self.wall))
+
+
+def add(name, seconds):
+    """Add seconds to phase name, if profiling is active"""
+    if _profile is not None:
+        _profile.add(name, seconds)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Count the time of the with block to phase name, if profiling is active"""
+    if _profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+class _TimedFile(object):
+    """File whose writes and close count to the phase io"""
+
+    def __init__(self, file):
+        self._file = file
+
+    def write(self, data):
+        with phase('io'):
+            return self._file.write(data)
+
+    def close(self):
+        with phase('io'):
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def timed(file):
+    """Provide file, with its writes counting to the phase io if profiling is active"""
+    return _TimedFile(file) if _profile is not None else file
+
+
+@contextlib.contextmanager
+def profiled(filename=None, cprofile=None):
+    """
+    Profile the with block and write the results
+    :param filename: OPTIONAL: Write the phases as JSON to this file and print them. Default: None (no profiling)
+    :param cprofile: OPTIONAL: Write cProfile statistics of all threads to this file. Default: None
+    :return: The Profile, as target of the with statement, or None
+    """
+    global _profile
+    if filename is None and cprofile is None:
+        yield None
+        return
+    _profile = profile = Profile()
+    profilers = []
+    if cprofile is not None:
+        import cProfile
+
+        def start_thread_profiler(*args):
+            profiler = cProfile.Profile()
+            profilers.append(profiler)
+            profiler.enable()
+        threading.setprofile(start_thread_profiler)
+        main_profiler = cProfile.Profile()
+        profilers.append(main_profiler)
+        main_profiler.enable()
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield profile
+    finally:
+        profile.wall = time.perf_counter() - start
+        profile.cpu = time.process_time() - cpu
+        _profile = None
+        if cprofile is not None:
+            main_profiler.disable()
+            threading.setprofile(None)
+            import pstats
+            stats = pstats.Stats(*profilers)
+            stats.dump_stats(cprofile)
+            print('cProfile statistics of ' + str(len(profilers)) + ' thread(s) written to '
+                  + os.path.abspath(cprofile))
+        if filename is not None:
+            profile.save(filename)
+            profile.summary()
+            print('Profile written to ' + os.path.abspath(filename))
+
+
+def add_arguments(parser):
+    """Add the options --profile and --cprofile to the argparse parser of a script"""
+    parser.add_argument('--profile', dest='profile', default=None, metavar='FILE',
+                        help='Write the time spent waiting for the server, writing files and in git as JSON to FILE')
+    parser.add_argument('--cprofile', dest='cprofile', default=None, metavar='FILE',
+                        help='Write cProfile statistics of all threads to FILE, for python -m pstats')
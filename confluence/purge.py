@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Bulk removal of drafts and trashed content, e.g. the leftovers of automated publishers
+
+The drafts or trashed pages and blog posts of a space, or the content found by a CQL query, are streamed from the
+server and optionally restricted to those not modified for a number of days. All of them are found before the first
+one is removed, as removing content while paginating through it would shift the following pages of results; this
+also provides the count of a dry run. They are then removed with up to parallel requests at once, and requests
+failing with a network error, a server error or throttling are repeated with exponential backoff.
+"""
+
+import concurrent.futures
+import datetime
+import random
+import time
+
+import requests
+
+from . import metrics
+
+STATUSES = ('draft', 'trashed')
+CONTENT_TYPES = ('page', 'blogpost')
+
+
+def candidates(confluence, space=None, status='draft', cql=None, older_than=None):
+    """
+    Find the content to remove
+    :param confluence: confluence.Confluence REST client
+    :param space: OPTIONAL: The space key
+    :param status: OPTIONAL: draft or trashed. Default: draft
+    :param cql: OPTIONAL: Only content found by this CQL query, e.g. 'space="CFELCMI" AND status=draft'; of the results
+                only those with status are removed
+    :param older_than: OPTIONAL: Only content not modified for this number of days
+    :return: List of dictionaries with id, type, title and when (time of the last modification)
+    """
+    if status not in STATUSES:
+        raise ValueError('Only draft or trashed content is purged, not ' + str(status))
+    if cql is not None:
+        contents = (content for content in confluence.iter_content_by_cql(cql, expand='version')
+                    if content.get('status') == status)
+    elif space is not None:
+        contents = (content for content_type in CONTENT_TYPES
+                    for content in confluence.iter_contents_from_space(space, content_type, status, expand='version'))
+    else:
+        raise ValueError('purge requires a space or a CQL query')
+
+    found = []
+    if older_than is not None:
+        limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than)
+    for content in contents:
+        when = content.get('version', {}).get('when')
+        if older_than is not None and (when is None or _parse_time(when) > limit):
+            continue
+        found.append({'id': content['id'], 'type': content['type'], 'title': content['title'], 'when': when})
+    return found
+
+
+def _parse_time(text):
+    # imported on first use, like in content
+    import dateutil.parser
+    when = dateutil.parser.parse(text)
+    return when if when.tzinfo is not None else when.astimezone()
+
+
+def _retry_reason(error):
+    """Provide the reason to repeat a request that failed with error, or None if it cannot succeed when repeated"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return 'network' if isinstance(error, (requests.ConnectionError, requests.Timeout)) else None
+    if response.status_code in (429, 503):
+        return 'throttled'
+    if response.status_code >= 500:
+        return 'server'
+    return None
+
+
+def remove(confluence, content_id, status='draft', retries=3, backoff=1.):
+    """
+    Remove a draft or trashed content, repeating the request after network errors, server errors or throttling
+    :param confluence: confluence.Confluence REST client
+    :param content_id: The content id
+    :param status: OPTIONAL: draft or trashed. Default: draft
+    :param retries: OPTIONAL: How often a failed request is repeated. Default: 3
+    :param backoff: OPTIONAL: Seconds before the first repetition, doubled for every further one. Default: 1
+    :return: True if the content was removed, False if it did not exist (anymore)
+    """
+    for attempt in range(retries + 1):
+        try:
+            # like Confluence.remove_content, whose delete does not provide the response; a 404 is only logged
+            response = confluence.request('DELETE', path='rest/api/content/{0}'.format(content_id),
+                                          params={'status': status})
+            return response.status_code != 404
+        except requests.RequestException as e:
+            reason = _retry_reason(e)
+            if reason is None or attempt == retries:
+                raise
+            metrics.retry(reason)
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def purge(confluence, space=None, status='draft', cql=None, older_than=None, dry_run=False, parallel=8, retries=3,
+          backoff=1., progress=None):
+    """
+    Remove the drafts or trashed content of a space or CQL query, see candidates and remove
+    :param confluence: confluence.Confluence REST client
+    :param dry_run: OPTIONAL: Only find the content, remove nothing. Default: False
+    :param parallel: OPTIONAL: Maximum number of concurrent requests. Default: 8
+    :param progress: OPTIONAL: Function called with a message for every removed, missing or failed content
+    :return: Dictionary with the number of found, removed and missing (removed by somebody else meanwhile) contents
+             and the failed contents as dictionary id -> error message
+    """
+    found = candidates(confluence, space=space, status=status, cql=cql, older_than=older_than)
+    report = {'found': len(found), 'removed': 0, 'missing': 0, 'failed': {}}
+    if dry_run:
+        return report
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(remove, confluence, content['id'], status, retries, backoff): content
+                   for content in found}
+        for future in concurrent.futures.as_completed(futures):
+            content = futures[future]
+            try:
+                removed = future.result()
+            except requests.RequestException as e:
+                report['failed'][content['id']] = str(e)
+                message = 'Removing ' + content['title'] + ' (' + content['id'] + ') failed: ' + str(e)
+            else:
+                if removed:
+                    report['removed'] += 1
+                    message = 'Removed ' + status + ' ' + content['type'] + ' ' + content['title'] + ' (' \
+                              + content['id'] + ')'
+                else:
+                    report['missing'] += 1
+                    message = content['title'] + ' (' + content['id'] + ') does not exist anymore'
+            if progress is not None:
+                progress(message)
+    return report
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Recording and replay of the requests of a REST client (AtlassianRestAPI, Confluence)
+
+A trace holds every request made through AtlassianRestAPI.request: method, path, parameters, status, the sizes of
+request and response body, the time the server took, and the response body. Credentials never enter a trace: the
+Authorization header and auth are not recorded, and parameters that look like secrets are scrubbed.
+
+Replaying a trace answers the requests of the client from the trace, without a server, in the recorded order. Any
+request that differs from the recorded one (method, path or parameters), and any request beyond the recorded ones,
+raises ReplayMismatch; replay() also fails if recorded requests are left over. Streamed responses, e.g. of downloads,
+are replayed as streams. This locks in the request budget of an operation:
+
+    with record(confluence) as trace:
+        confluence.update_page(None, '12345', 'Title', '<p>body</p>')
+    trace.save('update_page.json')
+
+    with replay(confluence, Trace.load('update_page.json')):
+        confluence.update_page(None, '12345', 'Title', '<p>body</p>')
+"""
+
+import base64
+import contextlib
+import io
+import json
+import re
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+# parameters whose values are never recorded
+SECRET_PARAMETER = re.compile(r'pass|token|secret', re.IGNORECASE)
+SCRUBBED = '********'
+
+
+class ReplayMismatch(AssertionError):
+    """A request of a replayed client differs from the recorded one"""
+
+
+def path_template(path):
+    """Provide path with all ids replaced by {id}, e.g. rest/api/content/{id}"""
+    return re.sub(r'(?<=/)\d+(?=/|$)', '{id}', path)
+
+
+def endpoint(method, path):
+    """Provide the endpoint of a request with all ids replaced by {id}, e.g. PUT rest/api/content/{id}"""
+    return method + ' ' + path_template(path)
+
+
+def _scrub(params):
+    return [[name, SCRUBBED if SECRET_PARAMETER.search(name) else value] for name, value in params]
+
+
+def _split(base_url, url):
+    """Provide (path relative to base_url, list of query parameters) of url"""
+    parts = urlsplit(url)
+    path = parts.path
+    base_path = urlsplit(base_url).path
+    if path.startswith(base_path):
+        path = path[len(base_path):]
+    return path.strip('/'), parse_qsl(parts.query, keep_blank_values=True)
+
+
+def _size(data):
+    """Provide the number of bytes of a request body or of an uploaded file object"""
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    if isinstance(data, bytes):
+        return len(data)
+    if hasattr(data, 'seek'):
+        position = data.tell()
+        size = data.seek(0, 2)
+        data.seek(position)
+        return size
+    return 0
+
+
+class Trace(object):
+    """The recorded requests of a client, see record()"""
+
+    def __init__(self, entries=None, operation=None, arguments=None):
+        """
+        :param entries: OPTIONAL: List of the recorded requests (dictionaries)
+        :param operation: OPTIONAL: Name of the recorded operation, e.g. update_page
+        :param arguments: OPTIONAL: Arguments of the recorded operation
+        """
+        self.entries = entries if entries is not None else []
+        self.operation = operation
+        self.arguments = arguments
+
+    def endpoints(self):
+        """Provide the endpoints of all requests in order, see endpoint()"""
+        return [endpoint(entry['method'], entry['path']) for entry in self.entries]
+
+    def seconds(self):
+        """Provide the total time the server took to answer all requests"""
+        return sum(entry['seconds'] for entry in self.entries)
+
+    def save(self, filename):
+        with open(filename, 'w') as trace_file:
+            json.dump({'operation': self.operation, 'arguments': self.arguments, 'requests': self.entries}, trace_file,
+                      indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as trace_file:
+            stored = json.load(trace_file)
+        return cls(stored['requests'], stored.get('operation'), stored.get('arguments'))
+
+
+class RecordingSession(object):
+    """Stand-in for the requests.Session of a client that records all requests into a trace"""
+
+    def __init__(self, session, base_url, trace, bodies=True):
+        """
+        :param session: The requests.Session doing the requests
+        :param base_url: The url of the server, paths are recorded relative to it
+        :param trace: Trace to record into
+        :param bodies: OPTIONAL: Record the response bodies, which are needed for replay. Default: True
+        """
+        self.session = session
+        self.base_url = base_url
+        self.trace = trace
+        self.bodies = bodies
+
+    def request(self, method, url, data=None, files=None, stream=False, **kwargs):
+        start = time.perf_counter()
+        response = self.session.request(method=method, url=url, data=data, files=files, stream=stream, **kwargs)
+        seconds = time.perf_counter() - start
+        path, params = _split(self.base_url, url)
+        if self.bodies or not stream:
+            # recorded bodies are read completely; the client still streams them, from memory
+            response_bytes = len(response.content)
+        else:
+            response_bytes = int(response.headers.get('Content-Length', 0))
+        entry = {'method': method,
+                 'path': path,
+                 'params': _scrub(params),
+                 'status': response.status_code,
+                 'request_bytes': _size(data) + sum(_size(file[1]) for file in (files or {}).values()),
+                 'response_bytes': response_bytes,
+                 'seconds': seconds,
+                 'content_type': response.headers.get('Content-Type', '')}
+        if self.bodies:
+            try:
+                entry['body'] = response.content.decode('utf-8')
+            except UnicodeDecodeError:
+                entry['body_base64'] = base64.b64encode(response.content).decode('ascii')
+        self.trace.entries.append(entry)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class ReplaySession(object):
+    """Stand-in for the requests.Session of a client that answers all requests from a trace"""
+
+    def __init__(self, base_url, trace):
+        """
+        :param base_url: The url of the server the client uses
+        :param trace: Trace to replay
+        """
+        self.base_url = base_url
+        self.trace = trace
+        self.position = 0
+        self.auth = None
+
+    def request(self, method, url, stream=False, **kwargs):
+        path, params = _split(self.base_url, url)
+        if self.position >= len(self.trace.entries):
+            raise ReplayMismatch('Request {0} of {1} recorded ones: {2} {3}'.format(
+                self.position + 1, len(self.trace.entries), method, path))
+        entry = self.trace.entries[self.position]
+        if (method, path, _scrub(params)) != (entry['method'], entry['path'], entry['params']):
+            raise ReplayMismatch('Request {0} is {1} {2} {3} instead of the recorded {4} {5} {6}'.format(
+                self.position + 1, method, path, _scrub(params), entry['method'], entry['path'], entry['params']))
+        self.position += 1
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.url = url
+        response.headers['Content-Type'] = entry.get('content_type', '')
+        response.encoding = 'utf-8'
+        if 'body_base64' in entry:
+            body = base64.b64decode(entry['body_base64'])
+        else:
+            body = entry.get('body', '').encode('utf-8')
+        response.headers['Content-Length'] = str(len(body))
+        # the body is read from raw like from a connection: by iter_content if the request is streamed, e.g. by
+        # AtlassianRestAPI.download, right away otherwise, like requests.Session does
+        response.raw = io.BytesIO(body)
+        if not stream:
+            response.content
+        return response
+
+    def remaining(self):
+        """Provide the recorded requests that were not replayed (yet)"""
+        return self.trace.entries[self.position:]
+
+
+@contextlib.contextmanager
+def record(client, trace=None, bodies=True):
+    """
+    Record all requests of client within the with block
+    :param client: AtlassianRestAPI, e.g. Confluence
+    :param trace: OPTIONAL: Trace to record into. Default: a new Trace
+    :param bodies: OPTIONAL: Record the response bodies, which are needed for replay. Default: True
+    :return: The Trace, as target of the with statement
+    """
+    trace = trace if trace is not None else Trace()
+    session = client._session
+    client._session = RecordingSession(session, client.url, trace, bodies=bodies)
+    try:
+        yield trace
+    finally:
+        client._session = session
+
+
+@contextlib.contextmanager
+def replay(client, trace):
+    """
+    Answer all requests of client within the with block from trace, requiring exactly the recorded requests in the
+    recorded order
+    :param client: AtlassianRestAPI, e.g. Confluence
+    :param trace: The Trace to replay
+    :return: The ReplaySession, as target of the with statement
+    """
+    session = client._session
+    client._session = replaying = ReplaySession(client.url, trace)
+    try:
+        yield replaying
+    finally:
+        client._session = session
+    remaining = replaying.remaining()
+    if remaining:
+        raise ReplayMismatch('{0} of {1} recorded requests were not made, the first one is {2} {3}'.format(
+            len(remaining), len(trace.entries), remaining[0]['method'], remaining[0]['path']))
@@ -4,8 +4,14 @@
 # Copyright (C) 2018 Alexander Franke, Jan Petermann
 import json
 import logging
+import os
+import time
 from six.moves.urllib.parse import urlencode
 import requests
+from . import metrics
+from . import profiling
+from . import tracing
+from .recording import path_template
 
 log = logging.getLogger('atlassian')
 
@@ -62,7 +68,8 @@ class AtlassianRestAPI(object):
         url_link = '/'.join(s.strip('/') for s in [url, path])
         return url_link
 
-    def request(self, method='GET', path='/', data=None, flags=None, params=None, headers=None, files=None):
+    def request(self, method='GET', path='/', data=None, flags=None, params=None, headers=None, files=None,
+                stream=False):
         """
         :param method: GET or POST
         :param path: Path to the rest api. Defaults to /
@@ -71,6 +78,7 @@ class AtlassianRestAPI(object):
         :param params:
         :param headers:
         :param files:
+        :param stream: OPTIONAL: Do not read the body of a successful response, see download. Default: False
         :return:
         """
         self.log_curl_debug(method=method, path=path, headers=headers, data=data)
@@ -85,25 +93,35 @@ class AtlassianRestAPI(object):
             data = json.dumps(data)
 
         headers = headers or self.default_headers
-        response = self._session.request(
-            method=method,
-            url=url,
-            headers=headers,
-            data=data,
-            auth=(self.username, self.password),
-            timeout=self.timeout,
-            verify=self.verify_ssl,
-            files=files
-        )
+        start = time.perf_counter()
         try:
-            if response.text:
-                response_content = response.json()
-            else:
-                response_content = response.content
-        except ValueError:
-            response_content = response.content
+            response = self._session.request(
+                method=method,
+                url=url,
+                headers=headers,
+                data=data,
+                auth=(self.username, self.password),
+                timeout=self.timeout,
+                verify=self.verify_ssl,
+                files=files,
+                stream=stream
+            )
+        except requests.RequestException:
+            metrics.request(method, path_template(path.split('?')[0].strip('/')), 'error', time.perf_counter() - start)
+            raise
+        seconds = time.perf_counter() - start
+        profiling.add('network', seconds)
+        if tracing.tracer() is not None or metrics.registry() is not None:
+            template = path_template(path.split('?')[0].strip('/'))
+            sent = int(response.request.headers.get('Content-Length', 0)) if response.request is not None else 0
+            # a streamed body is not read yet, the server announces its size
+            received = int(response.headers.get('Content-Length', 0)) if stream else len(response.content)
+            metrics.request(method, template, response.status_code, seconds, sent, received)
+            if tracing.tracer() is not None:
+                tracing.request(method + ' ' + template, sent, received, seconds)
         if response.status_code == 200:
-            log.debug('Received: {0}\n {1}'.format(response.status_code, response_content))
+            if not stream and log.isEnabledFor(logging.DEBUG):
+                log.debug('Received: {0}\n {1}'.format(response.status_code, self._response_content(response)))
         elif response.status_code == 204:
             log.debug('Received: {0}\n "No Content" response'.format(response.status_code))
         elif response.status_code == 404:
@@ -111,7 +129,7 @@ class AtlassianRestAPI(object):
         else:
             log.debug('Received: {0}\n {1}'.format(response.status_code, response))
             self.log_curl_debug(method=method, path=path, headers=headers, data=data, level=logging.DEBUG)
-            log.error(response_content)
+            log.error(self._response_content(response))
             try:
                 response.raise_for_status()
             except requests.exceptions.HTTPError as err:
@@ -120,6 +138,48 @@ class AtlassianRestAPI(object):
                 raise err
         return response
 
+    @staticmethod
+    def _response_content(response):
+        """The body of response for logging: decoded if the server sent JSON, the bytes otherwise (e.g. a PDF)"""
+        if 'json' in response.headers.get('Content-Type', ''):
+            try:
+                return response.json()
+            except ValueError:
+                pass
+        return response.content
+
+    def download(self, path, filename, params=None, headers=None, chunk_size=1 << 16):
+        """
+        Stream the response of a GET request into a file, without holding it in memory
+        The body is written into filename.part first, which replaces filename once complete, so an interrupted download
+        never leaves a truncated file behind.
+        :param path: Path of the resource, e.g. download/attachments/123/file.pdf
+        :param filename: The file to write
+        :param params: OPTIONAL: GET parameters
+        :param headers: OPTIONAL: Default: Accept anything
+        :param chunk_size: OPTIONAL: Bytes read and written at once. Default: 64 KiB
+        :return: Number of bytes written; raises requests.HTTPError without writing anything if the server answers with
+                 an error, e.g. 404
+        """
+        response = self.request('GET', path=path, params=params, headers=headers or {'Accept': '*/*'}, stream=True)
+        written = 0
+        partial = filename + '.part'
+        try:
+            # request() only logs a 404, whose body must not end up in the file
+            response.raise_for_status()
+            with profiling.timed(open(partial, 'wb')) as out_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    out_file.write(chunk)
+                    written += len(chunk)
+            os.replace(partial, filename)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        finally:
+            response.close()
+        return written
+
     def get(self, path, data=None, flags=None, params=None, headers=None, not_json_response=None):
         """
         Get request based on the python-requests module. You can override headers, and also, get not json response
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Thread-safe, rate limited access to the XML-RPC interface of Confluence"""
+
+import http.client
+import threading
+import time
+import xmlrpc
+import xmlrpc.client
+from . import metrics
+from . import profiling
+from . import tracing
+
+
+class RateLimiter(object):
+    """Limit the rate of calls over all threads sharing this limiter"""
+
+    def __init__(self, rate=None):
+        """
+        :param rate: OPTIONAL: Maximum number of calls per second. Default: None (unlimited)
+        """
+        self.interval = 1. / rate if rate else 0.
+        self._lock = threading.Lock()
+        self._next = 0.
+
+    def wait(self):
+        """Block until the next call is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class _CountedResponse(object):
+    """HTTP response of an XML-RPC call, counting the bytes read from it into the transport"""
+
+    def __init__(self, response, transport):
+        self._response = response
+        self._transport = transport
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amount=None):
+        data = self._response.read(amount)
+        self._transport.received += len(data)
+        return data
+
+
+class _Counting(object):
+    """Mixin of the xmlrpc.client transports, keeping the size of the last request body sent and response body
+    received, as sent over the wire (i.e. compressed if the server compresses responses)"""
+
+    sent = 0
+    received = 0
+
+    def send_request(self, host, handler, request_body, debug):
+        self.sent = len(request_body)
+        self.received = 0
+        return super().send_request(host, handler, request_body, debug)
+
+    def parse_response(self, response):
+        return super().parse_response(_CountedResponse(response, self))
+
+
+class _CountingTransport(_Counting, xmlrpc.client.Transport):
+    pass
+
+
+class _CountingSafeTransport(_Counting, xmlrpc.client.SafeTransport):
+    pass
+
+
+class XmlRpcServer(object):
+    """Thread-safe stand-in for xmlrpc.client.ServerProxy
+
+    Every thread gets its own ServerProxy, which keeps its HTTP connection to the server open between calls. All calls,
+    from all threads, share one RateLimiter. Use it like a ServerProxy, e.g., srv.confluence2.getPage(token, pageid).
+
+    Calls failing with network errors are repeated. When the login token of confluence2.login times out, the server
+    logs in again and repeats the call with the new token.
+    """
+
+    def __init__(self, serverurl, rate=None, retries=3):
+        """
+        :param serverurl: The base url of the server, including the trailing slash
+        :param rate: OPTIONAL: Maximum number of XML-RPC calls per second. Default: None (unlimited)
+        :param retries: OPTIONAL: How often a call failing with a network error is repeated. Default: 3
+        """
+        self.serverurl = serverurl
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.token = None
+        self._credentials = None
+        self._stale_tokens = set()
+        self._login_lock = threading.Lock()
+        self._local = threading.local()
+
+    def proxy(self):
+        """The ServerProxy of the calling thread"""
+        try:
+            return self._local.proxy
+        except AttributeError:
+            # the transport of the thread counts the bytes of its calls
+            transport = _CountingSafeTransport if self.serverurl.startswith('https') else _CountingTransport
+            self._local.transport = transport()
+            self._local.proxy = xmlrpc.client.ServerProxy(self.serverurl + 'rpc/xmlrpc',
+                                                          transport=self._local.transport)
+            return self._local.proxy
+
+    def call(self, method, *args):
+        """Call method (e.g. confluence2.getPage) with args"""
+        for attempt in range(self.retries + 1):
+            if args and args[0] in self._stale_tokens:
+                args = (self.token,) + args[1:]
+            self.limiter.wait()
+            proxy = self.proxy()
+            transport = self._local.transport
+            start = time.perf_counter()
+            try:
+                result = getattr(proxy, method)(*args)
+            except xmlrpc.client.Fault as e:
+                metrics.request('XML-RPC', method, 'fault', time.perf_counter() - start, transport.sent,
+                                transport.received)
+                if ('InvalidSessionException' not in e.faultString or self._credentials is None
+                        or not args or attempt == self.retries):
+                    raise
+                metrics.retry('session')
+                self.relogin(args[0])
+            except (OSError, http.client.HTTPException, xmlrpc.client.ProtocolError):
+                metrics.request('XML-RPC', method, 'error', time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise
+                metrics.retry('network')
+                # start over with a new connection
+                del self._local.proxy
+                time.sleep(2 ** attempt)
+            else:
+                seconds = time.perf_counter() - start
+                profiling.add('network', seconds)
+                metrics.request('XML-RPC', method, 'ok', seconds, transport.sent, transport.received)
+                tracing.request('XML-RPC ' + method, transport.sent, transport.received, seconds)
+                if method == 'confluence2.login':
+                    self._credentials = args
+                    self.token = result
+                return result
+
+    def relogin(self, token):
+        """Login again with the credentials of the last confluence2.login because token timed out"""
+        with self._login_lock:
+            if token in self._stale_tokens:
+                # another thread already logged in again
+                return
+            self._stale_tokens.add(token)
+            self.token = getattr(self.proxy(), 'confluence2.login')(*self._credentials)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _XmlRpcMethod(self, name)
+
+
+class _XmlRpcMethod(object):
+
+    def __init__(self, server, name):
+        self._server = server
+        self._name = name
+
+    def __getattr__(self, name):
+        return _XmlRpcMethod(self._server, self._name + '.' + name)
+
+    def __call__(self, *args):
+        return self._server.call(self._name, *args)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Full-text search over space backups, in a SQLite FTS5 index
+
+The clone indexes the title, text, labels and comments of every page and blog post it saves into
+ConfluenceBackup_<spacekey>.search.sqlite, next to the backup. Saving a page again replaces its entry and pages
+removed from the backup are removed from the index, so the index follows the backup incrementally. Queries use the
+FTS5 syntax, e.g. beamtime AND laser, "molecular beam", title:alignment or detect*:
+
+    with SearchIndex('ConfluenceBackup_CFELCMI.search.sqlite') as index:
+        for hit in index.search('molecular beam'):
+            print(hit['title'], hit['path'])
+"""
+
+import html
+import re
+import sqlite3
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS content USING fts5(contentid UNINDEXED, kind UNINDEXED, path UNINDEXED, title, body,
+                                                      labels, comments, tokenize='unicode61 remove_diacritics 2');
+"""
+
+_TAG = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_SPACE = re.compile(r'\s+')
+
+
+def filename_of(spacekey):
+    """Provide the file name of the search index of the backup of spacekey"""
+    return 'ConfluenceBackup_' + spacekey + '.search.sqlite'
+
+
+def html_text(fragment):
+    """Provide the text of a HTML fragment, without tags, scripts and styles"""
+    return _SPACE.sub(' ', html.unescape(_TAG.sub(' ', fragment or ''))).strip()
+
+
+class SearchIndex(object):
+    """Full-text index of the pages and blog posts of a space backup"""
+
+    def __init__(self, filename, readonly=False):
+        """
+        :param filename: The index file, e.g. ConfluenceBackup_CFELCMI.search.sqlite, see filename_of
+        :param readonly: Open an existing index for searching only
+        """
+        self.filename = filename
+        if readonly:
+            self._db = sqlite3.connect('file:' + filename + '?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self._db = sqlite3.connect(filename, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+
+    def add(self, contentid, kind, path, title, body, labels=(), comments=()):
+        """
+        Index a page or blog post, replacing its previous entry
+        :param contentid: The content id
+        :param kind: page or blogpost
+        :param path: The path of the saved content within the backup, e.g. pages/12345.html
+        :param title: The title
+        :param body: The content as HTML
+        :param labels: OPTIONAL: The label names
+        :param comments: OPTIONAL: The comments as HTML
+        """
+        self._db.execute('DELETE FROM content WHERE contentid = ?', (contentid,))
+        self._db.execute('INSERT INTO content (contentid, kind, path, title, body, labels, comments) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (contentid, kind, path, title, html_text(body), ' '.join(labels),
+                          '\n'.join(html_text(comment) for comment in comments)))
+
+    def remove(self, contentid):
+        self._db.execute('DELETE FROM content WHERE contentid = ?', (contentid,))
+
+    def commit(self):
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT count(*) FROM content').fetchone()[0]
+
+    def search(self, query, limit=20, kind=None):
+        """
+        Search the index, best matches first
+        :param query: FTS5 query, e.g. beamtime AND laser; if it is no valid FTS5 query, its words are searched
+        :param limit: OPTIONAL: Maximum number of results. Default: 20
+        :param kind: OPTIONAL: Only page or blogpost. Default: None (both)
+        :return: List of dictionaries with contentid, kind, path, title, snippet and rank (lower is better)
+        """
+        try:
+            return self._search(query, limit, kind)
+        except sqlite3.OperationalError:
+            # e.g. unbalanced quotes or operators in words typed by a user
+            words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+            if not words:
+                return []
+            return self._search(' '.join(words), limit, kind)
+
+    def _search(self, query, limit, kind):
+        sql = ("SELECT contentid, kind, path, title, snippet(content, -1, '[', ']', ' ... ', 12), bm25(content, 0, 0, "
+               "0, 10.0, 1.0, 5.0, 0.5) AS rank FROM content WHERE content MATCH ?")
+        parameters = [query]
+        if kind is not None:
+            sql += ' AND kind = ?'
+            parameters.append(kind)
+        sql += ' ORDER BY rank LIMIT ?'
+        parameters.append(int(limit))
+        return [dict(zip(('contentid', 'kind', 'path', 'title', 'snippet', 'rank'), row))
+                for row in self._db.execute(sql, parameters)]
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
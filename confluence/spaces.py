@@ -2,12 +2,25 @@
 # -*- coding: utf-8; fill-column: 100 -*-
 
 
+import concurrent.futures
+import csv
 import getpass
 import json
-import xmlrpc
-import xmlrpc.client
+from collections import defaultdict
 
-import requests
+from .confluence import Confluence
+from .rpc import XmlRpcServer
+
+# space categories of all CMI spaces
+DEFAULT_LABELS = ['team:cfel-cmi', 'team:cmi-elog-calendar']
+# the page "Spaces/Projects/Stashs with relevance to CMI", which links all CMI spaces
+OVERVIEW_PAGE_ID = '14421128'
+OVERVIEW_CLOSING_TAGS = '</ac:layout-cell></ac:layout-section></ac:layout>'
+
+READ_PERMISSIONS = ['VIEWSPACE']
+WRITE_PERMISSIONS = ['VIEWSPACE', 'EDITSPACE', 'COMMENT', 'CREATEATTACHMENT', 'EDITBLOG']
+ADMIN_PERMISSIONS = ['VIEWSPACE', 'SETSPACEPERMISSIONS', 'EDITSPACE', 'COMMENT', 'REMOVECOMMENT', 'CREATEATTACHMENT',
+                     'REMOVEATTACHMENT', 'EDITBLOG', 'REMOVEPAGE', 'REMOVEBLOG', 'EXPORTSPACE', 'SETPAGEPERMISSIONS']
 
 
 def auth(user, srv, pwd):
@@ -16,7 +29,8 @@ def auth(user, srv, pwd):
 
 
 def xmlrpcServer(serverurl):
-    return xmlrpc.client.ServerProxy(serverurl + 'rpc/xmlrpc')
+    """Thread-safe XML-RPC server, see confluence.rpc.XmlRpcServer"""
+    return XmlRpcServer(serverurl)
 
 
 def printResponse(r):
@@ -25,35 +39,70 @@ def printResponse(r):
 
 def addReadPermissions(token, srv, entity, spacekey):
     """Adds the permission VIEWSPACE to a given entity (String of a confluence group or user)"""
-    srv.confluence2.addPermissionToSpace(token, "VIEWSPACE", entity, spacekey)
+    srv.confluence2.addPermissionsToSpace(token, READ_PERMISSIONS, entity, spacekey)
 
 
 def addWritePermissions(token, srv, entity, spacekey):
     """Adds the permissions VIEWSPACE,EDITSPACE,COMMENT,CREATEATTACHMENT,EDITBLOG to a given entity (String of a confluence group or user)"""
-    permissions = ['VIEWSPACE', 'EDITSPACE', 'COMMENT', 'CREATEATTACHMENT', 'EDITBLOG']
-    for perm in permissions:
-        srv.confluence2.addPermissionToSpace(token, perm, entity, spacekey)
+    srv.confluence2.addPermissionsToSpace(token, WRITE_PERMISSIONS, entity, spacekey)
 
 
 def addAdminPermissions(token, srv, entity, spacekey):
     """Adds the administration permission to a given entity (String of a confluence group or user)"""
-    permissions = ['VIEWSPACE', 'SETSPACEPERMISSIONS', 'EDITSPACE', 'COMMENT', 'REMOVECOMMENT', 'CREATEATTACHMENT',
-                   'REMOVEATTACHMENT', 'EDITBLOG', 'REMOVEPAGE', 'REMOVEBLOG', 'EXPORTSPACE', 'SETPAGEPERMISSIONS']
-    for perm in permissions:
-        srv.confluence2.addPermissionToSpace(token, perm, entity, spacekey)
+    srv.confluence2.addPermissionsToSpace(token, ADMIN_PERMISSIONS, entity, spacekey)
 
 
-def createCMISpace(serverurl, user, spacekey, spacename, reads, writes, admins):
-    """Creates a new space (required spacekey, name), sets the homepage according to the CMI template and sets space categories **cfel-cmi** and **cmi-elog-calendar**"""
+def getSpacePermissions(token, srv, spacekey):
+    """Provide the permissions granted in a space as dictionary entity (group or user name) -> set of permissions"""
+    granted = defaultdict(set)
+    for permissionset in srv.confluence2.getSpacePermissionSets(token, spacekey):
+        for permission in permissionset.get('spacePermissions', []):
+            # anonymous access has neither group nor user
+            entity = permission.get('groupName') or permission.get('userName')
+            if entity:
+                granted[entity].add(permission['type'])
+    return granted
 
-    # Get Authentification Token
-    print("Please enter your password  (user:" + user + ")")
-    pwd = getpass.getpass()
 
-    srv = xmlrpcServer(serverurl)
-    token = auth(user, srv, pwd)
+def missingPermissions(granted, wanted):
+    """Provide the permissions of wanted (dictionary entity -> permissions) that are not granted yet, as dictionary
+    entity -> sorted list of permissions"""
+    missing = {}
+    for entity, permissions in wanted.items():
+        permissions = sorted(set(permissions) - granted.get(entity, set()))
+        if permissions:
+            missing[entity] = permissions
+    return missing
+
+
+def applyPermissions(token, srv, spacekey, reads=(), writes=(), admins=(), parallel=4):
+    """Grants read, write and admin permissions to lists of entities (confluence groups or users)
+
+    The permissions of the space are read once; only the missing ones are added, with one call per entity and up to
+    parallel entities concurrently. Running it again for the same space therefore changes nothing.
+
+    :return: The added permissions, as dictionary entity -> list of permissions
+    """
+    wanted = defaultdict(set)
+    for entities, permissions in ((reads, READ_PERMISSIONS), (writes, WRITE_PERMISSIONS),
+                                  (admins, ADMIN_PERMISSIONS)):
+        for entity in entities:
+            wanted[entity].update(permissions)
+    missing = missingPermissions(getSpacePermissions(token, srv, spacekey), wanted)
+    if not missing:
+        print(spacekey + ': all permissions granted already')
+        return missing
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(srv.confluence2.addPermissionsToSpace, token, permissions, entity, spacekey): entity
+                   for entity, permissions in missing.items()}
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            print(spacekey + ': granted ' + ', '.join(missing[futures[future]]) + ' to ' + futures[future])
+    return missing
+
 
-    # Content for homepage
+def homepageContent(spacekey, spacename):
+    """Provide the storage format of the homepage of a space according to the CMI template"""
     content = '<ac:layout><ac:layout-section ac:type="two_equal"><ac:layout-cell><ac:structured-macro ac:name="info"><ac:parameter ac:name="title">Overview</ac:parameter><ac:rich-text-body><p>This is the Confluence Space (Wiki, logbook, etc.) of the project ' + spacename + '.</p></ac:rich-text-body></ac:structured-macro></ac:layout-cell>'
     content += '<ac:layout-cell><p><br /><ac:structured-macro ac:name="livesearch"><ac:parameter ac:name="additional">page excerpt</ac:parameter><ac:parameter ac:name="placeholder">Search space</ac:parameter><ac:parameter ac:name="' + spacekey + '">com.atlassian.confluence.content.render.xhtml.model.resource.identifiers.SpaceResourceIdentifier@35</ac:parameter><ac:parameter ac:name="spaceKey"><ri:space ri:space-key="' + spacekey + '" /></ac:parameter></ac:structured-macro></p></ac:layout-cell></ac:layout-section>'
     content += '<ac:layout-section ac:type="single"><ac:layout-cell><ac:structured-macro ac:name="info"><ac:parameter ac:name="title">Members of the project (Confluence Space permissions)</ac:parameter><ac:rich-text-body><ac:macro ac:name="spaceaccessusersminimal" /></ac:rich-text-body></ac:structured-macro></ac:layout-cell></ac:layout-section>'
@@ -62,71 +111,174 @@ def createCMISpace(serverurl, user, spacekey, spacename, reads, writes, admins):
     content += '<h2>All labels in this space</h2><p><ac:structured-macro ac:name="listlabels"><ac:parameter ac:name="' + spacekey + '">com.atlassian.confluence.content.render.xhtml.model.resource.identifiers.SpaceResourceIdentifier@35</ac:parameter><ac:parameter ac:name="spaceKey"><ri:space ri:space-key="' + spacekey + '" /></ac:parameter></ac:structured-macro></p></ac:layout-cell>'
     content += '<ac:layout-cell><h2>Space contributors</h2><p><ac:structured-macro ac:name="contributors-summary"><ac:parameter ac:name="spaces"><ri:space ri:space-key="' + spacekey + '" /></ac:parameter></ac:structured-macro></p></ac:layout-cell></ac:layout-section>'
     content += '<ac:layout-section ac:type="single"><ac:layout-cell><h2>Incomplete tasks</h2><p><ac:structured-macro ac:name="tasks-report-macro"><ac:parameter ac:name="spaces">' + spacekey + '</ac:parameter><ac:parameter ac:name="spaceAndPage">space:' + spacekey + '</ac:parameter><ac:parameter ac:name="pageSize">40</ac:parameter></ac:structured-macro></p></ac:layout-cell></ac:layout-section></ac:layout>'
+    return content
+
+
+def overviewLink(spacekey, spacename):
+    """Provide the link to a space on the space overview page"""
+    return '<ul><li><a href="/display/' + spacekey + '">' + spacename + '</a></li></ul>'
+
+
+def isListed(content, spacekey):
+    """True if the storage format content of the space overview page links the space spacekey"""
+    return 'href="/display/' + spacekey + '"' in content
+
+
+def overviewWithLinks(content, spaces):
+    """Provide the storage format content of the space overview page with links to those spaces (list of (spacekey,
+    spacename)) that are not listed yet, inserted before the closing tags of the last layout cell"""
+    missing = [(spacekey, spacename) for spacekey, spacename in spaces if not isListed(content, spacekey)]
+    if not missing:
+        return content
+    if not content.endswith(OVERVIEW_CLOSING_TAGS):
+        raise ValueError('The space overview page ' + OVERVIEW_PAGE_ID + ' does not end with its last layout cell '
+                         'anymore, the links are not added')
+    return (content[:-len(OVERVIEW_CLOSING_TAGS)]
+            + ''.join(overviewLink(spacekey, spacename) for spacekey, spacename in missing)
+            + OVERVIEW_CLOSING_TAGS)
+
+
+def addToOverview(confluence, spaces):
+    """Adds links to spaces (list of (spacekey, spacename)) to the space overview page, skipping the spaces listed there
+    already. All links are added in one update of the page, which is repeated if somebody else changed the page in the
+    meantime (see Confluence.atomic_update).
+
+    :param confluence: confluence.Confluence REST client
+    :return: List of the spacekeys listed on the updated page
+    """
+    updated = confluence.atomic_update(OVERVIEW_PAGE_ID, lambda content: overviewWithLinks(content, spaces))
+    content = updated['body']['storage']['value']
+    return [spacekey for spacekey, spacename in spaces if isListed(content, spacekey)]
+
+
+def loadManifest(filename):
+    """Reads the spaces to provision from a YAML or CSV manifest
+
+    YAML manifests are a list of mappings, CSV manifests have one row per space, e.g.
+
+        - key: BT2019A
+          name: Beamtime 2019 A
+          labels: [team:cfel-cmi]
+          read: [cmi-users]
+          write: [bt2019a-members]
+          admin: [jkuepper]
+
+        key,name,labels,read,write,admin
+        BT2019A,Beamtime 2019 A,team:cfel-cmi,cmi-users,bt2019a-members,jkuepper
+
+    Several labels or entities within a CSV field are separated by semicolons. Without labels, a space gets
+    DEFAULT_LABELS; without read, it is readable by cmi-users.
+
+    :return: List of dictionaries with the keys key, name, labels, reads, writes and admins
+    """
+    if filename.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Reading YAML manifests requires PyYAML, use a CSV manifest otherwise')
+        with open(filename) as manifest_file:
+            entries = yaml.safe_load(manifest_file) or []
+    else:
+        with open(filename, newline='') as manifest_file:
+            entries = list(csv.DictReader(manifest_file))
+
+    def entities(value, default=()):
+        if value is None or value == '':
+            return list(default)
+        if isinstance(value, str):
+            return [entity.strip() for entity in value.split(';') if entity.strip() != '']
+        return [str(entity) for entity in value]
+
+    specs = []
+    for number, entry in enumerate(entries, 1):
+        if not entry.get('key') or not entry.get('name'):
+            raise ValueError(filename + ': space ' + str(number) + ' needs a key and a name')
+        specs.append({'key': str(entry['key']),
+                      'name': str(entry['name']),
+                      'labels': entities(entry.get('labels'), DEFAULT_LABELS),
+                      'reads': entities(entry.get('read'), ['cmi-users']),
+                      'writes': entities(entry.get('write')),
+                      'admins': entities(entry.get('admin'))})
+    return specs
+
+
+def provisionSpace(confluence, srv, token, spec):
+    """Creates a space according to the CMI template, or reconciles an existing one with spec
+
+    Missing spaces are created with the CMI homepage; missing labels and permissions are added to existing spaces.
+    Nothing is ever removed.
+
+    :param confluence: confluence.Confluence REST client
+    :param srv: XML-RPC server
+    :param token: The authentification token
+    :param spec: Dictionary with the keys key, name, labels, reads, writes and admins, see loadManifest
+    :return: 'created' or 'reconciled'
+    """
+    spacekey = spec['key']
+    space = confluence.get_space(spacekey, expand='homepage,metadata.labels') or {}
+    if space.get('key') == spacekey:
+        status = 'reconciled'
+    else:
+        print(spacekey + ': creating new space')
+        confluence.create_space(spacekey, spec['name'], description='CMI space')
+        space = confluence.get_space(spacekey, expand='homepage,metadata.labels')
+        confluence.update_page(None, space['homepage']['id'], spec['name'] + ' Home',
+                               homepageContent(spacekey, spec['name']))
+        status = 'created'
+
+    labels = set()
+    for label in space.get('metadata', {}).get('labels', {}).get('results', []):
+        labels.add(label['prefix'] + ':' + label['name'] if label.get('prefix') else label['name'])
+    for label in spec['labels']:
+        # labels without prefix are stored as global labels
+        if label not in labels and 'global:' + label not in labels:
+            srv.confluence2.addLabelByNameToSpace(token, label, spacekey)
+
+    applyPermissions(token, srv, spacekey, spec['reads'], spec['writes'], spec['admins'])
+    return status
+
+
+def provisionSpaces(confluence, srv, token, specs, parallel=4):
+    """Provisions all spaces of a manifest, up to parallel spaces concurrently, and links the new ones on the space
+    overview page
+
+    :param confluence: confluence.Confluence REST client, shared by all spaces
+    :param srv: XML-RPC server, shared by all spaces
+    :param token: The authentification token
+    :param specs: List of space specifications, see loadManifest
+    :return: Dictionary spacekey -> 'created', 'reconciled' or the error message
+    """
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(provisionSpace, confluence, srv, token, spec): spec for spec in specs}
+        for future in concurrent.futures.as_completed(futures):
+            spacekey = futures[future]['key']
+            try:
+                results[spacekey] = future.result()
+            except Exception as e:
+                results[spacekey] = 'failed: ' + str(e)
+            print(spacekey + ': ' + results[spacekey])
+    created = [(spec['key'], spec['name']) for spec in specs if results[spec['key']] == 'created']
+    if created:
+        print(', '.join(addToOverview(confluence, created)) + ' listed on the space overview page')
+    return results
+
+
+def createCMISpace(serverurl, user, spacekey, spacename, reads, writes, admins):
+    """Creates a new space (required spacekey, name), sets the homepage according to the CMI template and sets space categories **cfel-cmi** and **cmi-elog-calendar**"""
+
+    # Get Authentification Token
+    print("Please enter your password  (user:" + user + ")")
+    pwd = getpass.getpass()
+
+    srv = xmlrpcServer(serverurl)
+    token = auth(user, srv, pwd)
+    confluence = Confluence(user, pwd, url=serverurl)
 
-    # Create new space
     print('----------------------------------------------------------------')
-    print('                  ')
-    print('Creating new space')
-
-    r = requests.post(serverurl + 'rest/api/space',
-                      data=json.dumps({'key': spacekey, 'name': spacename,
-                                       "description": {"plain": {"value": "CMI space", "representation": "plain"}},
-                                       "metadata": {}}),
-                      auth=(user, pwd),
-                      headers=({'Content-Type': 'application/json'}))
-    printResponse(r)
-    print('                  ')
-    print('                  ')
+    spec = {'key': spacekey, 'name': spacename, 'labels': DEFAULT_LABELS,
+            'reads': reads, 'writes': writes, 'admins': admins}
+    if provisionSpace(confluence, srv, token, spec) == 'created':
+        print('Updating space overview')
+        addToOverview(confluence, [(spacekey, spacename)])
     print('----------------------------------------------------------------')
-
-    # Add labels (categories)
-    srv.confluence2.addLabelByNameToSpace(token, "team:cfel-cmi", spacekey)
-    srv.confluence2.addLabelByNameToSpace(token, "team:cmi-elog-calendar", spacekey)
-
-    # Get information about newly created space
-    newspace = srv.confluence2.getSpace(token, spacekey)
-
-    # Get content ID of homepage of the space
-    homepageid = newspace["homePage"]
-    print(homepageid)
-    r = requests.put(serverurl + 'rest/api/content/' + homepageid,
-                     data=json.dumps({"version": {"number": 2}, "title": spacename + " Home", "type": "page",
-                                      "body": {"storage": {"value": content, "representation": "storage"}}}),
-                     auth=(user, pwd),
-                     headers=({'Content-Type': 'application/json'}))
-    # print(str(r))
-    # printResponse(r)
-
-    # add link to space overview page
-    print('------------------------------')
-    print('                  ')
-    print('    Updating Spaceoverview    ')
-
-    r = requests.get(serverurl + 'rest/api/content/14421128',
-                     params={'expand': 'body.storage,version'},
-                     auth=(user, pwd))
-    content = r.json()['body']['storage']['value']
-    versionnumber = int(r.json()['version']['number']) + 1
-    print("version number:")
-    print(versionnumber)
-    r = requests.put(serverurl + 'rest/api/content/14421128',
-                     data=json.dumps({'type': 'page', "version": {"number": str(versionnumber)},
-                                      "title": "Spaces/Projects/Stashs with relevance to CMI", 'body': {'storage': {
-                             'value': content[
-                                      :-49] + '<ul><li><a href="/display/' + spacekey + '">' + spacename + '</a></li></ul></ac:layout-cell></ac:layout-section></ac:layout>',
-                             'representation': 'storage'}}}),
-                     auth=(user, pwd),
-                     headers=({'Content-Type': 'application/json'}))
-    print('                  ')
-    print('       Response:          ')
-    print(r.json())
-    print('                  ')
-    print('------------------------------')
-
-    # Add permissions
-    for entity in reads:
-        addReadPermissions(token, srv, entity, spacekey)
-    for entity in writes:
-        addWritePermissions(token, srv, entity, spacekey)
-    for entity in admins:
-        addAdminPermissions(token, srv, entity, spacekey)
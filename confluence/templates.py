@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Precompiled HTML templates that stream their output fragment by fragment
+
+A template is plain text with ``{name}`` placeholders (``{{`` and ``}}`` for literal braces). It is split into literal
+fragments and placeholder names once, when it is created. Rendering then writes the fragments directly into a file
+handle, so no document is ever assembled as one string in memory.
+"""
+
+from string import Formatter
+
+
+class Template(object):
+
+    def __init__(self, text):
+        """
+        :param text: The template text with {name} placeholders
+        """
+        self._parts = []
+        for literal, name, format_spec, conversion in Formatter().parse(text):
+            if format_spec or conversion:
+                raise ValueError('Template placeholders do not support format specs or conversions: {' + name + '}')
+            self._parts.append((literal, name))
+
+    def fragments(self, **values):
+        """
+        Generate the fragments of the rendered template
+        :param values: A string or an iterable of strings (e.g. a generator or another template's fragments()) for
+                       every placeholder name
+        :return: Generator of strings
+        """
+        for literal, name in self._parts:
+            if literal:
+                yield literal
+            if name is not None:
+                value = values[name]
+                if isinstance(value, str):
+                    yield value
+                else:
+                    for fragment in value:
+                        yield fragment
+
+    def render(self, out, **values):
+        """
+        Write the rendered template into an open text file handle
+        :param out: File handle (anything with a write method)
+        :param values: See fragments()
+        """
+        for fragment in self.fragments(**values):
+            out.write(fragment)
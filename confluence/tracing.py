@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Tracing of the requests made by high-level operations
+
+Within tracing(), every call of a public method of Confluence, Page and Blogpost opens a span, and every request to the
+server is a span within the spans of the calls that made it. Spans count the requests, the bytes sent and received and
+the time of everything within them:
+
+    with tracing() as tracer:
+        blog.publish()
+    tracer.summary()
+    tracer.save('publish.json')
+
+Spans nest within a thread; calls made by worker threads (e.g. of convert_many or audit) are recorded as spans of their
+own. If OpenTelemetry (opentelemetry-api) is installed, all spans are also reported to its current tracer provider. Outside
+of tracing() the only cost of the instrumentation is one check per call.
+"""
+
+import contextlib
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+
+# the active Tracer, see tracing()
+_tracer = None
+_local = threading.local()
+
+
+class Span(object):
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.seconds = None
+        self.requests = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.error = None
+        self.children = []
+
+    def to_dict(self):
+        result = {'name': self.name, 'start': self.start, 'seconds': self.seconds, 'requests': self.requests,
+                  'request_bytes': self.request_bytes, 'response_bytes': self.response_bytes}
+        if self.attributes:
+            result['attributes'] = self.attributes
+        if self.error is not None:
+            result['error'] = self.error
+        if self.children:
+            result['children'] = [child.to_dict() for child in self.children]
+        return result
+
+
+class Tracer(object):
+    """The spans recorded within tracing()"""
+
+    def __init__(self, opentelemetry=None):
+        """
+        :param opentelemetry: OPTIONAL: Report spans to OpenTelemetry. Default: None (if it is installed)
+        """
+        self.opentelemetry = None
+        if opentelemetry or opentelemetry is None:
+            # imported on first use, it is not needed unless tracing
+            try:
+                from opentelemetry import trace as opentelemetry_trace
+            except ImportError:
+                if opentelemetry:
+                    raise ImportError('Reporting spans to OpenTelemetry requires opentelemetry-api')
+            else:
+                self.opentelemetry = opentelemetry_trace.get_tracer('confluence')
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return [recorded.to_dict() for recorded in self.spans]
+
+    def save(self, filename):
+        """Write all spans as JSON to filename"""
+        with open(filename, 'w') as trace_file:
+            json.dump(self.to_dict(), trace_file, indent=1)
+
+    def totals(self):
+        """Provide the calls, requests, bytes and seconds of all spans by name, as dictionary name -> dictionary"""
+        totals = {}
+
+        def add(recorded):
+            total = totals.setdefault(recorded.name, {'calls': 0, 'requests': 0, 'request_bytes': 0,
+                                                  'response_bytes': 0, 'seconds': 0.})
+            total['calls'] += 1
+            total['requests'] += recorded.requests
+            total['request_bytes'] += recorded.request_bytes
+            total['response_bytes'] += recorded.response_bytes
+            total['seconds'] += recorded.seconds or 0.
+            for child in recorded.children:
+                add(child)
+        with self._lock:
+            for recorded in self.spans:
+                add(recorded)
+        return totals
+
+    def summary(self, out=sys.stdout):
+        """Print the totals of all spans by name, slowest first"""
+        out.write('{:<60} {:>6} {:>9} {:>11} {:>11} {:>9}\n'.format('span', 'calls', 'requests', 'sent', 'received',
+                                                                     'seconds'))
+        for name, total in sorted(self.totals().items(), key=lambda item: -item[1]['seconds']):
+            out.write('{:<60} {:>6d} {:>9d} {:>11d} {:>11d} {:>9.3f}\n'.format(
+                name[:60], total['calls'], total['requests'], total['request_bytes'], total['response_bytes'],
+                total['seconds']))
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def tracer():
+    """Provide the active Tracer, or None outside of tracing()"""
+    return _tracer
+
+
+@contextlib.contextmanager
+def tracing(opentelemetry=None):
+    """
+    Trace all operations within the with block, in all threads
+    :param opentelemetry: OPTIONAL: Report spans to OpenTelemetry. Default: None (if it is installed)
+    :return: The Tracer, as target of the with statement
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = Tracer(opentelemetry)
+    try:
+        yield _tracer
+    finally:
+        _tracer = previous
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record the operations within the with block as a span, if tracing is active"""
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    new = Span(name, attributes)
+    stack = _stack()
+    if stack:
+        stack[-1].children.append(new)
+    else:
+        with tracer._lock:
+            tracer.spans.append(new)
+    stack.append(new)
+    start = time.perf_counter()
+    with contextlib.ExitStack() as exits:
+        otel_span = None
+        if tracer.opentelemetry is not None:
+            otel_span = exits.enter_context(tracer.opentelemetry.start_as_current_span(name, attributes=attributes))
+        try:
+            yield new
+        except Exception as e:
+            new.error = type(e).__name__ + ': ' + str(e)
+            raise
+        finally:
+            new.seconds = time.perf_counter() - start
+            stack.pop()
+            if otel_span is not None:
+                otel_span.set_attribute('confluence.requests', new.requests)
+                otel_span.set_attribute('confluence.request_bytes', new.request_bytes)
+                otel_span.set_attribute('confluence.response_bytes', new.response_bytes)
+
+
+def request(name, request_bytes, response_bytes, seconds):
+    """Record a request to the server, as span within the current spans, if tracing is active
+    :param name: The request, e.g. GET rest/api/content/{id}
+    """
+    if _tracer is None:
+        return
+    with span(name) as new:
+        pass
+    new.seconds = seconds
+    new.start -= seconds
+    for parent in _stack() + [new]:
+        parent.requests += 1
+        parent.request_bytes += request_bytes
+        parent.response_bytes += response_bytes
+
+
+def traced(function):
+    """Decorator recording every call of function as a span named by its qualified name"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _tracer is None:
+            return function(*args, **kwargs)
+        with span(function.__qualname__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def traced_methods(cls):
+    """Class decorator applying traced to all public methods defined in the class itself; static and class methods,
+    properties and generators are left alone, as the span of a generator would end before it is consumed; the requests
+    of a generator count to the spans enclosing its consumer"""
+    for name, member in list(vars(cls).items()):
+        if (name.startswith('_') or not inspect.isfunction(member) or inspect.isgeneratorfunction(member)):
+            continue
+        setattr(cls, name, traced(member))
+    return cls
@@ -40,9 +40,16 @@ setup(name="py-confluence",
       long_description    = long_description,
       license             = "GPL",
       packages            = ['confluence'],
-      scripts             = ['bin/confluence_clone-space',
+      scripts             = ['bin/confluence_archive',
+                             'bin/confluence_audit-restrictions',
+                             'bin/confluence_clone-space',
                              'bin/confluence_create-CMI-space',
                              'bin/confluence_example_create_blog',
+                             'bin/confluence_export-pdf',
+                             'bin/confluence_mirror-spaces',
+                             'bin/confluence_provision-spaces',
+                             'bin/confluence_purge',
+                             'bin/confluence_search',
                              'bin/confluence_upload_evernote'],
       install_requires    = ['requests>=2.21.0',
                              'six>=1.12.0',
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; fill-column: 120 -*-
+
+__doc__ = """Replay of recorded traces of streamed downloads, see confluence.recording"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from confluence.confluence import Confluence  # noqa: E402
+from confluence.fakeserver import FakeConfluence  # noqa: E402
+from confluence.recording import ReplayMismatch, Trace, record, replay  # noqa: E402
+
+# the url of replayed clients, traces do not depend on the recorded server
+REPLAY_URL = 'https://confluence.invalid/'
+
+
+class ReplayDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fake = FakeConfluence(pages=2, blogs=0, attachments=1, attachment_size=200000).start()
+        self.confluence = Confluence('record', 'record', url=self.fake.url)
+        page = next(content for content in self.fake.contents.values() if content['type'] == 'page')
+        attachment = next(content for content in self.fake.contents.values() if content['type'] == 'attachment'
+                          and content['container'] == page['id'])
+        self.page_id = page['id']
+        self.data = attachment['data']
+        self.path = 'download/attachments/' + page['id'] + '/' + attachment['title']
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def recorded(self, operation):
+        """Record operation(confluence) and provide the trace as saved and loaded again"""
+        with record(self.confluence) as trace:
+            operation(self.confluence)
+        filename = os.path.join(self.directory, 'trace.json')
+        trace.save(filename)
+        return Trace.load(filename)
+
+    def test_download(self):
+        recorded = os.path.join(self.directory, 'recorded.bin')
+        trace = self.recorded(lambda confluence: confluence.download(self.path, recorded))
+        replayed = os.path.join(self.directory, 'replayed.bin')
+        confluence = Confluence('replay', 'replay', url=REPLAY_URL)
+        with replay(confluence, trace):
+            written = confluence.download(self.path, replayed, chunk_size=4096)
+        self.assertEqual(written, len(self.data))
+        with open(replayed, 'rb') as replayed_file:
+            self.assertEqual(replayed_file.read(), self.data)
+        self.assertEqual(trace.entries[0]['response_bytes'], len(self.data))
+
+    def test_export_content_as_pdf(self):
+        trace = self.recorded(lambda confluence: confluence.export_content_as_pdf(
+            self.page_id, os.path.join(self.directory, 'recorded.pdf')))
+        replayed = os.path.join(self.directory, 'replayed.pdf')
+        confluence = Confluence('replay', 'replay', url=REPLAY_URL)
+        with replay(confluence, trace):
+            confluence.export_content_as_pdf(self.page_id, replayed)
+        with open(replayed, 'rb') as replayed_file:
+            self.assertTrue(replayed_file.read().startswith(b'%PDF'))
+
+    def test_missing_download(self):
+        missing = 'download/attachments/' + self.page_id + '/missing.bin'
+        filename = os.path.join(self.directory, 'missing.bin')
+
+        def download(confluence):
+            with self.assertRaises(requests.HTTPError):
+                confluence.download(missing, filename)
+
+        trace = self.recorded(download)
+        confluence = Confluence('replay', 'replay', url=REPLAY_URL)
+        with replay(confluence, trace):
+            download(confluence)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_other_download(self):
+        trace = self.recorded(lambda confluence: confluence.download(self.path, os.path.join(self.directory, 'a')))
+        confluence = Confluence('replay', 'replay', url=REPLAY_URL)
+        with self.assertRaises(ReplayMismatch):
+            with replay(confluence, trace):
+                confluence.download(self.path + '.other', os.path.join(self.directory, 'b'))
+
+
+if __name__ == '__main__':
+    unittest.main()